@@ -1,4 +1,5 @@
 # -*- coding: utf8 -*-
 
 
-from .core import __doc__, Announcement, Announcer
+from .core import __doc__, Announcement, SlottedAnnouncement, Announcer, \
+        StopPropagation
@@ -0,0 +1,255 @@
+# -*- coding: utf8 -*-
+
+"""This module implements AsyncAnnouncer, an Announcer for asyncio programs.
+Subscribers can be coroutine functions, or any callable returning an
+awaitable, taking zero, one or two arguments as usual. Requires Python 3.
+
+    >>> async def changed(announcement):
+    ...     await store(announcement)
+    >>> announcer = AsyncAnnouncer(concurrency=10)
+    >>> announcer.on(Changed, do=changed)
+    >>> await announcer.announce(Changed)
+
+AsyncAnnouncementStream reads the announcements of any announcer from
+asyncio code:
+
+    >>> async with announcer.asyncStream(Changed) as changes:
+    ...     async for change in changes:
+    ...         await store(change)
+
+"""
+
+import asyncio
+import collections
+import inspect
+
+from . import core
+from . import stream
+
+
+class AsyncAnnouncer(core.Announcer):
+    """An announcer whose announce answers an awaitable. Plain subscribers are
+    still called inline while announcing, the awaitables answered by the
+    others are run as tasks, at most concurrency at a time for each announce
+    (None means no limit.) As in Announcer, everyone is delivered and then the
+    last error not in ignored_exceptions is raised, this time when awaiting.
+    StopPropagation skips the subscribers after the one raising it only while
+    calling them, the tasks already started keep running.
+
+    """
+    def __init__(self, concurrency=None):
+        super(AsyncAnnouncer, self).__init__()
+        if concurrency is not None and concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+
+    def announce(self, announcement):
+        """Deliver announcement and answer a future resolved to it once every
+        subscriber is done
+
+        """
+        announcement = announcement.asAnnouncement(announcement)
+        delivery = self.newDelivery()
+        delivery.deliver(announcement,
+                self.subscriptionsTo(announcement))
+        return delivery.start(announcement)
+
+    def announceLazily(self, announcementClass, factory):
+        """See Announcer.announceLazily, the future is resolved to None if
+        factory wasn't called
+
+        """
+        if not self.hasSubscribersFor(announcementClass):
+            return self.newDelivery().start(None)
+        return self.announce(factory())
+
+    def announceAll(self, announcements):
+        """Deliver every announcement and answer a future resolved to their
+        number once every subscriber is done. The concurrency limit applies to
+        the whole batch.
+
+        """
+        delivery = self.newDelivery()
+        subscriptionsTo = self.chain.subscriptionsTo if self.parents \
+                else self.registry.subscriptionsTo
+        count = 0
+        for announcement in announcements:
+            announcement = announcement.asAnnouncement(announcement)
+            delivery.deliver(announcement,
+                    subscriptionsTo(announcement))
+            count += 1
+        return delivery.start(count)
+
+    def newDelivery(self):
+        return AsyncDelivery(asyncio.get_event_loop(), self.concurrency,
+                tuple(self.ignored_exceptions))
+
+
+class AsyncDelivery(object):
+    """Deliver announcements and run the awaitables answered by subscribers,
+    resolving a future when all of them are done. Cancelling the future
+    cancels what is still running.
+
+    """
+    def __init__(self, loop, concurrency, exceptions_that_are_ok):
+        super(AsyncDelivery, self).__init__()
+        self.loop = loop
+        self.concurrency = concurrency
+        self.exceptions_that_are_ok = exceptions_that_are_ok
+        self.pending = collections.deque()
+        self.running = set()
+        self.error = None
+        self.result = None
+        self.future = None
+
+    def deliver(self, announcement, subscriptions):
+        for subscription in subscriptions:
+            try:
+                awaitable = subscription.basicDeliver(announcement)
+            except core.StopPropagation:
+                break
+            except Exception as err:
+                self.failed(err)
+            else:
+                if awaitable is not None and inspect.isawaitable(awaitable):
+                    self.pending.append(awaitable)
+
+    def start(self, result):
+        """Start running the awaitables and answer the future
+
+        """
+        self.result = result
+        self.future = self.loop.create_future()
+        self.future.add_done_callback(self.finished)
+        self.schedule()
+        return self.future
+
+    def schedule(self):
+        while self.pending and (self.concurrency is None or
+                len(self.running) < self.concurrency):
+            task = asyncio.ensure_future(self.pending.popleft(), loop=self.loop)
+            self.running.add(task)
+            task.add_done_callback(self.done)
+        if not self.running and not self.future.done():
+            if self.error is not None:
+                self.future.set_exception(self.error)
+            else:
+                self.future.set_result(self.result)
+
+    def done(self, task):
+        self.running.discard(task)
+        if task.cancelled():
+            if not self.future.done():
+                self.failed(asyncio.CancelledError())
+        elif task.exception() is not None:
+            self.failed(task.exception())
+        if not self.future.done():
+            self.schedule()
+
+    def failed(self, error):
+        if not isinstance(error, (core.StopPropagation,) +
+                self.exceptions_that_are_ok):
+            self.error = error
+
+    def finished(self, future):
+        """If the future was cancelled, cancel what is running and discard
+        what didn't start
+
+        """
+        if future.cancelled():
+            for task in list(self.running):
+                task.cancel()
+            while self.pending:
+                awaitable = self.pending.popleft()
+                if inspect.iscoroutine(awaitable):
+                    awaitable.close()
+
+
+class AsyncAnnouncementStream(stream.AnnouncementStream):
+    """An AnnouncementStream read with async for, and async with, from the
+    tasks of loop. Announcements can be made from any thread. The BLOCK
+    overflow policy is not supported, it could block the loop.
+
+    """
+    def __init__(self, announcer, announcementClass=core.Announcement,
+            maxsize=1024, overflow=stream.DROP_OLDEST, where=None, loop=None):
+        if overflow == stream.BLOCK:
+            raise ValueError("%s can't block announcers" % (
+                type(self).__name__,))
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.waiters = []
+        super(AsyncAnnouncementStream, self).__init__(announcer,
+                announcementClass, maxsize, overflow, where)
+
+    def __aenter__(self):
+        return self.resolved(self)
+
+    def __aexit__(self, *excinfo):
+        self.close()
+        return self.resolved(None)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self.loop.create_future()
+        self.fill(future, self.takeNext)
+        return future
+
+    def resolved(self, result):
+        future = self.loop.create_future()
+        future.set_result(result)
+        return future
+
+    def arrived(self):
+        """Wake the waiting tasks up, in the thread of the loop
+
+        """
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            self.loop.call_soon_threadsafe(self.release, waiter)
+
+    @staticmethod
+    def release(waiter, result=None):
+        if not waiter.done():
+            waiter.set_result(result)
+
+    def takeNext(self):
+        if not self.buffer:
+            raise StopAsyncIteration()
+        return self.buffer.popleft()
+
+    def fill(self, future, take):
+        """Resolve future to what take answers, with the lock held, once
+        announcements are buffered or the stream is closed
+
+        """
+        def ready(woken=None):
+            if future.done():
+                return
+            with self.lock:
+                if not (self.buffer or self.closed):
+                    waiter = self.loop.create_future()
+                    self.waiters.append(waiter)
+                else:
+                    waiter = None
+                    try:
+                        future.set_result(take())
+                    except StopAsyncIteration as err:
+                        future.set_exception(err)
+            if waiter is not None:
+                waiter.add_done_callback(ready)
+
+        ready()
+
+    def nextBatch(self, count, timeout=None):
+        """Answer a future resolved to up to count announcements, see
+        AnnouncementStream.nextBatch
+
+        """
+        future = self.loop.create_future()
+        self.fill(future, lambda: self.takeBatch(count))
+        if timeout is not None and not future.done():
+            expiry = self.loop.call_later(timeout, self.release, future, [])
+            future.add_done_callback(lambda future: expiry.cancel())
+        return future
@@ -0,0 +1,700 @@
+# -*- coding: utf8 -*-
+
+"""Benchmarks for Python-Announcements. Run them with:
+
+    python -m announcements.benchmarks [--quick] [--output results.json]
+        [--compare previous.json]
+
+Every benchmark reports operations per second, the percentiles of the
+latency of a single operation (measured in small batches) and, where
+tracemalloc is available, the bytes allocated and the memory blocks retained
+per operation. Results are saved as JSON so runs of different versions can be
+compared with --compare. The contention benchmarks are most telling on a
+free-threaded build, whether the GIL was enabled is saved with the results.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+from .core import Announcement, AnnouncementSet, AnnouncementSubscription, \
+        Announcer, SlottedAnnouncement
+from .sharded import ShardedSubscriptionRegistry
+from .journal import AnnouncementJournal, records
+
+
+class BenchmarkAnnouncement(Announcement):
+    pass
+
+
+def hierarchy(depth):
+    """Answer a chain of depth Announcement subclasses, the deepest last
+
+    """
+    classes = [BenchmarkAnnouncement]
+    for level in range(1, depth):
+        classes.append(type("Level%d" % level, (classes[-1],), {}))
+    return classes
+
+
+def family(width):
+    """Answer width unrelated Announcement subclasses
+
+    """
+    return [type("Member%d" % each, (BenchmarkAnnouncement,), {})
+            for each in range(width)]
+
+
+class Receiver(object):
+
+    def zero(self):
+        pass
+
+    def one(self, announcement):
+        pass
+
+    def two(self, announcement, announcer):
+        pass
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(operation, number=20000, batch=20):
+    """Time number calls to operation, in batches of batch calls. Answer a
+    dict with the throughput and the latency percentiles in microseconds.
+
+    """
+    timer = timeit.default_timer
+    for each in range(min(number, 1000)):
+        operation()
+    latencies = []
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timer()
+        for each in range(number // batch):
+            batchStart = timer()
+            for call in range(batch):
+                operation()
+            latencies.append((timer() - batchStart) / batch)
+        elapsed = timer() - start
+    finally:
+        if gcEnabled:
+            gc.enable()
+    result = {
+        "opsPerSecond": len(latencies) * batch / elapsed,
+        "p50": percentile(latencies, 0.5) * 1e6,
+        "p90": percentile(latencies, 0.9) * 1e6,
+        "p99": percentile(latencies, 0.99) * 1e6,
+    }
+    result.update(allocations(operation))
+    return result
+
+
+def allocations(operation, number=200):
+    """Answer the bytes allocated (peak over the call) and the blocks retained
+    per call to operation, None when tracemalloc is not available
+
+    """
+    if tracemalloc is None or not hasattr(tracemalloc, "reset_peak"):
+        return {"allocatedBytes": None, "retainedBlocks": None}
+    tracemalloc.start()
+    try:
+        peaks = []
+        for each in range(number):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            operation()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        blocks = sys.getallocatedblocks()
+        for each in range(number):
+            operation()
+        retained = sys.getallocatedblocks() - blocks
+    finally:
+        tracemalloc.stop()
+    return {"allocatedBytes": float(sum(peaks)) / number,
+            "retainedBlocks": float(retained) / number}
+
+
+def measureThreads(operation, threads, number):
+    """Run operation number times in each of threads threads at once, answer
+    the total throughput
+
+    """
+    barrier = threading.Event()
+
+    def work():
+        barrier.wait()
+        for each in range(number):
+            operation()
+
+    workers = [threading.Thread(target=work) for each in range(threads)]
+    for worker in workers:
+        worker.start()
+    start = timeit.default_timer()
+    barrier.set()
+    for worker in workers:
+        worker.join()
+    elapsed = timeit.default_timer() - start
+    return {"opsPerSecond": threads * number / elapsed}
+
+
+def subscribed(count, announcementClass=BenchmarkAnnouncement, arity=1,
+        weak=False):
+    """Answer an announcer with count subscribers of the given arity to
+    announcementClass, and the receivers so weak subscriptions stay alive
+
+    """
+    announcer = Announcer()
+    receivers = [Receiver() for each in range(count)]
+    selector = ("zero", "one", "two")[arity]
+    for receiver in receivers:
+        subscription = announcer.subscribe(announcementClass, send=selector,
+                to=receiver)
+        if weak:
+            subscription.makeWeak()
+    return announcer, receivers
+
+
+def benchAnnounceSubscribers(counts, number):
+    for count in counts:
+        announcer, receivers = subscribed(count)
+        announcement = BenchmarkAnnouncement()
+        yield ({"benchmark": "announce", "subscribers": count},
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchAnnounceUnobserved(counts, number):
+    """Announce a class nobody subscribed to, on an announcer with count
+    subscriptions to other classes. The announcement is built beforehand, by
+    announce, or by a factory announceLazily never calls.
+
+    """
+    unobserved = type("Unobserved", (Announcement,), {})
+    for count in counts:
+        announcer, receivers = subscribed(count)
+        announcement = unobserved()
+        yield ({"benchmark": "announce-unobserved", "subscribers": count},
+                measure(lambda: announcer.announce(announcement), number))
+        yield ({"benchmark": "announce-unobserved", "build": "class",
+            "subscribers": count},
+            measure(lambda: announcer.announce(unobserved), number))
+        yield ({"benchmark": "announce-unobserved", "build": "factory",
+            "subscribers": count},
+            measure(lambda: announcer.announceLazily(unobserved, unobserved),
+                number))
+
+
+def benchAnnounceFiltered(counts, number):
+    """Announce to count subscribers filtering on an attribute, only one of
+    them matches
+
+    """
+    for count in counts:
+        announcer = Announcer()
+        receivers = [Receiver() for each in range(count)]
+        for key, receiver in enumerate(receivers):
+            announcer.subscribe(BenchmarkAnnouncement, send="one", to=receiver,
+                    where={"key": key})
+        announcement = BenchmarkAnnouncement()
+        announcement.key = 0
+        yield ({"benchmark": "announce-filtered", "subscribers": count},
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchAnnounceDepth(depths, number):
+    for depth in depths:
+        classes = hierarchy(depth)
+        announcer, receivers = subscribed(10, classes[0])
+        announcement = classes[-1]()
+        yield ({"benchmark": "announce", "depth": depth, "subscribers": 10},
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchForwarding(depths, number):
+    """Announce with the leaf of a chain of depth announcers, 10 subscribers
+    each, relaying by subscribing announce to the next one or forwarding to
+    it
+
+    """
+    for depth in depths:
+        for mode in ("relay", "forward"):
+            chain = [subscribed(10) for each in range(depth)]
+            for (child, receivers), (parent, others) in zip(chain, chain[1:]):
+                if mode == "relay":
+                    child.subscribe(Announcement, send="announce", to=parent)
+                else:
+                    child.forwardTo(parent)
+            announcer = chain[0][0]
+            announcement = BenchmarkAnnouncement()
+            yield ({"benchmark": "announce-chain", "mode": mode,
+                "depth": depth, "subscribers": 10 * depth},
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchAnnounceSetWidth(widths, number):
+    for width in widths:
+        members = family(width)
+        announcementSet = AnnouncementSet(*members)
+        announcer, receivers = subscribed(10, announcementSet)
+        announcement = members[-1]()
+        yield ({"benchmark": "announce-set", "width": width,
+            "subscribers": 10},
+            measure(lambda: announcer.announce(announcement), number))
+        yield ({"benchmark": "set-handles", "width": width},
+                measure(lambda: announcementSet.handles(members[-1]), number))
+
+
+def benchAnnounceArity(number):
+    for arity in (0, 1, 2):
+        announcer, receivers = subscribed(10, arity=arity)
+        announcement = BenchmarkAnnouncement()
+        yield ({"benchmark": "announce", "arity": arity, "subscribers": 10},
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchAnnouncePriority(number):
+    """Delivering to prioritized subscriptions should cost as much as to
+    unprioritized ones, the order is resolved once
+
+    """
+    for prioritized in (False, True):
+        announcer = Announcer()
+        receivers = [Receiver() for each in range(10)]
+        for priority, receiver in enumerate(receivers):
+            announcer.subscribe(BenchmarkAnnouncement, send="one", to=receiver,
+                    priority=-priority if prioritized else 0)
+        announcement = BenchmarkAnnouncement()
+        yield ({"benchmark": "announce", "prioritized": prioritized,
+            "subscribers": 10},
+            measure(lambda: announcer.announce(announcement), number))
+
+
+def benchAnnounceLimited(number):
+    """Announce to 10 subscribers without limits, with a rate limit they
+    stay under and with a sample of a tenth of the announcements
+
+    """
+    announcement = BenchmarkAnnouncement()
+    for limit in ({}, {"rate": 1e12}, {"sample": 0.1}):
+        announcer = Announcer()
+        receivers = [Receiver() for each in range(10)]
+        for receiver in receivers:
+            announcer.subscribe(BenchmarkAnnouncement, send="one",
+                    to=receiver, **limit)
+        parameters = {"benchmark": "announce-limited", "subscribers": 10,
+                "limit": "none"}
+        parameters.update(limit)
+        if limit:
+            del parameters["limit"]
+        yield (parameters,
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchStream(number):
+    """Announce to a stream and read the announcement back, one at a time
+    and in batches of 100
+
+    """
+    announcer = Announcer()
+    announcement = BenchmarkAnnouncement()
+    with announcer.stream(BenchmarkAnnouncement) as stream:
+
+        def one():
+            announcer.announce(announcement)
+            next(stream)
+
+        def batch():
+            for each in range(100):
+                announcer.announce(announcement)
+            stream.nextBatch(100)
+
+        yield ({"benchmark": "stream", "batch": 1}, measure(one, number))
+        # Per announcement, like the others
+        measures = measure(batch, number // 100 or 1, batch=1)
+        for key, value in measures.items():
+            if value is not None and key != "retainedBlocks":
+                measures[key] = value * 100 if key == "opsPerSecond" \
+                        else value / 100
+        yield ({"benchmark": "stream", "batch": 100}, measures)
+
+
+def benchAnnounceWeak(number):
+    for weak in (False, True):
+        announcer, receivers = subscribed(10, weak=weak)
+        announcement = BenchmarkAnnouncement()
+        yield ({"benchmark": "announce", "weak": weak, "subscribers": 10},
+                measure(lambda: announcer.announce(announcement), number))
+
+
+def benchAnnounceThreads(threadCounts, number):
+    for threads in threadCounts:
+        announcer, receivers = subscribed(10)
+        announcement = BenchmarkAnnouncement()
+        yield ({"benchmark": "announce", "threads": threads,
+            "subscribers": 10},
+            measureThreads(lambda: announcer.announce(announcement), threads,
+                number // threads))
+
+
+def benchContention(threadCounts, number):
+    """Threads each subscribing to their own class, announcing it and
+    unsubscribing, with the single lock of a SubscriptionRegistry or with a
+    ShardedSubscriptionRegistry
+
+    """
+    for sharded in (False, True):
+        for threads in threadCounts:
+            announcer = Announcer(registry=ShardedSubscriptionRegistry()
+                    if sharded else None)
+            local = threading.local()
+
+            def churn():
+                try:
+                    cls, receiver = local.cls, local.receiver
+                except AttributeError:
+                    cls = local.cls = type("Contended",
+                            (BenchmarkAnnouncement,), {})
+                    receiver = local.receiver = Receiver()
+                subscription = announcer.subscribe(cls, send="one",
+                        to=receiver)
+                announcer.announce(cls)
+                announcer.removeSubscription(subscription)
+
+            yield ({"benchmark": "contention", "sharded": sharded,
+                "threads": threads},
+                measureThreads(churn, threads, number // 10))
+
+
+def benchSubscriptions(counts, number):
+    """Subscribe and unsubscribe, or make weak and strong again, one receiver
+    on an announcer with count subscriptions
+
+    """
+    for count in counts:
+        announcer, receivers = subscribed(count)
+        receiver = Receiver()
+
+        def subscribeUnsubscribe():
+            announcer.subscribe(BenchmarkAnnouncement, send="one", to=receiver)
+            announcer.unsubscribe(receiver)
+
+        current = [announcer.subscribe(BenchmarkAnnouncement, send="one",
+            to=Receiver())]
+
+        def weakStrong():
+            current[0] = current[0].makeWeak().makeStrong()
+
+        yield ({"benchmark": "subscribe-unsubscribe", "subscribers": count},
+                measure(subscribeUnsubscribe, number // 10, batch=1))
+        yield ({"benchmark": "makeWeak-makeStrong", "subscribers": count},
+                measure(weakStrong, number // 10, batch=1))
+
+
+def benchBulkSubscriptions(counts):
+    """Subscribe count receivers one by one, then unsubscribe them one by
+    one, the time per subscription should not grow with count
+
+    """
+    timer = timeit.default_timer
+    for count in counts:
+        announcer = Announcer()
+        receivers = [Receiver() for each in range(count)]
+        start = timer()
+        for receiver in receivers:
+            announcer.subscribe(BenchmarkAnnouncement, send="one", to=receiver)
+        added = timer()
+        announcer.announce(BenchmarkAnnouncement)
+        unsubscribing = timer()
+        for receiver in receivers:
+            announcer.unsubscribe(receiver)
+        end = timer()
+        yield ({"benchmark": "bulk-subscribe", "subscribers": count},
+                {"opsPerSecond": count / (added - start)})
+        yield ({"benchmark": "bulk-unsubscribe", "subscribers": count},
+                {"opsPerSecond": count / (end - unsubscribing)})
+
+
+class PayloadAnnouncement(BenchmarkAnnouncement):
+
+    def __init__(self, order=None, amount=None):
+        super(PayloadAnnouncement, self).__init__()
+        self.order = order
+        self.amount = amount
+
+
+class SlottedPayloadAnnouncement(SlottedAnnouncement):
+    __slots__ = ("order", "amount")
+
+
+def memoryPer(create, number):
+    """Answer the bytes retained per object by number calls to create, None
+    when tracemalloc is not available
+
+    """
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [create() for each in range(number)]
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del objects
+    return float(retained) / number
+
+
+def benchMemory(number):
+    """Bytes per subscription, alone and in a registry, and per announcement
+    carrying two values in a dictionary or in slots
+
+    """
+    announcer = Announcer()
+    receivers = [Receiver() for each in range(number)]
+    iterator = iter(receivers)
+
+    def subscription():
+        subscription = AnnouncementSubscription()
+        subscription.announcer = announcer
+        subscription.announcementClass = BenchmarkAnnouncement
+        subscription.subscriber = receiver = next(iterator)
+        subscription.action = receiver.one
+        return subscription
+
+    yield ({"benchmark": "memory", "object": "subscription"},
+            {"bytesPer": memoryPer(subscription, number)})
+    for weak in (False, True):
+        iterator = iter(receivers)
+
+        def subscribe():
+            subscription = announcer.subscribe(BenchmarkAnnouncement,
+                    send="one", to=next(iterator))
+            if weak:
+                subscription.makeWeak()
+
+        announcer.registry.reset()
+        yield ({"benchmark": "memory", "object": "registered", "weak": weak},
+                {"bytesPer": memoryPer(subscribe, number)})
+    for cls in (PayloadAnnouncement, SlottedPayloadAnnouncement):
+        yield ({"benchmark": "memory", "object": cls.__name__},
+                {"bytesPer": memoryPer(lambda: cls(order=1, amount=2),
+                    number)})
+        announcer, receivers = subscribed(1)
+        yield ({"benchmark": "announce-new", "object": cls.__name__},
+                measure(lambda: announcer.announce(cls(order=1, amount=2)),
+                    number))
+
+
+def benchJournal(number):
+    """Record announcements in a journal, writing them from the announcing
+    thread or from a background one, and read them back, decoding all of
+    them or skipping all of them
+
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        announcement = SlottedPayloadAnnouncement(order=1, amount=2)
+        count = 0
+        for interval in (None, 0.01):
+            journal = AnnouncementJournal(directory, interval=interval)
+            yield ({"benchmark": "journal-record",
+                "background": interval is not None},
+                measure(lambda: journal.record(announcement), number))
+            journal.close()
+            count += journal.recorded
+        for types in (None, (PayloadAnnouncement,)):
+            start = timeit.default_timer()
+            for record in records(directory, types=types):
+                pass
+            elapsed = timeit.default_timer() - start
+            yield ({"benchmark": "journal-read",
+                "skipped": types is not None},
+                {"opsPerSecond": count / elapsed})
+    finally:
+        shutil.rmtree(directory)
+
+
+def legacyDeliver(subscription, announcement):
+    """Delivery as it was done before resolving the arity at subscribe time:
+    inspect the action on every call
+
+    """
+    if subscription.handles(type(announcement)):
+        argumentsCount = subscription.getArgumentsCount()
+        if argumentsCount == 0:
+            subscription.action()
+        elif argumentsCount == 1:
+            subscription.action(announcement)
+        elif argumentsCount == 2:
+            subscription.action(announcement, subscription.announcer)
+
+
+def benchArity(number=100000):
+    """Compare the cost of a delivery inspecting the action every time against
+    the invoker resolved at subscribe time, for each supported arity
+
+    """
+    actions = [
+        ("0 arguments", lambda: None),
+        ("1 argument", lambda ann: None),
+        ("2 arguments", lambda ann, announcer: None),
+    ]
+    announcement = BenchmarkAnnouncement()
+    results = []
+    for name, action in actions:
+        subscription = Announcer().on(BenchmarkAnnouncement, do=action)
+        legacy = min(timeit.repeat(
+            lambda: legacyDeliver(subscription, announcement),
+            number=number, repeat=3))
+        resolved = min(timeit.repeat(
+            lambda: subscription.deliver(announcement),
+            number=number, repeat=3))
+        results.append((name, legacy / number, resolved / number))
+    return results
+
+
+def suite(quick=False):
+    """Answer the generators of (parameters, measures) making the suite
+
+    """
+    number = 2000 if quick else 20000
+    counts = (1, 10, 100) if quick else (1, 10, 100, 1000)
+    return [
+        benchAnnounceSubscribers(counts, number),
+        benchAnnounceUnobserved(counts, number),
+        benchAnnounceFiltered(counts, number),
+        benchAnnounceDepth((1, 4) if quick else (1, 4, 16), number),
+        benchForwarding((2, 4) if quick else (2, 4, 8), number),
+        benchAnnounceSetWidth((1, 8) if quick else (1, 8, 64), number),
+        benchAnnounceArity(number),
+        benchAnnouncePriority(number),
+        benchAnnounceLimited(number),
+        benchAnnounceWeak(number),
+        benchStream(number),
+        benchAnnounceThreads((1, 2) if quick else (1, 2, 4, 8), number),
+        benchContention((1, 2) if quick else (1, 2, 4, 8), number),
+        benchSubscriptions(counts, number),
+        benchBulkSubscriptions((1000, 4000) if quick else (1000, 4000, 16000)),
+        benchMemory(number // 2),
+        benchJournal(number),
+    ]
+
+
+def run(quick=False, report=None):
+    results = []
+    for benchmark in suite(quick):
+        for parameters, measures in benchmark:
+            result = dict(parameters, **measures)
+            results.append(result)
+            if report is not None:
+                report(result)
+    return {
+        "python": platform.python_implementation(),
+        "version": platform.python_version(),
+        "gil": getattr(sys, "_is_gil_enabled", lambda: True)(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def keyOf(result):
+    return tuple(sorted((name, value) for name, value in result.items()
+        if name not in MEASURES))
+
+
+MEASURES = ("opsPerSecond", "p50", "p90", "p99", "allocatedBytes",
+        "retainedBlocks", "bytesPer")
+
+
+def describe(result):
+    parameters = ", ".join("%s=%s" % (name, value) for name, value
+            in keyOf(result) if name != "benchmark")
+    line = "%-22s %-32s" % (result["benchmark"], parameters)
+    if "bytesPer" in result:
+        if result["bytesPer"] is None:
+            return line + " %12s bytes each" % "n/a"
+        return line + " %12.1f bytes each" % result["bytesPer"]
+    line += " %12.0f ops/s" % result["opsPerSecond"]
+    if "p50" in result:
+        line += "  p50 %7.2f  p90 %7.2f  p99 %7.2f usec" % (result["p50"],
+                result["p90"], result["p99"])
+    if result.get("allocatedBytes") is not None:
+        line += "  %6.0f B  %5.2f blocks" % (result["allocatedBytes"],
+                result["retainedBlocks"])
+    return line
+
+
+def compare(previous, current):
+    """Answer a line for every benchmark in both runs, with the ratio of their
+    throughputs
+
+    """
+    before = dict((keyOf(result), result) for result in previous["results"])
+    lines = []
+    for result in current["results"]:
+        old = before.get(keyOf(result))
+        if old is None:
+            continue
+        measure = "bytesPer" if "bytesPer" in result else "opsPerSecond"
+        if not (result[measure] and old[measure]):
+            continue
+        lines.append("%s  x%.2f" % (describe(result),
+            result[measure] / old[measure]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--quick", action="store_true",
+            help="fewer iterations and a smaller sweep")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare",
+            help="compare against the results saved in this JSON file")
+    parser.add_argument("--arity", action="store_true",
+            help="only compare resolved and inspected arity")
+    options = parser.parse_args(argv)
+
+    if options.arity:
+        print("Per delivery cost (usec)")
+        print("%-12s %10s %10s %8s" % ("arity", "inspected", "resolved",
+            "speedup"))
+        for name, legacy, resolved in benchArity():
+            print("%-12s %10.3f %10.3f %7.1fx" % (name, legacy * 1e6,
+                resolved * 1e6, legacy / resolved))
+        return
+
+    results = run(options.quick, lambda result: print(describe(result)))
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as previous:
+            previous = json.load(previous)
+        print("")
+        print("Compared to %s" % options.compare)
+        for line in compare(previous, results):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# -*- coding: utf8 -*-
+
+"""This module implements CircuitBreaker, suspending the subscriptions of an
+Announcer that keep failing or keep taking too long.
+
+    >>> breaker = announcer.protect(CircuitBreaker(maxFailures=3, budget=0.01,
+    ...     cooldown=60))
+    >>> announcer.on(SubscriptionSuspended, do=alert)
+
+A suspended subscription is skipped until cooldown seconds have passed, then
+it is given one more delivery: if it goes well it is resumed, otherwise it is
+suspended again. Both are announced by the announcer of the subscription.
+Like Instrumentation, installing replaces the delivery loop of the registry.
+
+"""
+
+import sys
+import threading
+import timeit
+import weakref
+
+from . import core
+
+
+class SubscriptionSuspended(core.SlottedAnnouncement):
+    """A CircuitBreaker suspended subscription until the until time of its
+    timer. reason is "failures" or "latency", error the last exception raised
+    by the subscriber, if any.
+
+    """
+    __slots__ = ("subscription", "reason", "error", "until")
+
+
+class SubscriptionResumed(core.SlottedAnnouncement):
+    """A CircuitBreaker delivers to subscription again
+
+    """
+    __slots__ = ("subscription",)
+
+
+class DeliveryErrors(Exception):
+    """Raised by announce when several subscribers failed. errors are their
+    exceptions, excinfos their sys.exc_info() tuples, in delivery order.
+
+    """
+    def __init__(self, excinfos):
+        super(DeliveryErrors, self).__init__("%d subscribers failed: %s" % (
+            len(excinfos), ", ".join(repr(excinfo[1])
+                for excinfo in excinfos)))
+        self.excinfos = excinfos
+        self.errors = [excinfo[1] for excinfo in excinfos]
+
+
+class CircuitState(object):
+    """What a CircuitBreaker knows about a subscription. failures and
+    overruns are consecutive, the totals are kept apart.
+
+    """
+    def __init__(self):
+        super(CircuitState, self).__init__()
+        self.failures = 0
+        self.overruns = 0
+        self.totalFailures = 0
+        self.totalOverruns = 0
+        self.suspensions = 0
+        self.skipped = 0
+        self.suspendedUntil = None
+        self.lastError = None
+
+    def __repr__(self):
+        return "<%s failures=%d overruns=%d suspensions=%d%s>" % (
+                type(self).__name__, self.totalFailures, self.totalOverruns,
+                self.suspensions, " suspended" if self.suspended else "")
+
+    @property
+    def suspended(self):
+        return self.suspendedUntil is not None
+
+    @property
+    def healthy(self):
+        return not (self.failures or self.overruns or self.suspended)
+
+
+class CircuitBreaker(object):
+    """Suspends a subscription after maxFailures failed deliveries in a row,
+    or, when a budget in seconds is given, after maxOverruns deliveries in a
+    row taking longer than it. Exceptions in the ignored_exceptions of the
+    announcer don't count unless countIgnored is true, their tracebacks are
+    never captured.
+    Every error is collected: if a single subscriber failed its exception is
+    raised as usual, if several did a DeliveryErrors with all of them.
+
+    """
+    timer = staticmethod(timeit.default_timer)
+
+    def __init__(self, maxFailures=5, budget=None, maxOverruns=5,
+            cooldown=30.0, countIgnored=False):
+        super(CircuitBreaker, self).__init__()
+        if maxFailures < 1 or maxOverruns < 1:
+            raise ValueError("maxFailures and maxOverruns must be at least 1")
+        self.maxFailures = maxFailures
+        self.budget = budget
+        self.maxOverruns = maxOverruns
+        self.cooldown = cooldown
+        self.countIgnored = countIgnored
+        self.states = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def install(self, registry):
+        registry.tryDeliverTo = self.tryDeliverTo
+
+    def uninstall(self, registry):
+        registry.__dict__.pop("tryDeliverTo", None)
+
+    def tryDeliverTo(self, announcement, subscriptions, exceptions_that_are_ok):
+        """SubscriptionRegistry.tryDeliverTo, skipping suspended subscriptions
+        and collecting every error
+
+        """
+        excinfos = []
+        notifications = []
+        states = self.states
+        timer = self.timer
+        budget = self.budget
+        for subscription in subscriptions:
+            state = states.get(subscription)
+            if state is not None and state.suspendedUntil is not None and \
+                    timer() < state.suspendedUntil:
+                state.skipped += 1
+                continue
+            error = None
+            stop = False
+            start = timer() if budget is not None else 0.0
+            try:
+                subscription.basicDeliver(announcement)
+            except core.StopPropagation:
+                stop = True
+            except Exception as err:
+                if not isinstance(err, exceptions_that_are_ok):
+                    excinfos.append(sys.exc_info())
+                    error = err
+                elif self.countIgnored:
+                    error = err
+            overrun = budget is not None and timer() - start > budget
+            if error is not None or overrun or \
+                    (state is not None and not state.healthy):
+                self.record(subscription, error, overrun, notifications)
+            if stop:
+                break
+        for notification in notifications:
+            try:
+                notification.subscription.announcer.announce(notification)
+            except Exception:
+                excinfos.append(sys.exc_info())
+        if not excinfos:
+            return None
+        if len(excinfos) == 1:
+            return excinfos[0]
+        errors = DeliveryErrors(excinfos)
+        return type(errors), errors, None
+
+    def record(self, subscription, error, overrun, notifications):
+        """Count the outcome of a delivery to subscription, suspending or
+        resuming it. What should be announced is added to notifications.
+
+        """
+        with self.lock:
+            state = self.states.get(subscription)
+            if state is None:
+                state = self.states[subscription] = CircuitState()
+            if error is None:
+                state.failures = 0
+            else:
+                state.failures += 1
+                state.totalFailures += 1
+                state.lastError = error
+            if overrun:
+                state.overruns += 1
+                state.totalOverruns += 1
+            else:
+                state.overruns = 0
+            if state.suspended:
+                if error is None and not overrun:
+                    state.suspendedUntil = None
+                    notifications.append(SubscriptionResumed(
+                        subscription=subscription))
+                    return
+                reason = "failures" if error is not None else "latency"
+            elif state.failures >= self.maxFailures:
+                reason = "failures"
+            elif state.overruns >= self.maxOverruns:
+                reason = "latency"
+            else:
+                return
+            state.suspendedUntil = self.timer() + self.cooldown
+            state.suspensions += 1
+            notifications.append(SubscriptionSuspended(
+                subscription=subscription, reason=reason,
+                error=state.lastError if error is not None else None,
+                until=state.suspendedUntil))
+
+    def stateOf(self, subscription):
+        """Answer the CircuitState of subscription, None if it never failed
+        nor overran its budget
+
+        """
+        return self.states.get(subscription)
+
+    def suspended(self):
+        """Answer the subscriptions suspended now
+
+        """
+        with self.lock:
+            return [subscription for subscription, state
+                    in list(self.states.items()) if state.suspended]
+
+    def resume(self, subscription):
+        """Deliver to subscription again right away, forgetting its failures
+
+        """
+        with self.lock:
+            self.states.pop(subscription, None)
+
+    def reset(self):
+        with self.lock:
+            self.states.clear()
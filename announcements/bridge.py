@@ -0,0 +1,459 @@
+# -*- coding: utf8 -*-
+
+"""This module implements AnnouncementBridge, forwarding announcements between
+the Announcers of several processes over a multiprocessing connection, a Pipe
+or a Unix domain socket.
+
+    >>> hub = BridgeListener(announcer, "/run/app/announcements.sock",
+    ...     authkey=secret, types=(OrderPlaced, OrderShipped))
+    >>> ...
+    >>> # in a worker process
+    >>> bridge = bridgeTo(announcer, "/run/app/announcements.sock",
+    ...     authkey=secret)
+    >>> announcer.on(OrderPlaced, do=ship)
+
+Each end tells the other which announcement classes its announcer has
+subscriptions for, and only the announcements the other end wants are sent:
+classes nobody subscribes to in the other process never cross. Bridges of the
+same announcer relay to each other, a hub also asks each peer for what its
+other peers subscribe to, so workers connected to a BridgeListener announce
+to each other through it. Announcements are buffered per peer and written
+batchSize at a time by a sender thread, a receiver thread announces what the
+peer sends with the local announcer.
+Messages are (kind, payload) pairs serialized with the serializer of the
+bridge, pickle by default. Unpickling runs whatever the peer asks for, a peer
+must be trusted: give the listener and its clients an authkey, the socket is
+only open to its owner. The class names a peer sends are looked up among the
+classes the bridge forwards, nothing is imported.
+
+"""
+
+import inspect
+import logging
+import os
+import threading
+import multiprocessing
+from multiprocessing import connection
+
+from . import core
+from .journal import PickleSerializer, nameOf
+from .queued import BoundedBuffer, DROP_OLDEST
+
+
+INTEREST = "interest"
+ANNOUNCEMENTS = "announcements"
+CLOSE = "close"
+
+#XXX An announcement relayed from a peer is not sent back by the bridge it
+#    came from, the other bridges forward it, and what its subscribers
+#    announce is forwarded by all. This is known by the thread relaying it:
+#    announcers delivering from other threads, like QueuedAnnouncer,
+#    shouldn't be bridged in a cycle.
+relaying = threading.local()
+
+Disconnected = (EOFError, IOError, OSError)
+
+
+class AnnouncementBridge(BoundedBuffer):
+    """Forwards the announcements of types announced by announcer to the
+    peer at the other end of connection, a multiprocessing Connection, and
+    announces with announcer what the peer forwards.
+    Up to maxsize announcements wait for the sender thread, when the buffer
+    is full the overflow policy of BoundedBuffer applies. Dropped
+    announcements are counted in dropped, those the peer doesn't want in
+    filtered. The subscriptions of announcer are looked at again every
+    refresh seconds when they changed, and the peer told.
+    serializer is anything with dumps and loads, like PickleSerializer.
+
+    """
+    logger = logging.getLogger("AnnouncementBridge")
+    # Bumped when a peer tells what it subscribes to, the other bridges of
+    # its announcer advertise it too
+    interests = 0
+
+    def __init__(self, announcer, connection, types=(core.Announcement,),
+            maxsize=1024, overflow=DROP_OLDEST, batchSize=64,
+            serializer=PickleSerializer, refresh=0.1):
+        super(AnnouncementBridge, self).__init__(maxsize, overflow)
+        if batchSize < 1:
+            raise ValueError("batchSize must be at least 1")
+        self.announcer = announcer
+        self.connection = connection
+        self.types = tuple(types)
+        self.batchSize = batchSize
+        self.serializer = serializer
+        self.refresh = refresh
+        # The classes the peer subscribes to and what was decided for each
+        # announced class, replaced together when the peer tells
+        self.peer = ((), {})
+        self.ready = threading.Event()
+        self.generation = None
+        self.advertised = None
+        self.sent = 0
+        self.received = 0
+        self.filtered = 0
+        self.failures = 0
+        self.running = 2
+        if len(self.types) == 1:
+            announcementClass = self.types[0]
+        else:
+            announcementClass = core.AnnouncementSet(*self.types)
+        announcer.subscribe(announcementClass, send="forward", to=self)
+        self.sender = threading.Thread(target=self.send,
+                name="AnnouncementBridge-send")
+        self.receiver = threading.Thread(target=self.receive,
+                name="AnnouncementBridge-receive")
+        for thread in (self.sender, self.receiver):
+            thread.daemon = True
+            thread.start()
+
+    def __repr__(self):
+        return "<%s %r%s>" % (type(self).__name__, self.connection,
+                " closed" if self.closed else "")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def wants(self, announcementClass):
+        """Answer whether the peer subscribes to announcementClass, or to one
+        of its superclasses
+
+        """
+        classes, wanted = self.peer
+        try:
+            return wanted[announcementClass]
+        except KeyError:
+            accepted = wanted[announcementClass] = \
+                    issubclass(announcementClass, classes)
+            return accepted
+
+    def forward(self, announcement):
+        """Buffer announcement for the peer, if it wants it
+
+        """
+        if getattr(relaying, "bridge", None) is self and \
+                relaying.announcement is announcement:
+            return
+        if not self.wants(type(announcement)):
+            self.filtered += 1
+            return
+        with self.lock:
+            if self.basicPut(announcement):
+                self.notEmpty.notify()
+
+    def interest(self):
+        """Answer the names of the classes the subscriptions of announcer
+        handle, and those the peers of its other bridges want from them, see
+        forwarded
+
+        """
+        names = set()
+        for subscription in self.announcer.registry.subscriptions:
+            subscriber = subscription.subscriber
+            if subscriber is self:
+                continue
+            if isinstance(subscriber, AnnouncementBridge):
+                classes = subscriber.forwarded()
+            else:
+                classes = subscription.handledClasses()
+            for cls in classes:
+                names.add(nameOf(cls))
+        return sorted(names)
+
+    def forwarded(self):
+        """Answer the classes self forwards that the peer wants, the most
+        specific of the two when one is a subclass of the other
+
+        """
+        classes = set()
+        for wanted in self.peer[0]:
+            for forwarded in self.types:
+                if issubclass(wanted, forwarded):
+                    classes.add(wanted)
+                elif issubclass(forwarded, wanted):
+                    classes.add(forwarded)
+        return classes
+
+    def advertise(self):
+        """Tell the peer what announcer subscribes to, if it or what the
+        peers of the other bridges want changed since the last time
+
+        """
+        generation = (self.announcer.registry.generation,
+                AnnouncementBridge.interests)
+        if generation == self.generation:
+            return
+        self.generation = generation
+        names = self.interest()
+        if names != self.advertised:
+            self.write(INTEREST, names)
+            self.advertised = names
+
+    def write(self, kind, payload):
+        self.connection.send_bytes(self.serializer.dumps((kind, payload)))
+
+    def send(self):
+        """Write the buffered announcements batchSize at a time until closed,
+        in the sender thread
+
+        """
+        try:
+            self.advertise()
+            while True:
+                with self.lock:
+                    if not self.buffer and not self.closed:
+                        self.notEmpty.wait(self.refresh)
+                    batch = []
+                    while self.buffer and len(batch) < self.batchSize:
+                        batch.append(self.buffer.popleft())
+                    if batch:
+                        self.notFull.notify_all()
+                    done = self.closed and not self.buffer
+                if batch:
+                    self.sendBatch(batch)
+                if done:
+                    break
+                self.advertise()
+            self.write(CLOSE, None)
+        except Disconnected:
+            self.close(drain=False)
+        finally:
+            self.finished()
+
+    def sendBatch(self, batch):
+        try:
+            data = self.serializer.dumps((ANNOUNCEMENTS, batch))
+        except Exception:
+            # Leave out what can't be serialized instead of the whole batch
+            dumps = self.serializer.dumps
+            serializable = []
+            for announcement in batch:
+                try:
+                    dumps(announcement)
+                except Exception as err:
+                    self.failures += 1
+                    self.sendFailed(announcement, err)
+                else:
+                    serializable.append(announcement)
+            if not serializable:
+                return
+            batch = serializable
+            data = self.serializer.dumps((ANNOUNCEMENTS, batch))
+        self.connection.send_bytes(data)
+        self.sent += len(batch)
+
+    def sendFailed(self, announcement, error):
+        """Called from the sender thread when announcement couldn't be
+        serialized
+
+        """
+        self.logger.error("Serializing %r failed", announcement,
+                exc_info=True)
+
+    def receive(self):
+        """Read what the peer sends until it closes, in the receiver thread
+
+        """
+        loads = self.serializer.loads
+        try:
+            while True:
+                kind, payload = loads(self.connection.recv_bytes())
+                if kind == ANNOUNCEMENTS:
+                    self.relay(payload)
+                elif kind == INTEREST:
+                    self.interestChanged(payload)
+                else:
+                    break
+        except Disconnected:
+            pass
+        try:
+            self.close(drain=False)
+        finally:
+            self.finished()
+
+    def finished(self):
+        """Called by the sender and the receiver threads on their way out,
+        the last one closes the connection
+
+        """
+        with self.lock:
+            self.running -= 1
+            last = not self.running
+        if last:
+            self.connection.close()
+
+    def known(self):
+        """Answer the classes the peer may name by their names: the types
+        self forwards, their superclasses and their subclasses
+
+        """
+        classes = {}
+        seen = set()
+        pending = []
+        for forwarded in self.types:
+            for cls in inspect.getmro(forwarded):
+                classes.setdefault(nameOf(cls), cls)
+            pending.append(forwarded)
+        while pending:
+            cls = pending.pop()
+            if cls in seen:
+                continue
+            seen.add(cls)
+            classes.setdefault(nameOf(cls), cls)
+            pending.extend(cls.__subclasses__())
+        return classes
+
+    def interestChanged(self, names):
+        known = self.known()
+        classes = tuple(known[name] for name in names if name in known)
+        self.peer = (classes, {})
+        #XXX Not atomic, two peers changing at once still change it
+        AnnouncementBridge.interests += 1
+        self.ready.set()
+
+    def relay(self, announcements):
+        """Announce what the peer forwarded with announcer
+
+        """
+        relaying.bridge = self
+        try:
+            for announcement in announcements:
+                self.received += 1
+                relaying.announcement = announcement
+                try:
+                    self.announcer.announce(announcement)
+                except Exception as err:
+                    self.failures += 1
+                    self.relayFailed(announcement, err)
+        finally:
+            relaying.bridge = relaying.announcement = None
+
+    def relayFailed(self, announcement, error):
+        """Called from the receiver thread when announcing announcement
+        raised error
+
+        """
+        self.logger.error("Relaying %r failed", announcement, exc_info=True)
+
+    def close(self, drain=True, timeout=None):
+        """Stop forwarding, send what is buffered unless drain is false, and
+        close the connection once the peer closed its end. Called from
+        outside, it waits up to timeout seconds for the sender and receiver
+        threads to finish, forever if timeout is None.
+
+        """
+        with self.lock:
+            closing = not self.closed
+            self.closed = True
+            if not drain:
+                self.dropped += len(self.buffer)
+                self.buffer.clear()
+            self.notEmpty.notify_all()
+            self.notFull.notify_all()
+        if closing:
+            self.announcer.unsubscribe(self)
+        #XXX The bridge threads close when the peer is gone, each waiting
+        #    for the other would deadlock: they don't join, the last one to
+        #    finish closes the connection.
+        current = threading.current_thread()
+        if current is self.sender or current is self.receiver:
+            return
+        for thread in (self.sender, self.receiver):
+            thread.join(timeout)
+
+
+class BridgeListener(object):
+    """Listens on the Unix domain socket at address and bridges announcer
+    with every process connecting there, see bridgeTo. Processes have to
+    prove they know authkey, bytes, when given. The socket gets the
+    permissions in mode once created, put it in a directory only its users
+    can reach to leave no window. options are passed to each
+    AnnouncementBridge.
+
+    """
+    def __init__(self, announcer, address, authkey=None, mode=0o600,
+            **options):
+        super(BridgeListener, self).__init__()
+        self.announcer = announcer
+        self.address = address
+        self.authkey = authkey
+        self.options = options
+        self.listener = connection.Listener(address, "AF_UNIX",
+                authkey=authkey)
+        os.chmod(address, mode)
+        self.bridges = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.acceptor = threading.Thread(target=self.accept,
+                name="BridgeListener")
+        self.acceptor.daemon = True
+        self.acceptor.start()
+
+    def __repr__(self):
+        return "<%s %s>" % (type(self).__name__, self.address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    @property
+    def peers(self):
+        """The bridges to the processes connected now
+
+        """
+        with self.lock:
+            return [bridge for bridge in self.bridges if not bridge.closed]
+
+    def accept(self):
+        while True:
+            try:
+                peer = self.listener.accept()
+            except (multiprocessing.AuthenticationError, EOFError):
+                # A process which didn't prove it knows authkey
+                if self.closed:
+                    return
+                continue
+            except Disconnected:
+                return
+            with self.lock:
+                if self.closed:
+                    peer.close()
+                    return
+                self.bridges = [bridge for bridge in self.bridges
+                        if not bridge.closed]
+                self.bridges.append(AnnouncementBridge(self.announcer, peer,
+                    **self.options))
+
+    def close(self, timeout=None):
+        """Stop listening and close the bridges
+
+        """
+        with self.lock:
+            self.closed = True
+            bridges = self.bridges
+            self.bridges = []
+        #XXX accept doesn't return when the socket is closed under it,
+        #    connect once to wake it up
+        try:
+            connection.Client(self.address, "AF_UNIX",
+                    authkey=self.authkey).close()
+        except Disconnected:
+            pass
+        self.acceptor.join(timeout)
+        self.listener.close()
+        for bridge in bridges:
+            bridge.close(timeout=timeout)
+
+
+def bridgeTo(announcer, address, authkey=None, **options):
+    """Connect to the BridgeListener at address, proving authkey if given,
+    and answer the AnnouncementBridge between it and announcer
+
+    """
+    return AnnouncementBridge(announcer, connection.Client(address, "AF_UNIX",
+        authkey=authkey), **options)
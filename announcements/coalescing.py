@@ -0,0 +1,109 @@
+# -*- coding: utf8 -*-
+
+"""This module implements CoalescingAnnouncer, an Announcer holding back its
+announcements until flushed, and delivering only the last of each kind.
+
+    >>> announcer = CoalescingAnnouncer(window=0.05)
+    >>> announcer.on(ModelChanged, do=view.refresh)
+    >>> for each in range(10000):
+    ...     announcer.announce(ModelChanged)
+
+refreshes the view once, 50 milliseconds after the first announcement.
+
+"""
+
+import collections
+import logging
+import threading
+
+from . import core
+
+
+def sameType(announcement):
+    """Two announcements are equivalent when they are of the same type, see
+    Announcement.__eq__
+
+    """
+    return type(announcement)
+
+
+class CoalescingAnnouncer(core.Announcer):
+    """An announcer keeping a single pending announcement for each key,
+    announcing again replaces it, or merges it with merge(pending, new) when
+    given. The key is the announcement type by default, pass key to coalesce
+    by something else, like the instance an announcement is about.
+    Pending announcements are delivered by flush, in the order they were last
+    announced. When window is given they are also flushed window seconds after
+    the first one arrives, from a timer thread.
+
+    """
+    logger = logging.getLogger("CoalescingAnnouncer")
+
+    def __init__(self, window=None, key=sameType, merge=None):
+        super(CoalescingAnnouncer, self).__init__()
+        self.window = window
+        self.key = key
+        self.merge = merge
+        self.pending = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.timer = None
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def announce(self, announcement):
+        """Make announcement pending, answer it or the merged announcement
+
+        """
+        announcement = announcement.asAnnouncement(announcement)
+        key = self.key(announcement)
+        with self.lock:
+            previous = self.pending.pop(key, None)
+            if previous is not None:
+                self.coalesced += 1
+                if self.merge is not None:
+                    announcement = self.merge(previous, announcement)
+            self.pending[key] = announcement
+            if self.window is not None and self.timer is None:
+                self.timer = threading.Timer(self.window, self.timerFlush)
+                self.timer.daemon = True
+                self.timer.start()
+        return announcement
+
+    def announceAll(self, announcements):
+        count = 0
+        for announcement in announcements:
+            self.announce(announcement)
+            count += 1
+        return count
+
+    def flush(self):
+        """Deliver the pending announcements, answer how many were delivered
+
+        """
+        with self.lock:
+            announcements = list(self.pending.values())
+            self.pending.clear()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not announcements:
+            return 0
+        return super(CoalescingAnnouncer, self).announceAll(announcements)
+
+    def timerFlush(self):
+        try:
+            self.flush()
+        except Exception:
+            self.logger.error("Flushing %r failed", self, exc_info=True)
+
+    def discard(self):
+        """Drop the pending announcements without delivering them
+
+        """
+        with self.lock:
+            self.pending.clear()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
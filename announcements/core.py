@@ -47,18 +47,254 @@ http://discorporate.us/projects/Blinker/.
 """
 
 
-__all__ = [ "Announcement", "Announcer" ]
+__all__ = [ "Announcement", "SlottedAnnouncement", "Announcer",
+        "StopPropagation" ]
 __author__ = "rbistolfi"
 __date__ = 2012
 
 
 import types
 import inspect
+import functools
+import itertools
+import collections
 import threading
 import weakref
 import sys
 
 
+try:
+    getargspec = inspect.getfullargspec
+except AttributeError: # Python 2
+    getargspec = inspect.getargspec
+
+
+if sys.version_info[0] < 3:
+    exec("def reraise(excep):\n    raise excep[0], excep[1], excep[2]\n")
+else:
+    def reraise(excep):
+        """Raise the exception from the sys.exc_info() tuple excep keeping its
+        traceback
+
+        """
+        raise excep[1].with_traceback(excep[2])
+
+
+def unbound(method):
+    """Return (instance, function) if method is bound to instance, so that
+    function(instance, ...) calls it, or None if it is not a bound method
+
+    """
+    instance = getattr(method, "__self__", None)
+    if instance is None or isinstance(instance, types.ModuleType):
+        return None
+    if inspect.ismethod(method):
+        return instance, method.__func__
+    if isinstance(method, types.BuiltinMethodType):
+        function = getattr(type(instance), method.__name__, None)
+        if function is not None:
+            return instance, function
+    return None
+
+
+def weakReferenceTo(obj, callback=None):
+    """Return (reference, function), a weak reference to obj and None or, if
+    obj is a bound method, a weak reference to its instance and its function.
+    Bound methods are created on each attribute access, referencing them
+    would die at once; see dereference. Raise TypeError if obj can't be
+    weakly referenced.
+
+    """
+    method = unbound(obj)
+    if method is None:
+        return weakref.ref(obj, callback), None
+    instance, function = method
+    return weakref.ref(instance, callback), function
+
+
+def dereference(reference, function):
+    """Return the object weakReferenceTo referenced, or None if it died
+
+    """
+    obj = reference()
+    if obj is None or function is None:
+        return obj
+    return function.__get__(obj, type(obj))
+
+
+def withMetaclass(meta, *bases):
+    """Return a base class to create classes with meta as their metaclass,
+    both in Python 2 and 3. The base is replaced by bases on creation.
+
+    """
+    class metaclass(meta):
+        def __new__(cls, name, thisBases, namespace):
+            return meta(name, bases, namespace)
+    return type.__new__(metaclass, "temporary_class", (), {})
+
+
+def parametersOf(valuable):
+    """Return the positional parameters valuable accepts as a list of (name,
+    optional) pairs, and whether it accepts *args. Builtins are read from
+    their signature, when they have none we assume they take a single
+    argument.
+
+    """
+    if isinstance(valuable, functools.partial):
+        parameters, varargs = parametersOf(valuable.func)
+        keywords = valuable.keywords or {}
+        parameters = [(name, optional) for name, optional
+                in parameters[len(valuable.args):] if name not in keywords]
+        return parameters, varargs
+    if inspect.isclass(valuable):
+        init = valuable.__init__
+        if not (inspect.isfunction(init) or inspect.ismethod(init)):
+            return [], False
+        parameters, varargs = parametersOf(init)
+        return parameters[1:], varargs
+    elif not (inspect.isfunction(valuable) or inspect.ismethod(valuable)):
+        if isinstance(valuable, (types.BuiltinFunctionType,
+                types.BuiltinMethodType)) or not hasattr(valuable, "__call__"):
+            return signatureOf(valuable) or ([("announcement", False)], False)
+        return parametersOf(valuable.__call__)
+    spec = getargspec(valuable)
+    names = spec.args
+    if inspect.ismethod(valuable) and valuable.__self__ is not None:
+        names = names[1:] # self is passed automatically
+    kwonlydefaults = getattr(spec, "kwonlydefaults", None) or {}
+    for name in getattr(spec, "kwonlyargs", ()):
+        if name not in kwonlydefaults:
+            raise TypeError("Incompatible signature, %r requires the keyword "
+                    "argument %s" % (valuable, name))
+    defaults = len(spec.defaults or ())
+    parameters = [(name, index >= len(names) - defaults)
+            for index, name in enumerate(names)]
+    return parameters, spec.varargs is not None
+
+
+def signatureOf(valuable):
+    """Return what parametersOf answers for valuable from its signature, or
+    None if it has none, like some builtins and every one in Python 2
+
+    """
+    if not hasattr(inspect, "signature"):
+        return None
+    try:
+        signature = inspect.signature(valuable)
+    except (TypeError, ValueError):
+        return None
+    parameters = []
+    varargs = False
+    for parameter in signature.parameters.values():
+        if parameter.kind in (parameter.POSITIONAL_ONLY,
+                parameter.POSITIONAL_OR_KEYWORD):
+            parameters.append((parameter.name,
+                parameter.default is not parameter.empty))
+        elif parameter.kind == parameter.VAR_POSITIONAL:
+            varargs = True
+        elif parameter.kind == parameter.KEYWORD_ONLY and \
+                parameter.default is parameter.empty:
+            raise TypeError("Incompatible signature, %r requires the keyword "
+                    "argument %s" % (valuable, parameter.name))
+    return parameters, varargs
+
+
+def subscriberKeyOf(subscriber):
+    """Return the key subscriptions are indexed under for subscriber. This is
+    the identity of subscriber, bound methods are keyed by their instance and
+    function since a new one is created on each attribute access.
+
+    """
+    method = unbound(subscriber)
+    if method is not None:
+        instance, function = method
+        return (id(instance), id(function))
+    return id(subscriber)
+
+
+def argumentsCountOf(valuable):
+    """Return how many of the announcement and the announcer should be passed
+    to valuable, taking as many as it accepts. Raise TypeError if valuable
+    can't be called with at most two arguments.
+
+    """
+    if not callable(valuable):
+        raise TypeError("%r is not callable" % (valuable,))
+    parameters, varargs = parametersOf(valuable)
+    required = len([name for name, optional in parameters if not optional])
+    if required > 2:
+        raise TypeError("Incompatible signature, %r requires %d arguments" %
+                (valuable, required))
+    if varargs:
+        return 2
+    return min(len(parameters), 2)
+
+
+#XXX Stands for a missing attribute when matching filtered subscriptions, it
+#    is equal to nothing but itself.
+missing = object()
+
+
+def conditionsOf(where):
+    """Return the where filter of a subscription, a dictionary of attribute
+    names and values, as a tuple of (attribute, value) pairs sorted by
+    attribute, or None if there is no filter. The registry indexes filtered
+    subscriptions by their values, raise TypeError if any can't be hashed.
+
+    """
+    if not where:
+        return None
+    conditions = tuple(sorted(where.items(), key=lambda pair: pair[0]))
+    for attribute, value in conditions:
+        try:
+            hash(value)
+        except TypeError:
+            raise TypeError("Can't filter by %s, %r is not hashable" %
+                    (attribute, value))
+    return conditions
+
+
+def limitOf(rate, burst, sample):
+    """Return the limit of a subscription, see Announcer.subscribe, or None
+
+    """
+    if rate is None and sample is None:
+        if burst is not None:
+            raise ValueError("burst needs a rate")
+        return None
+    from .limits import RateLimit, Sample
+    if sample is None:
+        return RateLimit(rate, burst)
+    if rate is not None:
+        raise ValueError("Use either a rate or a sample")
+    return Sample(sample)
+
+
+def sequenceOf(subscription):
+    return subscription.sequence
+
+
+def orderOf(subscription):
+    """The delivery order: by priority, lower first, and then in the order
+    the subscriptions were made
+
+    """
+    return subscription.priority, subscription.sequence
+
+
+#XXX One counter for every registry, so subscriptions moved between the
+#    shards of a ShardedSubscriptionRegistry keep their order.
+sequences = itertools.count()
+
+
+class StopPropagation(Exception):
+    """Raised by a subscriber to stop delivering the announcement, the
+    subscriptions after it are skipped. It is not an error, announce doesn't
+    raise it.
+
+    """
+
+
 class AnnouncementMeta(type):
     """A metaclass giving support for addition to its classes
 
@@ -67,13 +303,19 @@ class AnnouncementMeta(type):
         return AnnouncementSet(cls, announcementClass)
 
 
-class Announcement(object):
+class Announcement(withMetaclass(AnnouncementMeta, object)):
     """This class is the superclass for events that someone might want to
     announce, such as a button click or an attribute change. Typically you
     create subclasses for your own events you want to announce.
+    Announcement declares __slots__ so SlottedAnnouncement subclasses have no
+    instance dictionary. A subclass without __slots__ has one as usual, but
+    a bare Announcement() doesn't: it takes no attributes, announce a
+    subclass to carry data. Instances can be weakly referenced, subclasses
+    must not list __weakref__ in their __slots__ again.
 
     """
-    __metaclass__ = AnnouncementMeta
+    __slots__ = ("__weakref__",)
+    __hash__ = object.__hash__
 
     def __eq__(self, other):
         #XXX Since any event is encoded as a *class* (actually a subclass of
@@ -98,6 +340,32 @@ class Announcement(object):
         return announcementClass is cls or issubclass(announcementClass, cls)
 
 
+class SlottedAnnouncement(Announcement):
+    """A base for announcements carrying data in slots instead of an instance
+    dictionary. Subclasses list their fields in __slots__, they can be given
+    as keyword arguments:
+
+        >>> class OrderPlaced(SlottedAnnouncement):
+        ...     __slots__ = ("order", "amount")
+        >>> announcer.announce(OrderPlaced(order=order, amount=10))
+
+    """
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        super(SlottedAnnouncement, self).__init__()
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = []
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                if hasattr(self, name):
+                    fields.append("%s=%r" % (name, getattr(self, name)))
+        return "<%s %s>" % (type(self).__name__, " ".join(fields))
+
+
 class AnnouncementSet(object):
     """This is a set for Announcements. An instance is created when
     Announcements are added with the "+" operator. It knows what kind of events
@@ -110,6 +378,8 @@ class AnnouncementSet(object):
         """
         super(AnnouncementSet, self).__init__()
         self.announcements = set(announcements)
+        self.handled = {}
+        self.registries = weakref.WeakSet()
 
     def __add__(self, announcementClass):
         """Add announcementClass to the announcements set
@@ -118,6 +388,63 @@ class AnnouncementSet(object):
         self.add(announcementClass)
         return self
 
+    def add(self, announcementClass):
+        """Add announcementClass to the announcements set
+
+        """
+        if announcementClass not in self.announcements:
+            self.announcements.add(announcementClass)
+            self.changed()
+
+    def discard(self, announcementClass):
+        if announcementClass in self.announcements:
+            self.announcements.discard(announcementClass)
+            self.changed()
+
+    def remove(self, announcementClass):
+        self.announcements.remove(announcementClass)
+        self.changed()
+
+    def pop(self):
+        announcementClass = self.announcements.pop()
+        self.changed()
+        return announcementClass
+
+    def clear(self):
+        self.modify(self.announcements.clear)
+
+    def update(self, *others):
+        self.modify(self.announcements.update, *others)
+
+    def difference_update(self, *others):
+        self.modify(self.announcements.difference_update, *others)
+
+    def intersection_update(self, *others):
+        self.modify(self.announcements.intersection_update, *others)
+
+    def symmetric_difference_update(self, other):
+        self.modify(self.announcements.symmetric_difference_update, other)
+
+    def modify(self, operation, *arguments):
+        """Apply operation to the announcements set, see changed if it changed
+        anything
+
+        """
+        before = frozenset(self.announcements)
+        operation(*arguments)
+        if self.announcements != before:
+            self.changed()
+
+    def changed(self):
+        """The announcements set changed. The answers of handles are cached,
+        drop them, and make the registries holding subscriptions to us index
+        them again.
+
+        """
+        self.handled = {}
+        for registry in list(self.registries):
+            registry.reindex()
+
     def __repr__(self):
         return "<%s(%s)>" % (type(self).__name__,
                 repr(self.announcements)[4:-1])
@@ -126,14 +453,21 @@ class AnnouncementSet(object):
         return len(self.announcements)
 
     def __getattr__(self, name):
+        #XXX Only what reads the announcements set is left to forward, every
+        #    method changing it is defined above.
         return getattr(self.announcements, name)
 
     def handles(self, announcementClass):
         """We can handle an announcement if any of the elements in the
-        announcements set can handle it
+        announcements set can handle it. The answer is cached by class.
 
         """
-        return any(i.handles(announcementClass) for i in self.announcements)
+        try:
+            return self.handled[announcementClass]
+        except KeyError:
+            handles = self.handled[announcementClass] = any(
+                    i.handles(announcementClass) for i in self.announcements)
+            return handles
 
 
 class Announcer(object):
@@ -144,21 +478,83 @@ class Announcer(object):
     same time in different threads should never cause failures.
     This Python version is based in the Pharo Smalltalk implementation.
     Btw, thread-safety is in the TODO
+    A different registry, like a ShardedSubscriptionRegistry, can be given.
+    An announcer can forward what it announces to other announcers, see
+    forwardTo.
 
     """
-    def __init__(self):
+    def __init__(self, registry=None):
         super(Announcer, self).__init__()
-        self.registry = SubscriptionRegistry()
+        self.registry = SubscriptionRegistry() if registry is None \
+                else registry
         self.ignored_exceptions = []
+        self.parents = ()
+        self.chain = ForwardingChain(self)
 
     def announce(self, announcement):
+        """Deliver announcement, an Announcement or an Announcement class to
+        instantiate, and return it
+
+        """
         announcement = announcement.asAnnouncement(announcement)
-        if self.registry:
+        if self.parents:
+            self.chain.deliver(announcement, tuple(self.ignored_exceptions))
+        elif self.registry:
             self.registry.ignored_exceptions = tuple(self.ignored_exceptions)
             self.registry.deliver(announcement)
         return announcement
 
-    def subscribe(self, announcementClass, do=None, send=None, to=None):
+    def announceLazily(self, announcementClass, factory):
+        """Announce the announcement factory builds only if some subscription
+        handles announcementClass, see hasSubscribersFor, and return what
+        announce does. Otherwise factory isn't called and None is returned.
+
+        """
+        if not self.hasSubscribersFor(announcementClass):
+            return None
+        return self.announce(factory())
+
+    def hasSubscribersFor(self, announcementClass):
+        """Return true if some subscription handles announcementClass. It is
+        true as soon as a filtered subscription could, depending on the
+        announcement, see subscribe. This is a lookup in the registry index,
+        and in the ones of the announcers self forwards to.
+
+        """
+        if self.parents:
+            return self.chain.hasSubscribersFor(announcementClass)
+        return self.registry.hasSubscribersFor(announcementClass)
+
+    def subscriptionsTo(self, announcement):
+        """Return the subscriptions announcement would be delivered to now,
+        including those of the announcers self forwards to
+
+        """
+        if self.parents:
+            return self.chain.subscriptionsTo(announcement)
+        return self.registry.subscriptionsTo(announcement)
+
+    def announceAll(self, announcements):
+        """Announce every element of the announcements iterable, in order.
+        The subscriptions are resolved once per announcement class, when the
+        first announcement of the class comes, and used for the rest. As in
+        announce, errors don't stop the delivery, the last one is re-raised at
+        the end. The iterable is consumed lazily. Return the number of
+        announcements delivered.
+
+        """
+        if self.parents:
+            return self.chain.deliverAll(
+                    (announcement.asAnnouncement(announcement)
+                        for announcement in announcements),
+                    tuple(self.ignored_exceptions))
+        return self.registry.deliverAll(
+                (announcement.asAnnouncement(announcement)
+                    for announcement in announcements),
+                tuple(self.ignored_exceptions))
+
+    def subscribe(self, announcementClass, do=None, send=None, to=None,
+            where=None, priority=0, rate=None, burst=None, sample=None):
         """Declare that when announcementClass is raised, do is
         executed. The do and send/to keyword arguments are mutually exclusive,
         you can't provide both do and send.
@@ -166,6 +562,17 @@ class Announcer(object):
         subscribe:do: and subscribe:send:to:. I choosed to implement all of them
         as kwargs, the other option was to do subscribeDo and subscribeSendTo.
         My taste picked the first one.
+        where is an optional dictionary of attribute names and values, only
+        announcements whose attributes are equal to them are delivered, like
+        where={"order_id": 42}. The registry indexes filtered subscriptions by
+        value, announcing doesn't look at the ones that don't match.
+        Subscriptions are delivered by priority, lower first, and then in the
+        order they were made. A subscriber can raise StopPropagation to skip
+        the rest.
+        rate limits the deliveries to the subscriber to rate per second, in
+        bursts of up to burst, and sample delivers only that ratio of the
+        announcements, see announcements.limits. Deliveries dropped by either
+        are counted by subscription.limit.
 
         """
         assert not (do and (send or to)), "The keywords do and send/to are "\
@@ -179,19 +586,113 @@ class Announcer(object):
         subscription.announcementClass = announcementClass
         #XXX Original uses #valuable instead #action and #subscriber
         subscription.action = do
-        subscription.subscriber = to or do
+        subscription.subscriber = do if to is None else to
+        subscription.where = conditionsOf(where)
+        subscription.priority = priority
+        subscription.limit = limitOf(rate, burst, sample)
         return self.registry.add(subscription)
 
-    def on(self, announcementClass, do=None):
+    def on(self, announcementClass, do=None, where=None, priority=0,
+            rate=None, burst=None, sample=None):
         """Declare that when announcementClass is raised, do is
         executed
 
         """
-        return self.subscribe(announcementClass, do=do)
+        return self.subscribe(announcementClass, do=do, where=where,
+                priority=priority, rate=rate, burst=burst, sample=sample)
 
     def replace(self, subscription, newOne):
         return self.registry.replace(subscription, newOne)
 
+    def stream(self, announcementClass=Announcement, **options):
+        """Return an announcements.stream.AnnouncementStream iterating the
+        announcements of announcementClass, options are maxsize, overflow and
+        where. Close it, or use it in a with statement, to unsubscribe.
+
+        """
+        from .stream import AnnouncementStream
+        return AnnouncementStream(self, announcementClass, **options)
+
+    def asyncStream(self, announcementClass=Announcement, **options):
+        """Return the announcements.aio.AsyncAnnouncementStream twin of
+        stream, for asyncio code. Requires Python 3.
+
+        """
+        from .aio import AsyncAnnouncementStream
+        return AsyncAnnouncementStream(self, announcementClass, **options)
+
+    def forwardTo(self, announcer):
+        """Deliver what self announces to the subscriptions of announcer too,
+        after its own, and return announcer. announcer may forward further:
+        announcing resolves the whole chain at once instead of announcing
+        again at every step, see ForwardingChain. The exceptions ignored and
+        the delivery loop are those of the announcer announcing.
+
+        """
+        with ForwardingChain.lock:
+            if announcer is self or self in announcer.chain.announcers():
+                raise ValueError("%r forwards to %r" % (announcer, self))
+            if announcer not in self.parents:
+                self.parents += (announcer,)
+                ForwardingChain.changed()
+        return announcer
+
+    def stopForwardingTo(self, announcer):
+        with ForwardingChain.lock:
+            if announcer in self.parents:
+                self.parents = tuple(parent for parent in self.parents
+                        if parent is not announcer)
+                ForwardingChain.changed()
+
+    def instrument(self, instrumentation=None):
+        """Measure the deliveries of this announcer with instrumentation, a new
+        announcements.instrumentation.Instrumentation by default, and return
+        it. Until uninstrument is called the registry delivers through it.
+
+        """
+        if "breaker" in self.__dict__:
+            raise ValueError("%r is protected by a circuit breaker" % (self,))
+        if instrumentation is None:
+            from .instrumentation import Instrumentation
+            instrumentation = Instrumentation()
+        self.uninstrument()
+        instrumentation.install(self.registry)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def uninstrument(self):
+        """Go back to delivering without measuring
+
+        """
+        instrumentation = self.__dict__.pop("instrumentation", None)
+        if instrumentation is not None:
+            instrumentation.uninstall(self.registry)
+
+    def protect(self, breaker=None):
+        """Suspend the subscriptions that keep failing or taking too long
+        with breaker, a new announcements.breaker.CircuitBreaker by default,
+        and return it. It replaces the delivery loop until unprotect is
+        called, an instrumented announcer can't be protected.
+
+        """
+        if "instrumentation" in self.__dict__:
+            raise ValueError("%r is instrumented" % (self,))
+        if breaker is None:
+            from .breaker import CircuitBreaker
+            breaker = CircuitBreaker()
+        self.unprotect()
+        breaker.install(self.registry)
+        self.breaker = breaker
+        return breaker
+
+    def unprotect(self):
+        """Deliver to every subscription again
+
+        """
+        breaker = self.__dict__.pop("breaker", None)
+        if breaker is not None:
+            breaker.uninstall(self.registry)
+
     def removeSubscription(self, subscription):
         return self.registry.remove(subscription)
 
@@ -199,17 +700,178 @@ class Announcer(object):
         return self.registry.removeSubscriber(subscriber)
 
 
+class ForwardingChain(object):
+    """An announcer and the announcers it forwards to, directly or not,
+    delivered to as one. Their registries are listed depth first, each once,
+    when a link changes, and what they resolve for an announcement class is
+    joined and cached until one of them resolves something else: a chain of
+    announcers costs about the same as a single announcer holding all their
+    subscriptions. Each registry keeps its own order, filters and priorities.
+
+    """
+    lock = threading.Lock()
+    generation = 0
+
+    @classmethod
+    def changed(cls):
+        """A link was made or removed somewhere, call it with the lock held
+
+        """
+        cls.generation += 1
+
+    def __init__(self, announcer):
+        super(ForwardingChain, self).__init__()
+        self.announcer = announcer
+        self.listed = None
+        self.registries = ()
+        self.index = {}
+
+    def announcers(self):
+        """Return the announcer and the ones it forwards to, depth first
+
+        """
+        announcers = []
+        pending = [self.announcer]
+        while pending:
+            announcer = pending.pop()
+            if not any(each is announcer for each in announcers):
+                announcers.append(announcer)
+                pending.extend(reversed(announcer.parents))
+        return announcers
+
+    def registriesNow(self):
+        generation = ForwardingChain.generation
+        if self.listed != generation:
+            self.registries = tuple(announcer.registry
+                    for announcer in self.announcers())
+            self.index = {}
+            self.listed = generation
+        return self.registries
+
+    def entryFor(self, announcementClass):
+        """Return the entries of the registries for announcementClass, see
+        SubscriptionRegistry.resolve, and their subscriptions joined, or None
+        if some are filtered and depend on the announcement. The registries
+        are cached along, a thread still holding the registries listed before
+        a link changed may store its entries after the index was dropped.
+
+        """
+        registries = self.registriesNow()
+        try:
+            listed, entries, joined = self.index[announcementClass]
+        except KeyError:
+            pass
+        else:
+            if listed is registries:
+                for registry, entry in zip(registries, entries):
+                    if registry.entryFor(announcementClass) is not entry:
+                        break
+                else:
+                    return entries, joined
+        entries = tuple(registry.entryFor(announcementClass)
+                for registry in registries)
+        if any(filters for subscriptions, filters in entries):
+            joined = None
+        else:
+            joined = ()
+            for subscriptions, filters in entries:
+                joined += subscriptions
+        self.index[announcementClass] = (registries, entries, joined)
+        return entries, joined
+
+    @staticmethod
+    def select(announcement, entries):
+        subscriptions = ()
+        for entry in entries:
+            subscriptions += SubscriptionRegistry.select(announcement, entry)
+        return subscriptions
+
+    def hasSubscribersFor(self, announcementClass):
+        entries, joined = self.entryFor(announcementClass)
+        return any(subscriptions or filters
+                for subscriptions, filters in entries)
+
+    def subscriptionsTo(self, announcement):
+        entries, joined = self.entryFor(type(announcement))
+        if joined is None:
+            return self.select(announcement, entries)
+        return joined
+
+    def deliver(self, announcement, exceptions_that_are_ok):
+        for registry in self.registriesNow():
+            if registry.dead:
+                registry.sweep()
+        subscriptions = self.subscriptionsTo(announcement)
+        if subscriptions:
+            self.announcer.registry.deliverTo(announcement, subscriptions,
+                    exceptions_that_are_ok)
+
+    def deliverAll(self, announcements, exceptions_that_are_ok):
+        """SubscriptionRegistry.deliverAll across the chain
+
+        """
+        resolved = {}
+        excep = None
+        count = 0
+        tryDeliverTo = self.announcer.registry.tryDeliverTo
+        for announcement in announcements:
+            count += 1
+            announcementClass = type(announcement)
+            try:
+                entries, joined = resolved[announcementClass]
+            except KeyError:
+                entries, joined = resolved[announcementClass] = \
+                        self.entryFor(announcementClass)
+            subscriptions = joined if joined is not None \
+                    else self.select(announcement, entries)
+            if subscriptions:
+                excep = tryDeliverTo(announcement, subscriptions,
+                        exceptions_that_are_ok) or excep
+
+        if excep is not None:
+            reraise(excep)
+        return count
+
+
 class AnnouncementSubscription(object):
     """The subscription is a single entry in a SubscriptionRegistry.
     Several subscriptions by the same object is possible.
+    Registries may hold lots of subscriptions, they use slots instead of an
+    instance dictionary.
 
     """
+    __slots__ = ("announcer", "announcementClass", "subscriber", "_action",
+            "argumentsCount", "invoke", "where", "priority", "sequence",
+            "limit", "__weakref__")
+
     def __init__(self):
         super(AnnouncementSubscription, self).__init__()
         self.announcer = None
         self.announcementClass = None
         self.subscriber = None
         self.action = None
+        self.where = None
+        self.priority = 0
+        self.sequence = None
+        self.limit = None
+
+    @property
+    def action(self):
+        return self._action
+
+    @action.setter
+    def action(self, valuable):
+        """The arity of valuable is resolved here, once, and an invoker taking
+        the announcement is built for it. Bad signatures fail at subscribe time.
+
+        """
+        self._action = valuable
+        if valuable is None:
+            self.argumentsCount = None
+            self.invoke = None
+        else:
+            self.argumentsCount = argumentsCountOf(valuable)
+            self.invoke = self.invokerFor(valuable, self.argumentsCount)
 
     @property
     def valuable(self):
@@ -224,7 +886,7 @@ class AnnouncementSubscription(object):
         """
         self.action = valuable
         if self.isMethod():
-            self.subscriber = valuable.im_self
+            self.subscriber = valuable.__self__
         else:
             self.subscriber = valuable
 
@@ -233,16 +895,29 @@ class AnnouncementSubscription(object):
         handled in separate process
 
         """
-        if self.handles(type(announcement)):
-            argumentsCount = self.getArgumentsCount()
-            if argumentsCount == 0:
-                self.action()
-            elif argumentsCount == 1:
-                self.action(announcement)
-            elif argumentsCount == 2:
-                self.action(announcement, self.announcer)
-            else:
-                raise TypeError("Incompatible signature")
+        if self.handles(type(announcement)) and self.accepts(announcement):
+            self.basicDeliver(announcement)
+
+    def basicDeliver(self, announcement):
+        """Deliver an announcement we already know we handle, answer what the
+        action answered. The limit of self, if any, may drop it.
+
+        """
+        if self.limit is not None and not self.limit.admit():
+            return None
+        return self.invoke(announcement)
+
+    def invokerFor(self, valuable, argumentsCount):
+        """Return a callable taking the announcement and calling valuable with
+        argumentsCount arguments
+
+        """
+        if argumentsCount == 1:
+            return valuable
+        elif argumentsCount == 0:
+            return lambda announcement: valuable()
+        else:
+            return lambda announcement: valuable(announcement, self.announcer)
 
     def makeStrong(self):
         """I am already strong, do nothing
@@ -254,13 +929,14 @@ class AnnouncementSubscription(object):
         """Create a weak subscription equivalent to self and return it
 
         """
-        #XXX Use http://code.activestate.com/recipes/81253/
         subscription = WeakAnnouncementSubscription()
         subscription.announcer = self.announcer
         subscription.announcementClass = self.announcementClass
         subscription.subscriber = self.subscriber
         subscription.action = self.action
-        subscription.subscriber.__announcementsIm = self.action
+        subscription.where = self.where
+        subscription.priority = self.priority
+        subscription.limit = self.limit
         self.announcer.replace(self, subscription)
         return subscription
 
@@ -270,13 +946,41 @@ class AnnouncementSubscription(object):
         """
         return self.announcementClass.handles(announcementClass)
 
+    def accepts(self, announcement):
+        """Return true if the attributes of announcement match the where
+        filter of self, see conditionsOf
+
+        """
+        if self.where is None:
+            return True
+        for attribute, value in self.where:
+            if getattr(announcement, attribute, missing) != value:
+                return False
+        return True
+
+    def subscriberKey(self):
+        """Return the key the registry indexes self under, see subscriberKeyOf
+
+        """
+        return subscriberKeyOf(self.subscriber)
+
+    def handledClasses(self):
+        """Return the classes the registry should index self under
+
+        """
+        if isinstance(self.announcementClass, AnnouncementSet):
+            return tuple(self.announcementClass.announcements)
+        return (self.announcementClass,)
+
     #XXX Python specific methods
 
     def getArgumentsCount(self):
-        """Returns the number of arguments a function takes
+        """Returns the number of arguments a function takes. This inspects the
+        action each time, deliveries use the argumentsCount resolved when the
+        action was set.
 
         """
-        count = len(inspect.getargspec(self.action).args)
+        count = len(getargspec(self.action).args)
         if self.isMethod():
             return count - 1 # self is passed automatically
         else:
@@ -295,32 +999,84 @@ class WeakAnnouncementSubscription(AnnouncementSubscription):
     automatically when the subscriber is unreferenced.
     To switch between subscription types, use makeStrong/makeWeak on the
     subscription returned when initially registering with announcer.
+    Bound methods are referenced with WeakMethod semantics, they live as long
+    as their instance. When the subscriber or the action die the
+    subscription is only marked dead, the registry sweeps dead subscriptions
+    in batches.
 
     """
+    __slots__ = ("weaksubscription", "subscriberFunction", "weakaction",
+            "actionFunction", "weakSubscriberKey")
+
     def __init__(self):
         #super(WeakAnnouncementSubscription, self).__init__()
         self.weaksubscription = None
+        self.subscriberFunction = None
         self.weakaction = None
+        self.actionFunction = None
+        self.where = None
+        self.priority = 0
+        self.sequence = None
+        self.limit = None
 
     @property
     def subscriber(self):
-        return self.weaksubscription()
+        return dereference(self.weaksubscription, self.subscriberFunction)
 
     @subscriber.setter
     def subscriber(self, subscription):
-        self.weaksubscription = weakref.ref(subscription, self.finalize)
+        self.weaksubscription, self.subscriberFunction = \
+                weakReferenceTo(subscription, self.finalize)
+        self.weakSubscriberKey = subscriberKeyOf(subscription)
+
+    def subscriberKey(self):
+        """The subscriber may be gone when we are removed, remember its key
+
+        """
+        return self.weakSubscriberKey
 
     @property
     def action(self):
-        return self.weakaction()
+        return dereference(self.weakaction, self.actionFunction)
 
     @action.setter
     def action(self, valuable):
-        self.weakaction = weakref.ref(valuable, self.finalize)
+        self.argumentsCount = argumentsCountOf(valuable)
+        self.weakaction, self.actionFunction = \
+                weakReferenceTo(valuable, self.finalize)
+
+    def basicDeliver(self, announcement):
+        """Deliver an announcement we already know we handle, the action is
+        looked up each time since we don't want to keep it alive. Bound
+        methods are not rebuilt, their function is called with the instance.
+
+        """
+        target = self.weakaction()
+        if target is None:
+            return
+        if self.limit is not None and not self.limit.admit():
+            return None
+        function = self.actionFunction
+        argumentsCount = self.argumentsCount
+        if function is None:
+            if argumentsCount == 1:
+                return target(announcement)
+            elif argumentsCount == 0:
+                return target()
+            else:
+                return target(announcement, self.announcer)
+        if argumentsCount == 1:
+            return function(target, announcement)
+        elif argumentsCount == 0:
+            return function(target)
+        else:
+            return function(target, announcement, self.announcer)
 
     def finalize(self, wr):
-        print "Finalizing", wr
-        self.announcer.removeSubscription(self)
+        """Called by the garbage collector, don't take locks here
+
+        """
+        self.announcer.registry.markDead(self)
 
     def makeStrong(self):
         """Create a strong subscription equivalent to self and return it
@@ -331,6 +1087,9 @@ class WeakAnnouncementSubscription(AnnouncementSubscription):
         subscription.announcementClass = self.announcementClass
         subscription.subscriber = self.subscriber
         subscription.action = self.action
+        subscription.where = self.where
+        subscription.priority = self.priority
+        subscription.limit = self.limit
         self.announcer.replace(self, subscription)
         return subscription
 
@@ -344,77 +1103,278 @@ class WeakAnnouncementSubscription(AnnouncementSubscription):
 class SubscriptionRegistry(object):
     """The subscription registry is a threadsafe storage for the subscriptions
     to an Announcer.
+    The subscriptions are indexed by subscribed class (every member for
+    AnnouncementSet subscriptions) and by subscriber identity, see
+    subscriberKeyOf. Subscriptions with a where filter are indexed apart, in
+    filtered, by class, by the first attribute of their filter and by its
+    value. Changes update the indexes in place under the lock, a change costs
+    about the number of subscriptions it touches, and bump the generation
+    counter.
+    The subscriptions handling an announcement class, in delivery order, are
+    resolved when delivering and kept in entries until a change to the class
+    or to one of its superclasses drops them. Delivering only reads entries,
+    without taking the lock nor copying the subscriptions. An entry is never
+    modified, except for its tables of filtered subscriptions by value where
+    a change replaces the tuple of its value.
 
     """
     def __init__(self, lock=None):
         super(SubscriptionRegistry, self).__init__()
-        self.subscriptions = set()
         self.lock = lock or threading.Lock()
         self.ignored_exceptions = []
+        self.dead = collections.deque()
+        self.makeIndex()
+
+    def makeIndex(self):
+        """Create the empty indexes and entries
+
+        """
+        self.generation = 0
+        self.members = set()
+        self.subscriptionsByClass = {}
+        self.subscriptionsBySubscriber = {}
+        self.filtered = {}
+        self.entries = {}
+        self.dependents = {}
+        self.listed = None
 
     def __len__(self):
-        return len(self.subscriptions)
+        if self.dead:
+            self.sweep()
+        return len(self.members)
+
+    @property
+    def subscriptions(self):
+        """The tuple of the subscriptions in the order they were made, listed
+        again once per generation
+
+        """
+        listed = self.listed
+        if listed is None or listed[0] != self.generation:
+            with self.protected():
+                listed = self.listed = (self.generation,
+                        tuple(sorted(self.members, key=sequenceOf)))
+        return listed[1]
 
     def numberOfSubscriptions(self):
         return len(self)
 
     def reset(self):
-        self.subscriptions = set()
+        with self.protected():
+            self.rebuild(())
 
     def add(self, subscription):
         with self.protected():
-            self.subscriptions.add(subscription)
+            self.basicSweep()
+            if subscription not in self.members:
+                if subscription.sequence is None:
+                    subscription.sequence = next(sequences)
+                self.watch(subscription)
+                self.basicAdd(subscription)
+                self.generation += 1
         return subscription
 
     def remove(self, subscription):
         with self.protected():
-            if subscription in self.subscriptions:
-                self.subscriptions.remove(subscription)
+            self.basicSweep()
+            if subscription in self.members:
+                self.basicRemove(subscription)
+                self.generation += 1
 
     def removeSubscriber(self, subscriber):
         with self.protected():
-            subscriptions = list(self.subscriptions)
+            self.basicSweep()
+            subscriptions = self.basicSubscriptionsOf(subscriber)
             for subscription in subscriptions:
-                if subscription.subscriber == subscriber:
-                    self.subscriptions.remove(subscription)
+                self.basicRemove(subscription)
+            if subscriptions:
+                self.generation += 1
 
     def replace(self, subscription, newOne):
-        """Note that it will signal an error if subscription is not there
+        """Note that it will signal an error if subscription is not there.
+        newOne takes the place of subscription in the delivery order.
 
         """
         with self.protected():
-            self.subscriptions.remove(subscription)
-            self.subscriptions.add(newOne)
+            self.basicSweep()
+            if subscription not in self.members:
+                raise KeyError(subscription)
+            newOne.sequence = subscription.sequence
+            self.watch(newOne)
+            self.basicRemove(subscription)
+            self.basicAdd(newOne)
+            self.generation += 1
         return newOne
 
     def deliver(self, announcement):
-        with self.protected():
-            subscriptions = list(self.subscriptions)
-        self.deliverTo(announcement, subscriptions, self.ignored_exceptions)
+        if self.dead:
+            self.sweep()
+        subscriptions = self.select(announcement,
+                self.entryFor(type(announcement)))
+        if subscriptions:
+            self.deliverTo(announcement, subscriptions,
+                    self.ignored_exceptions)
 
     def deliverTo(self, announcement, subscriptions, exceptions_that_are_ok):
         """Ensure all the subscriptions are delivered even if some fail. If an
         exception is raised, catch it, continue delivering messages and only when
         all the messages are delivered re-raise in the original context.
+        The subscriptions are expected to handle the announcement, see
+        subscriptionsFor.
+
+        """
+        excep = self.tryDeliverTo(announcement, subscriptions,
+                exceptions_that_are_ok)
+        if excep is not None:
+            reraise(excep)
+
+    def tryDeliverTo(self, announcement, subscriptions, exceptions_that_are_ok):
+        """Deliver to every subscription and return the sys.exc_info() of the
+        last exception not in exceptions_that_are_ok, or None. This is the
+        delivery loop, an Instrumentation replaces it while installed. A
+        subscriber raising StopPropagation ends it.
 
         """
         excep = None
-        for index, subscription in enumerate(subscriptions):
+        for subscription in subscriptions:
             try:
-                subscription.deliver(announcement)
-            except Exception, err:
+                subscription.basicDeliver(announcement)
+            except StopPropagation:
+                break
+            except Exception as err:
                 if not isinstance(err, exceptions_that_are_ok):
                     excep = sys.exc_info()
+        return excep
+
+    def deliverAll(self, announcements, exceptions_that_are_ok):
+        """Deliver each announcement in order, the subscriptions are resolved
+        once per announcement class, when the first announcement of the class
+        comes. Like deliverTo, the last exception not in exceptions_that_are_ok
+        is re-raised after everything was delivered.
+
+        """
+        resolved = {}
+        excep = None
+        count = 0
+        tryDeliverTo = self.tryDeliverTo
+        select = self.select
+        for announcement in announcements:
+            count += 1
+            announcementClass = type(announcement)
+            try:
+                entry = resolved[announcementClass]
+            except KeyError:
+                entry = resolved[announcementClass] = \
+                        self.entryFor(announcementClass)
+            subscriptions = select(announcement, entry)
+            if subscriptions:
+                excep = tryDeliverTo(announcement, subscriptions,
+                        exceptions_that_are_ok) or excep
 
         if excep is not None:
-            raise excep[0], excep[1], excep[2]
+            reraise(excep)
+        return count
+
+    def hasSubscribersFor(self, announcementClass):
+        subscriptions, filters = self.entryFor(announcementClass)
+        return bool(subscriptions or filters)
+
+    def entryFor(self, announcementClass):
+        """Return the entry of announcementClass, see resolve. It is resolved
+        under the lock the first time it is asked for after a change.
+
+        """
+        try:
+            return self.entries[announcementClass]
+        except KeyError:
+            with self.protected():
+                entry = self.entries.get(announcementClass)
+                if entry is None:
+                    entry = self.resolve(announcementClass)
+                    self.entries[announcementClass] = entry
+                    for cls in inspect.getmro(announcementClass):
+                        self.dependents.setdefault(cls,
+                                set()).add(announcementClass)
+                return entry
+
+    def resolve(self, announcementClass):
+        """Collect the subscriptions to announcementClass or any of its
+        superclasses in delivery order, see orderOf. A subscription to an
+        AnnouncementSet is indexed under every member, so it is included only
+        once. Return them with the filters to look up when delivering, a tuple
+        of (attribute, subscriptions by value) pairs. Call it with the lock
+        held.
+
+        """
+        subscriptions = set()
+        filters = []
+        for cls in inspect.getmro(announcementClass):
+            subscriptions.update(self.subscriptionsByClass.get(cls, ()))
+            filters.extend(self.filtered.get(cls, {}).items())
+        return tuple(sorted(subscriptions, key=orderOf)), tuple(filters)
+
+    @staticmethod
+    def select(announcement, entry):
+        """Return the subscriptions of entry, see resolve, that announcement
+        should be delivered to. Only the filtered subscriptions indexed under
+        the values of announcement are looked at, they are merged with the
+        others in delivery order.
+
+        """
+        subscriptions, filters = entry
+        if not filters:
+            return subscriptions
+        matching = []
+        for attribute, subscriptionsByValue in filters:
+            try:
+                candidates = subscriptionsByValue.get(
+                        getattr(announcement, attribute, missing))
+            except TypeError: # Unhashable, nothing can match
+                continue
+            if candidates:
+                matching.extend(subscription for subscription in candidates
+                        if subscription.accepts(announcement))
+        if not matching:
+            return subscriptions
+        if len(filters) > 1:
+            seen = set()
+            matching = [subscription for subscription in matching
+                    if not (subscription in seen or seen.add(subscription))]
+        matching.sort(key=orderOf)
+        if subscriptions and orderOf(subscriptions[-1]) > orderOf(matching[0]):
+            return tuple(sorted(subscriptions + tuple(matching), key=orderOf))
+        return subscriptions + tuple(matching)
+
+    def subscriptionsFor(self, announcementClass):
+        """Return the tuple of subscriptions handling every announcement of
+        announcementClass, leaving out the filtered ones since they depend on
+        the announcement, see subscriptionsTo
+
+        """
+        return self.entryFor(announcementClass)[0]
+
+    def subscriptionsTo(self, announcement):
+        """Return the tuple of subscriptions announcement should be delivered
+        to now
+
+        """
+        return self.select(announcement, self.entryFor(type(announcement)))
 
     def subscriptionsOf(self, subscriber, do):
         with self.protected():
-            subscriptions = self.subscriptions
+            subscriptions = self.basicSubscriptionsOf(subscriber)
         for subscription in subscriptions:
-            if subscription.subscriber == subscriber:
-                do(subscription)
+            do(subscription)
+
+    def basicSubscriptionsOf(self, subscriber):
+        """Return the subscriptions of subscriber in the order they were made,
+        only its own subscriptions are looked at. Call it with the lock held.
+
+        """
+        candidates = self.subscriptionsBySubscriber.get(
+                subscriberKeyOf(subscriber), ())
+        return sorted((subscription for subscription in candidates
+                if subscription.subscriber == subscriber), key=sequenceOf)
 
     def protected(self):
         """Context manager providing thread safe block execution
@@ -422,3 +1382,136 @@ class SubscriptionRegistry(object):
         """
         #XXX
         return self.lock
+
+    def reindex(self):
+        """Index the subscriptions again, an AnnouncementSet we hold
+        subscriptions to has changed
+
+        """
+        with self.protected():
+            self.basicSweep()
+            self.rebuild(self.members)
+
+    def rebuild(self, subscriptions):
+        """Index subscriptions from scratch and drop every entry, call it with
+        the lock held
+
+        """
+        subscriptions = sorted(subscriptions, key=sequenceOf)
+        self.members = set()
+        self.subscriptionsByClass = {}
+        self.subscriptionsBySubscriber = {}
+        self.filtered = {}
+        for subscription in subscriptions:
+            self.basicAdd(subscription)
+        self.entries = {}
+        self.dependents = {}
+        self.generation += 1
+
+    def basicAdd(self, subscription):
+        """Index subscription, call it with the lock held
+
+        """
+        self.members.add(subscription)
+        classes = subscription.handledClasses()
+        if subscription.where is None:
+            for cls in classes:
+                self.subscriptionsByClass.setdefault(cls,
+                        set()).add(subscription)
+            self.invalidate(classes)
+        else:
+            attribute, value = subscription.where[0]
+            for cls in classes:
+                attributes = self.filtered.setdefault(cls, {})
+                if attribute not in attributes:
+                    attributes[attribute] = {}
+                    self.invalidate((cls,))
+                values = attributes[attribute]
+                values[value] = tuple(sorted(values.get(value, ()) +
+                    (subscription,), key=sequenceOf))
+        self.subscriptionsBySubscriber.setdefault(subscription.subscriberKey(),
+                set()).add(subscription)
+
+    def basicRemove(self, subscription):
+        """Remove subscription from the indexes, call it with the lock held
+
+        """
+        self.members.discard(subscription)
+        classes = subscription.handledClasses()
+        if subscription.where is None:
+            for cls in classes:
+                self.discard(self.subscriptionsByClass, cls, subscription)
+            self.invalidate(classes)
+        else:
+            attribute, value = subscription.where[0]
+            for cls in classes:
+                attributes = self.filtered.get(cls, {})
+                values = attributes.get(attribute, {})
+                remaining = tuple(each for each in values.get(value, ())
+                        if each is not subscription)
+                if remaining:
+                    values[value] = remaining
+                    continue
+                values.pop(value, None)
+                if not values:
+                    attributes.pop(attribute, None)
+                    if not attributes:
+                        self.filtered.pop(cls, None)
+                    self.invalidate((cls,))
+        self.discard(self.subscriptionsBySubscriber,
+                subscription.subscriberKey(), subscription)
+
+    @staticmethod
+    def discard(index, key, subscription):
+        subscriptions = index.get(key)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del index[key]
+
+    def invalidate(self, classes):
+        """Drop the entries resolved for classes and their subclasses, call
+        it with the lock held
+
+        """
+        for cls in classes:
+            for dependent in self.dependents.pop(cls, ()):
+                self.entries.pop(dependent, None)
+
+    def watch(self, subscription):
+        """Ask to be reindexed if subscription is to an AnnouncementSet and the
+        set changes
+
+        """
+        if isinstance(subscription.announcementClass, AnnouncementSet):
+            subscription.announcementClass.registries.add(self)
+
+    def markDead(self, subscription):
+        """Remember that subscription died, it will be removed by the next
+        sweep. This is called from weakref callbacks, it doesn't lock.
+
+        """
+        self.dead.append(subscription)
+
+    def sweep(self):
+        """Remove the subscriptions marked dead
+
+        """
+        with self.protected():
+            self.basicSweep()
+
+    def basicSweep(self):
+        """Remove the subscriptions marked dead, call it with the lock held
+
+        """
+        dead = set()
+        while self.dead:
+            try:
+                dead.add(self.dead.popleft())
+            except IndexError:
+                break
+        dead.intersection_update(self.members)
+        for subscription in dead:
+            self.basicRemove(subscription)
+        if dead:
+            self.generation += 1
@@ -0,0 +1,142 @@
+# -*- coding: utf8 -*-
+
+"""This module implements Instrumentation, measuring how long every
+subscription of an Announcer takes to handle its announcements.
+
+    >>> instrumentation = announcer.instrument(Instrumentation(
+    ...     slowThreshold=0.01, onSlow=warnSlow))
+    >>> announcer.announce(Event)
+    >>> instrumentation.statsOf(subscription).maxTime
+
+Installing replaces the delivery loop of the registry, nothing is checked on
+the delivery path while not installed.
+
+"""
+
+import bisect
+import threading
+import timeit
+import sys
+import weakref
+
+from .core import StopPropagation
+
+
+#XXX Upper bounds, in seconds, of the latency histogram buckets. There is an
+#    extra bucket for anything slower than the last one.
+BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+
+
+class SubscriptionStats(object):
+    """What an Instrumentation knows about a subscription
+
+    """
+    def __init__(self, buckets):
+        super(SubscriptionStats, self).__init__()
+        self.buckets = buckets
+        self.calls = 0
+        self.errors = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+
+    def __repr__(self):
+        return "<%s calls=%d errors=%d mean=%.6fs max=%.6fs>" % (
+                type(self).__name__, self.calls, self.errors, self.meanTime,
+                self.maxTime)
+
+    @property
+    def meanTime(self):
+        return self.totalTime / self.calls if self.calls else 0.0
+
+    def record(self, elapsed, failed):
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.totalTime += elapsed
+        if elapsed > self.maxTime:
+            self.maxTime = elapsed
+        self.histogram[bisect.bisect_left(self.buckets, elapsed)] += 1
+
+
+class Instrumentation(object):
+    """Keeps SubscriptionStats for every subscription delivered while
+    installed. When given, onSlow(subscription, announcement, elapsed) is
+    called for deliveries taking more than slowThreshold seconds and
+    exporter(subscription, elapsed, error) after every delivery, to feed a
+    metrics system. Both run in the announcing thread.
+
+    """
+    timer = staticmethod(timeit.default_timer)
+
+    def __init__(self, buckets=BUCKETS, slowThreshold=None, onSlow=None,
+            exporter=None):
+        super(Instrumentation, self).__init__()
+        self.buckets = tuple(buckets)
+        self.slowThreshold = slowThreshold
+        self.onSlow = onSlow
+        self.exporter = exporter
+        self.stats = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def install(self, registry):
+        registry.tryDeliverTo = self.tryDeliverTo
+
+    def uninstall(self, registry):
+        registry.__dict__.pop("tryDeliverTo", None)
+
+    def tryDeliverTo(self, announcement, subscriptions, exceptions_that_are_ok):
+        """SubscriptionRegistry.tryDeliverTo, measuring each delivery
+
+        """
+        excep = None
+        timer = self.timer
+        for subscription in subscriptions:
+            error = None
+            stop = False
+            start = timer()
+            try:
+                subscription.basicDeliver(announcement)
+            except StopPropagation:
+                stop = True
+            except Exception as err:
+                error = err
+                if not isinstance(err, exceptions_that_are_ok):
+                    excep = sys.exc_info()
+            self.record(subscription, announcement, timer() - start, error)
+            if stop:
+                break
+        return excep
+
+    def record(self, subscription, announcement, elapsed, error):
+        with self.lock:
+            stats = self.stats.get(subscription)
+            if stats is None:
+                stats = self.stats[subscription] = \
+                        SubscriptionStats(self.buckets)
+            stats.record(elapsed, error is not None)
+        if self.slowThreshold is not None and elapsed > self.slowThreshold \
+                and self.onSlow is not None:
+            self.onSlow(subscription, announcement, elapsed)
+        if self.exporter is not None:
+            self.exporter(subscription, elapsed, error)
+
+    def statsOf(self, subscription):
+        """Answer the SubscriptionStats of subscription, None if it wasn't
+        delivered anything
+
+        """
+        return self.stats.get(subscription)
+
+    def snapshot(self):
+        """Answer a list of (subscription, stats) pairs, slowest first
+
+        """
+        with self.lock:
+            items = list(self.stats.items())
+        items.sort(key=lambda item: item[1].totalTime, reverse=True)
+        return items
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
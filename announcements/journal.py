@@ -0,0 +1,348 @@
+# -*- coding: utf8 -*-
+
+"""This module implements AnnouncementJournal, recording the announcements of
+some announcers in a directory of memory mapped segment files, and replay,
+announcing them again later.
+
+    >>> journal = AnnouncementJournal("/var/lib/app/journal", announcer)
+    >>> ...
+    >>> journal.close()
+    >>> replay("/var/lib/app/journal", Announcer(), types=(OrderPlaced,),
+    ...     since=yesterday)
+
+Every record is a header, the name of the announcement class and the
+serialized announcement:
+
+    payload size     uint32, little endian
+    checksum         uint32, CRC-32 of everything after it
+    timestamp        float64, seconds since the epoch
+    name size        uint16
+    name             utf8, module:qualified name of the class
+    payload          pickled announcement by default
+
+Segments are preallocated and filled with zeros, a zero size ends them.
+Reading filters by time and class looking only at the headers, the payloads
+of skipped records are not decoded. A record running past the end of its
+segment, torn by a crash, ends the segment too, a record whose checksum
+doesn't match is skipped.
+
+"""
+
+import collections
+import glob
+import importlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+from . import core
+
+
+HEADER = struct.Struct("<IIdH")
+CHECKED = struct.Struct("<dH")
+
+
+class PickleSerializer(object):
+    """pickle, with its highest protocol
+
+    """
+    @staticmethod
+    def dumps(obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    loads = staticmethod(pickle.loads)
+
+
+def nameOf(cls):
+    return "%s:%s" % (cls.__module__, getattr(cls, "__qualname__",
+        cls.__name__))
+
+
+def checksumOf(timestamp, name, payload):
+    checksum = zlib.crc32(CHECKED.pack(timestamp, len(name)))
+    checksum = zlib.crc32(name, checksum)
+    return zlib.crc32(payload, checksum) & 0xffffffff
+
+
+def classNamed(name):
+    """Return the class nameOf answered name for, None if it can't be found
+
+    """
+    module, _, qualname = name.partition(":")
+    try:
+        obj = importlib.import_module(module)
+        for part in qualname.split("."):
+            obj = getattr(obj, part)
+    except (ImportError, AttributeError):
+        return None
+    return obj
+
+
+class Segment(object):
+    """A journal file of size bytes, mapped in memory while written
+
+    """
+    def __init__(self, path, size):
+        super(Segment, self).__init__()
+        self.path = path
+        self.size = size
+        self.position = 0
+        self.file = open(path, "w+b")
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def fits(self, length):
+        return self.position + length <= self.size
+
+    def append(self, record):
+        end = self.position + len(record)
+        self.map[self.position:end] = record
+        self.position = end
+
+    def sync(self):
+        self.map.flush()
+
+    def close(self):
+        """Unmap the segment and cut the unused space
+
+        """
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(self.position)
+        self.file.close()
+
+
+class AnnouncementJournal(object):
+    """Records every announcement of the announcers it watches in segments
+    of segmentSize bytes in directory. Announcements are kept in memory and
+    written batchSize at a time, or when flush is called, so they shouldn't
+    change once announced. When interval is given they are written every
+    interval seconds from a thread instead, announcing only queues them.
+    With sync=True every write is flushed to disk, otherwise that's left to
+    the operating system and to close.
+    serializer is anything with dumps and loads, like PickleSerializer.
+    Announcements it can't serialize are skipped, counted in failures and
+    reported to writeFailed.
+
+    """
+    logger = logging.getLogger("AnnouncementJournal")
+
+    def __init__(self, directory, announcer=None, segmentSize=64 * 1024 * 1024,
+            batchSize=256, sync=False, serializer=PickleSerializer,
+            interval=None):
+        super(AnnouncementJournal, self).__init__()
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.batchSize = batchSize
+        self.sync = sync
+        self.serializer = serializer
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.segment = None
+        self.names = {}
+        self.announcers = []
+        self.recorded = 0
+        self.failures = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        segments = segmentsIn(directory)
+        self.number = int(os.path.basename(segments[-1]).split(".")[0]) \
+                if segments else 0
+        self.interval = interval
+        self.closed = threading.Event()
+        self.writer = None
+        if interval is not None:
+            self.writer = threading.Thread(target=self.writeEvery,
+                    name="AnnouncementJournal")
+            self.writer.daemon = True
+            self.writer.start()
+        if announcer is not None:
+            self.watch(announcer)
+
+    def __repr__(self):
+        return "<%s %s>" % (type(self).__name__, self.directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def watch(self, announcer):
+        """Record the announcements of announcer too
+
+        """
+        announcer.subscribe(core.Announcement, send="record",
+                to=self).makeWeak()
+        self.announcers.append(announcer)
+
+    def unwatch(self, announcer):
+        announcer.unsubscribe(self)
+        self.announcers.remove(announcer)
+
+    def record(self, announcement):
+        self.pending.append((time.time(), announcement))
+        if len(self.pending) >= self.batchSize and self.writer is None:
+            self.flush()
+
+    def writeEvery(self):
+        while not self.closed.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Write the pending announcements
+
+        """
+        failed = []
+        with self.lock:
+            pending = self.pending
+            dumps = self.serializer.dumps
+            written = 0
+            while pending:
+                try:
+                    timestamp, announcement = pending.popleft()
+                except IndexError:
+                    break
+                try:
+                    record = self.encode(timestamp, announcement, dumps)
+                except Exception as err:
+                    failed.append((announcement, err))
+                    continue
+                self.write(record)
+                written += 1
+            self.recorded += written
+            self.failures += len(failed)
+            if self.sync and written:
+                self.segment.sync()
+        for announcement, error in failed:
+            self.writeFailed(announcement, error)
+
+    def writeFailed(self, announcement, error):
+        """Called by flush, in the writer thread if there is one, when
+        announcement couldn't be serialized
+
+        """
+        self.logger.error("Serializing %r failed", announcement,
+                exc_info=(type(error), error, getattr(error,
+                    "__traceback__", None)))
+
+    def encode(self, timestamp, announcement, dumps):
+        cls = type(announcement)
+        try:
+            name = self.names[cls]
+        except KeyError:
+            name = self.names[cls] = nameOf(cls).encode("utf8")
+        payload = dumps(announcement)
+        return HEADER.pack(len(payload), checksumOf(timestamp, name, payload),
+                timestamp, len(name)) + name + payload
+
+    def write(self, record):
+        """Append record to the current segment or to a new one, call it with
+        the lock held
+
+        """
+        if self.segment is None or not self.segment.fits(len(record)):
+            if self.segment is not None:
+                self.segment.close()
+            self.number += 1
+            self.segment = Segment(os.path.join(self.directory,
+                "%012d.journal" % self.number),
+                max(self.segmentSize, len(record)))
+        self.segment.append(record)
+
+    def close(self):
+        """Stop watching, write what is pending and close the current segment
+
+        """
+        for announcer in list(self.announcers):
+            self.unwatch(announcer)
+        self.closed.set()
+        if self.writer is not None:
+            self.writer.join()
+        self.flush()
+        with self.lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+
+
+def segmentsIn(directory):
+    return sorted(glob.glob(os.path.join(directory, "*.journal")))
+
+
+def records(directory, types=None, since=None, until=None,
+        serializer=PickleSerializer):
+    """Answer an iterator on the (timestamp, announcement) records in
+    directory, oldest first. Only announcements of types, or of their
+    subclasses, recorded between since and until are decoded. Segments are
+    read as they are reached.
+
+    """
+    wanted = {}
+    if types is not None:
+        types = tuple(types)
+    for path in segmentsIn(directory):
+        with open(path, "rb") as segment:
+            if not os.fstat(segment.fileno()).st_size:
+                continue
+            view = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for record in recordsIn(view, wanted, types, since, until,
+                        serializer.loads):
+                    yield record
+            finally:
+                view.close()
+
+
+def recordsIn(view, wanted, types, since, until, loads):
+    """Answer an iterator on the records of a segment mapped in view, see
+    records. Checksums are only verified for the records decoded.
+
+    """
+    position = 0
+    end = len(view)
+    while position + HEADER.size <= end:
+        size, checksum, timestamp, nameSize = HEADER.unpack_from(view,
+                position)
+        if not size:
+            return
+        start = position + HEADER.size + nameSize
+        if start + size > end:
+            AnnouncementJournal.logger.warning(
+                    "Incomplete record at %d, ignored", position)
+            return
+        offset, position = position, start + size
+        if since is not None and timestamp < since or \
+                until is not None and timestamp >= until:
+            continue
+        name = view[start - nameSize:start]
+        if types is not None:
+            try:
+                accepted = wanted[name]
+            except KeyError:
+                cls = classNamed(name.decode("utf8", "replace"))
+                accepted = wanted[name] = cls is not None and \
+                        isinstance(cls, type) and issubclass(cls, types)
+            if not accepted:
+                continue
+        payload = view[start:position]
+        if checksumOf(timestamp, name, payload) != checksum:
+            AnnouncementJournal.logger.warning(
+                    "Corrupt record at %d, skipped", offset)
+            continue
+        yield timestamp, loads(payload)
+
+
+def replay(directory, announcer, types=None, since=None, until=None,
+        serializer=PickleSerializer):
+    """Announce the records in directory, see records, with announcer, and
+    return how many were announced. They are read while being announced.
+
+    """
+    return announcer.announceAll(announcement for timestamp, announcement
+            in records(directory, types, since, until, serializer))
@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+
+"""This module implements the limits a subscription can have, checked before
+each delivery to it, see Announcer.subscribe:
+
+    >>> announcer.on(FrameRendered, do=refresh, rate=30)
+    >>> announcer.on(RequestServed, do=stats.record, sample=0.01)
+
+Deliveries a limit doesn't admit are dropped and counted, the action is not
+called.
+
+"""
+
+import random
+import timeit
+
+
+class RateLimit(object):
+    """A token bucket admitting up to rate deliveries per second on average
+    and bursts of up to burst deliveries, rate by default, at least one
+
+    """
+    timer = staticmethod(timeit.default_timer)
+
+    def __init__(self, rate, burst=None):
+        super(RateLimit, self).__init__()
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(max(1, rate if burst is None else burst))
+        self.tokens = self.burst
+        self.last = None
+        self.admitted = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return "<%s %g/s admitted=%d dropped=%d>" % (type(self).__name__,
+                self.rate, self.admitted, self.dropped)
+
+    def admit(self):
+        """Take a token, answer False if there was none
+
+        """
+        #XXX No lock, it would cost more than the rest: deliveries in
+        #    several threads at once may get a few tokens more than the rate.
+        now = self.timer()
+        last = self.last
+        self.last = now
+        tokens = self.tokens
+        if last is not None:
+            tokens += (now - last) * self.rate
+            if tokens > self.burst:
+                tokens = self.burst
+        if tokens >= 1.0:
+            self.tokens = tokens - 1.0
+            self.admitted += 1
+            return True
+        self.tokens = tokens
+        self.dropped += 1
+        return False
+
+
+class Sample(object):
+    """Admits each delivery with probability ratio. seed makes the choice
+    repeatable.
+
+    """
+    def __init__(self, ratio, seed=None):
+        super(Sample, self).__init__()
+        if not 0.0 <= ratio <= 1.0:
+            raise ValueError("ratio must be between 0 and 1")
+        self.ratio = ratio
+        self.random = random.Random(seed).random
+        self.admitted = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return "<%s %g admitted=%d dropped=%d>" % (type(self).__name__,
+                self.ratio, self.admitted, self.dropped)
+
+    def admit(self):
+        #XXX The counters may miss a few concurrent deliveries, it's a sample
+        if self.random() < self.ratio:
+            self.admitted += 1
+            return True
+        self.dropped += 1
+        return False
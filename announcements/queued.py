@@ -0,0 +1,230 @@
+# -*- coding: utf8 -*-
+
+"""This module implements QueuedAnnouncer, an Announcer whose announce only
+puts the announcement in a bounded queue. Dispatcher threads take them from
+there and deliver them to the subscribers. Its queue is a BoundedBuffer, which
+AnnouncementStream and AnnouncementBridge use too.
+
+    >>> announcer = QueuedAnnouncer(maxsize=10000, overflow=DROP_OLDEST)
+    >>> announcer.subscribe(RequestServed, send="record", to=stats)
+    >>> announcer.announce(RequestServed(request))
+    >>> announcer.close()
+
+"""
+
+import collections
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+from . import core
+
+
+BLOCK = "block"
+DROP_NEWEST = "drop-newest"
+DROP_OLDEST = "drop-oldest"
+RAISE = "raise"
+
+
+class BoundedBuffer(object):
+    """Holds up to maxsize items in buffer, put by some threads and taken by
+    others under lock. When it is full the overflow policy decides what
+    basicPut does: BLOCK waits on notFull for room, DROP_NEWEST drops the
+    new item, DROP_OLDEST drops the oldest one and RAISE raises queue.Full.
+    Dropped items are counted in dropped. Nothing is put once closed.
+    Takers notify notFull, putters notEmpty.
+
+    """
+    def __init__(self, maxsize=1024, overflow=BLOCK):
+        super(BoundedBuffer, self).__init__()
+        if overflow not in (BLOCK, DROP_NEWEST, DROP_OLDEST, RAISE):
+            raise ValueError("Unknown overflow policy %r" % (overflow,))
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.buffer = collections.deque()
+        self.lock = threading.Lock()
+        self.notEmpty = threading.Condition(self.lock)
+        self.notFull = threading.Condition(self.lock)
+        self.dropped = 0
+        self.closed = False
+
+    @property
+    def depth(self):
+        """Number of items waiting in the buffer
+
+        """
+        return len(self.buffer)
+
+    def basicPut(self, item):
+        """Append item following the overflow policy, call it with the lock
+        held. Answer whether it was appended, it isn't once closed.
+
+        """
+        if self.closed:
+            return False
+        if len(self.buffer) >= self.maxsize:
+            if self.overflow == BLOCK:
+                while len(self.buffer) >= self.maxsize and not self.closed:
+                    self.notFull.wait()
+                if self.closed:
+                    return False
+            elif self.overflow == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            elif self.overflow == DROP_OLDEST:
+                self.discarded(self.buffer.popleft())
+                self.dropped += 1
+            else:
+                raise queue.Full()
+        self.buffer.append(item)
+        return True
+
+    def discarded(self, item):
+        """Called with the lock held when DROP_OLDEST dropped item
+
+        """
+
+
+class QueuedAnnouncer(BoundedBuffer, core.Announcer):
+    """An announcer delivering from dispatcher threads. When the queue holds
+    maxsize announcements, the overflow policy decides what announce does:
+    BLOCK waits for room, DROP_NEWEST discards the new announcement,
+    DROP_OLDEST discards the oldest queued one and RAISE raises queue.Full.
+    Dropped announcements are counted in dropped.
+    With a single dispatcher announcements are delivered in order. Errors
+    raised by subscribers can't reach the announcing thread, they are counted
+    in failures and passed to dispatchFailed.
+
+    """
+    logger = logging.getLogger("QueuedAnnouncer")
+
+    def __init__(self, maxsize=1024, overflow=BLOCK, dispatchers=1):
+        super(QueuedAnnouncer, self).__init__(maxsize, overflow)
+        self.allDone = threading.Condition(self.lock)
+        self.unfinished = 0
+        self.failures = 0
+        self.dispatchers = []
+        for each in range(dispatchers):
+            thread = threading.Thread(target=self.dispatch,
+                    name="QueuedAnnouncer-%d" % each)
+            thread.daemon = True
+            thread.start()
+            self.dispatchers.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def __len__(self):
+        return self.depth
+
+    def announce(self, announcement):
+        """Queue announcement for delivery and answer it
+
+        """
+        announcement = announcement.asAnnouncement(announcement)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("%r is closed" % (self,))
+            if not self.basicPut(announcement):
+                if self.closed:
+                    raise RuntimeError("%r is closed" % (self,))
+                return announcement
+            self.unfinished += 1
+            self.notEmpty.notify()
+        return announcement
+
+    def discarded(self, announcement):
+        self.unfinished -= 1
+
+    def announceAll(self, announcements):
+        """Queue every announcement, answer how many were announced
+
+        """
+        count = 0
+        for announcement in announcements:
+            self.announce(announcement)
+            count += 1
+        return count
+
+    def dispatch(self):
+        """Deliver queued announcements until closed and empty
+
+        """
+        while True:
+            with self.lock:
+                while not self.buffer and not self.closed:
+                    self.notEmpty.wait()
+                if not self.buffer:
+                    return
+                announcement = self.buffer.popleft()
+                self.notFull.notify()
+            try:
+                if self.parents:
+                    self.chain.deliver(announcement,
+                            tuple(self.ignored_exceptions))
+                else:
+                    self.registry.ignored_exceptions = \
+                            tuple(self.ignored_exceptions)
+                    self.registry.deliver(announcement)
+            except Exception as err:
+                self.failures += 1
+                self.dispatchFailed(announcement, err)
+            finally:
+                with self.lock:
+                    self.unfinished -= 1
+                    if not self.unfinished:
+                        self.allDone.notify_all()
+
+    def dispatchFailed(self, announcement, error):
+        """Called from the dispatcher thread when delivering announcement
+        raised error
+
+        """
+        self.logger.error("Delivering %r failed", announcement,
+                exc_info=True)
+
+    def flush(self, timeout=None):
+        """Wait until every queued announcement is delivered, answer False if
+        timeout seconds passed before
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while self.unfinished:
+                if deadline is None:
+                    self.allDone.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.allDone.wait(remaining)
+        return True
+
+    def close(self, drain=True, timeout=None):
+        """Stop accepting announcements and stop the dispatchers once the queue
+        is empty. If drain is false the queued announcements are dropped.
+
+        """
+        with self.lock:
+            self.closed = True
+            if not drain:
+                self.dropped += len(self.buffer)
+                self.unfinished -= len(self.buffer)
+                self.buffer.clear()
+                if not self.unfinished:
+                    self.allDone.notify_all()
+            self.notEmpty.notify_all()
+            self.notFull.notify_all()
+        for thread in self.dispatchers:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
@@ -0,0 +1,240 @@
+# -*- coding: utf8 -*-
+
+"""This module implements ShardedSubscriptionRegistry, a subscription registry
+split in shards by announcement class, each with its own lock. Threads
+subscribing to unrelated classes don't wait for each other, and a change only
+invalidates what was resolved for the classes of its shard.
+
+    >>> announcer = Announcer(registry=ShardedSubscriptionRegistry(shards=32))
+    >>> announcer.on(OrderPlaced, do=ship)
+
+"""
+
+import contextlib
+import inspect
+
+from . import core
+from .core import sequenceOf
+
+
+class ShardedSubscriptionRegistry(core.SubscriptionRegistry):
+    """A registry keeping the subscriptions to each class in one of shards
+    SubscriptionRegistry, chosen by the hash of the class, and the
+    subscriptions to AnnouncementSets in an extra shard.
+    Delivering merges what the shards of the announcement class, its
+    superclasses and the sets have, in the order a SubscriptionRegistry would
+    deliver: by priority and then in the order they were made. The merge is
+    cached by class and made again when what one of those shards resolved for
+    the class changes. The lock of the registry itself is not used, protected
+    holds the locks of every shard.
+
+    """
+    def __init__(self, shards=16):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = tuple(core.SubscriptionRegistry()
+                for each in range(shards + 1))
+        super(ShardedSubscriptionRegistry, self).__init__()
+
+    def makeIndex(self):
+        """The shards index the subscriptions, self only keeps the merged
+        entries with the entries of the shards they were merged from
+
+        """
+        self.index = {}
+
+    def __len__(self):
+        if self.dead:
+            self.sweep()
+        return sum(len(shard.members) for shard in self.shards)
+
+    def __bool__(self):
+        """Announcer.announce asks before every delivery, stop at the first
+        shard holding subscriptions instead of counting them
+
+        """
+        for shard in self.shards:
+            if shard.members:
+                return True
+        return False
+
+    __nonzero__ = __bool__
+
+    @property
+    def subscriptions(self):
+        subscriptions = []
+        for shard in self.shards:
+            subscriptions.extend(shard.subscriptions)
+        subscriptions.sort(key=sequenceOf)
+        return tuple(subscriptions)
+
+    @property
+    def members(self):
+        members = set()
+        for shard in self.shards:
+            members.update(shard.members)
+        return members
+
+    @property
+    def entries(self):
+        return dict((cls, entry)
+                for cls, (positions, merged, entry) in self.index.items())
+
+    @property
+    def generation(self):
+        return sum(shard.generation for shard in self.shards)
+
+    @contextlib.contextmanager
+    def protected(self):
+        """Hold the lock of every shard, always taken in the same order
+
+        """
+        for shard in self.shards:
+            shard.lock.acquire()
+        try:
+            yield
+        finally:
+            for shard in reversed(self.shards):
+                shard.lock.release()
+
+    def shardOf(self, subscription):
+        announcementClass = subscription.announcementClass
+        if isinstance(announcementClass, core.AnnouncementSet):
+            return self.shards[-1]
+        return self.shards[hash(announcementClass) % (len(self.shards) - 1)]
+
+    def positionsFor(self, announcementClass):
+        """Return the positions of the shards which may hold subscriptions
+        handling announcementClass
+
+        """
+        positions = []
+        for cls in inspect.getmro(announcementClass):
+            position = hash(cls) % (len(self.shards) - 1)
+            if position not in positions:
+                positions.append(position)
+        positions.append(len(self.shards) - 1)
+        return tuple(positions)
+
+    def reset(self):
+        for shard in self.shards:
+            shard.reset()
+        self.index = {}
+
+    def add(self, subscription):
+        return self.shardOf(subscription).add(subscription)
+
+    def remove(self, subscription):
+        self.shardOf(subscription).remove(subscription)
+
+    def removeSubscriber(self, subscriber):
+        for shard in self.shards:
+            shard.removeSubscriber(subscriber)
+
+    def replace(self, subscription, newOne):
+        """Note that it will signal an error if subscription is not there.
+        newOne takes the place of subscription in the delivery order.
+
+        """
+        newOne.sequence = subscription.sequence
+        shard = self.shardOf(subscription)
+        if self.shardOf(newOne) is shard:
+            return shard.replace(subscription, newOne)
+        #XXX Moving between shards takes both locks one after the other,
+        #    an announce in between misses both subscriptions.
+        if subscription not in shard.members:
+            raise KeyError(subscription)
+        shard.remove(subscription)
+        return self.shardOf(newOne).add(newOne)
+
+    def deliver(self, announcement):
+        if self.dead:
+            self.sweep()
+        subscriptions = self.select(announcement,
+                self.entryFor(type(announcement)))
+        if subscriptions:
+            self.deliverTo(announcement, subscriptions,
+                    self.ignored_exceptions)
+
+    def entryFor(self, announcementClass):
+        """Return the merged entry of announcementClass, see
+        SubscriptionRegistry.resolve, reusing the cached one while the entries
+        of its shards are the same
+
+        """
+        try:
+            positions, merged, entry = self.index[announcementClass]
+        except KeyError:
+            positions = self.positionsFor(announcementClass)
+        else:
+            for position, each in zip(positions, merged):
+                if self.shards[position].entryFor(announcementClass) \
+                        is not each:
+                    break
+            else:
+                return entry
+        merged = tuple(self.shards[position].entryFor(announcementClass)
+                for position in positions)
+        entry = self.merge(merged)
+        self.index[announcementClass] = (positions, merged, entry)
+        return entry
+
+    @staticmethod
+    def merge(entries):
+        """Merge the entries of several shards for an announcement class, their
+        subscriptions are sorted again
+
+        """
+        entries = [entry for entry in entries if entry[0] or entry[1]]
+        if not entries:
+            return (), ()
+        if len(entries) == 1:
+            return entries[0]
+        subscriptions = []
+        filters = []
+        for each, eachFilters in entries:
+            subscriptions.extend(each)
+            filters.extend(eachFilters)
+        if len([entry for entry in entries if entry[0]]) > 1:
+            subscriptions.sort(key=core.orderOf)
+        return tuple(subscriptions), tuple(filters)
+
+    def subscriptionsFor(self, announcementClass):
+        return self.entryFor(announcementClass)[0]
+
+    def subscriptionsTo(self, announcement):
+        return self.select(announcement, self.entryFor(type(announcement)))
+
+    def subscriptionsOf(self, subscriber, do):
+        subscriptions = []
+        for shard in self.shards:
+            shard.subscriptionsOf(subscriber, subscriptions.append)
+        subscriptions.sort(key=sequenceOf)
+        for subscription in subscriptions:
+            do(subscription)
+
+    def reindex(self):
+        for shard in self.shards:
+            shard.reindex()
+
+    def markDead(self, subscription):
+        """Called from weakref callbacks, it doesn't lock
+
+        """
+        shard = self.shardOf(subscription)
+        shard.markDead(subscription)
+        self.dead.append(shard)
+
+    def sweep(self):
+        """Remove the subscriptions marked dead, from each shard holding any
+
+        """
+        shards = set()
+        while self.dead:
+            try:
+                shards.add(self.dead.popleft())
+            except IndexError:
+                break
+        for shard in shards:
+            shard.sweep()
+
@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+
+"""This module implements AnnouncementStream, the announcements of a class
+read in a loop instead of delivered to a callback, see Announcer.stream.
+
+    >>> with announcer.stream(OrderPlaced, maxsize=10000) as orders:
+    ...     for order in orders:
+    ...         ship(order)
+
+    >>> with announcer.stream(RequestServed) as requests:
+    ...     while running:
+    ...         stats.recordAll(requests.nextBatch(500, timeout=1.0))
+
+The stream subscribes when it is made and unsubscribes when it is closed.
+Announcements wait for the consumer in a bounded buffer, when it is full the
+overflow policies of BoundedBuffer apply. The asyncio twin is
+announcements.aio.AsyncAnnouncementStream.
+
+"""
+
+import time
+
+from . import core
+from .queued import BoundedBuffer, BLOCK, DROP_NEWEST, DROP_OLDEST, RAISE
+
+
+class AnnouncementStream(BoundedBuffer):
+    """An iterator on the announcements of announcementClass, or of its
+    subclasses, matching where, see Announcer.subscribe. Up to maxsize of them
+    are buffered, the overflow policy decides what happens to the others:
+    BLOCK makes the announcing thread wait for the consumer, so the consumer
+    must be in another thread, DROP_NEWEST and DROP_OLDEST drop announcements
+    and count them in dropped, and RAISE raises queue.Full to the announcer.
+    Iterating blocks until an announcement arrives and stops once the stream
+    is closed and what was buffered is read.
+
+    """
+    def __init__(self, announcer, announcementClass=core.Announcement,
+            maxsize=1024, overflow=DROP_OLDEST, where=None):
+        super(AnnouncementStream, self).__init__(maxsize, overflow)
+        self.announcer = announcer
+        self.subscription = announcer.subscribe(announcementClass, send="put",
+                to=self, where=where)
+
+    def __repr__(self):
+        return "<%s %r%s>" % (type(self).__name__,
+                self.subscription.announcementClass,
+                " closed" if self.closed else "")
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excinfo):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            while not self.buffer and not self.closed:
+                self.notEmpty.wait()
+            return self.take()
+
+    next = __next__ # Python 2
+
+    def put(self, announcement):
+        """Buffer announcement, the subscription of the stream sends it
+
+        """
+        with self.lock:
+            if self.basicPut(announcement):
+                self.arrived()
+
+    def arrived(self):
+        """Called with the lock held when announcements can be read, or the
+        stream was closed
+
+        """
+        self.notEmpty.notify_all()
+
+    def take(self):
+        """Answer the oldest buffered announcement, call it with the lock held
+
+        """
+        if not self.buffer:
+            raise StopIteration()
+        self.notFull.notify()
+        return self.buffer.popleft()
+
+    def takeBatch(self, count):
+        """Answer up to count buffered announcements, oldest first, call it
+        with the lock held
+
+        """
+        batch = []
+        while self.buffer and len(batch) < count:
+            batch.append(self.buffer.popleft())
+        if batch:
+            self.notFull.notify_all()
+        return batch
+
+    def nextBatch(self, count, timeout=None):
+        """Answer up to count announcements, oldest first, waiting up to
+        timeout seconds for the first one, forever if timeout is None. The
+        others are only taken if they are already buffered. Answer an empty
+        list if none arrived in time, or when closed and read.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while not self.buffer and not self.closed:
+                if deadline is None:
+                    self.notEmpty.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.notEmpty.wait(remaining)
+            return self.takeBatch(count)
+
+    def close(self):
+        """Unsubscribe. What is buffered can still be read, announcers
+        waiting for room are released and their announcements dropped.
+
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.notFull.notify_all()
+            self.arrived()
+        self.announcer.removeSubscription(self.subscription)
@@ -7,8 +7,43 @@
 
 
 import unittest
+import inspect
+import weakref
+import collections
+import functools
+import threading
+import time
 import gc
+import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+import pickle
 from .core import *
+from .core import argumentsCountOf, WeakAnnouncementSubscription
+from . import queued
+from .coalescing import CoalescingAnnouncer
+from .instrumentation import Instrumentation
+from .breaker import CircuitBreaker, DeliveryErrors, SubscriptionSuspended, \
+        SubscriptionResumed
+from .view import AnnouncementSpy
+from .sharded import ShardedSubscriptionRegistry
+from .journal import AnnouncementJournal, records, replay, nameOf, segmentsIn
+from .limits import RateLimit, Sample
+from .bridge import AnnouncementBridge, BridgeListener, bridgeTo
+
+try:
+    import asyncio
+    from .aio import AsyncAnnouncer
+except ImportError: # Python 2
+    asyncio = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    from .threaded import ThreadedAnnouncer
+except ImportError: # Python 2 without the futures backport
+    ThreadPoolExecutor = None
 
 
 class AnnouncementMockA(Announcement):
@@ -43,6 +78,233 @@ class AnnouncementSetTest(unittest.TestCase):
         self.assertEqual(len(ann_set), 2)
 
 
+class SubscriptionRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        super(SubscriptionRegistryTest, self).setUp()
+        self.announcer = Announcer()
+        self.registry = self.announcer.registry
+
+    def testSubscriptionsForInOrderMade(self):
+        general = self.announcer.on(AnnouncementMockB, do=lambda: None)
+        specific = self.announcer.on(AnnouncementMockC, do=lambda: None)
+        self.announcer.on(AnnouncementMockA, do=lambda: None)
+        self.assertEqual(self.registry.subscriptionsFor(AnnouncementMockC),
+                (general, specific))
+        self.assertEqual(self.registry.subscriptionsFor(AnnouncementMockB),
+                (general,))
+
+    def testSubscriptionsForSetOnlyOnce(self):
+        subscription = self.announcer.on(AnnouncementMockB + AnnouncementMockC,
+                do=lambda: None)
+        self.assertEqual(self.registry.subscriptionsFor(AnnouncementMockC),
+                (subscription,))
+
+    def testIndexInvalidation(self):
+        counter = []
+        self.announcer.announce(AnnouncementMockA)
+        subscription = self.announcer.on(AnnouncementMockA,
+                do=lambda: counter.append(1))
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(counter), 1)
+        self.announcer.removeSubscription(subscription)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(counter), 1)
+        self.assertEqual(self.registry.subscriptionsFor(AnnouncementMockA), ())
+
+    def testSubscriptionsOf(self):
+
+        class Receiver(object):
+            def do(self):
+                pass
+
+        receiver, other = Receiver(), Receiver()
+        first = self.announcer.on(AnnouncementMockA, do=receiver.do)
+        second = self.announcer.on(AnnouncementMockB, do=receiver.do)
+        self.announcer.on(AnnouncementMockA, do=other.do)
+        found = []
+        self.registry.subscriptionsOf(receiver.do, found.append)
+        self.assertEqual(found, [first, second])
+
+        self.announcer.unsubscribe(receiver.do)
+        self.assertEqual(len(self.registry), 1)
+        found = []
+        self.registry.subscriptionsOf(receiver.do, found.append)
+        self.assertEqual(found, [])
+
+    def testSubscriberIndexAfterReplace(self):
+
+        def do():
+            pass
+
+        self.announcer.on(AnnouncementMockA, do=do).makeWeak()
+        found = []
+        self.registry.subscriptionsOf(do, found.append)
+        self.assertEqual(len(found), 1)
+        self.assertTrue(isinstance(found[0], WeakAnnouncementSubscription))
+        del do, found
+        gc.collect()
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.registry.subscriptionsBySubscriber, {})
+
+    def testSubscribeWhileDelivering(self):
+        """A subscription added while delivering is not delivered the
+        announcement being delivered
+
+        """
+        counter = []
+
+        def subscribeAnother():
+            counter.append(1)
+            self.announcer.on(AnnouncementMockA, do=subscribeAnother)
+
+        self.announcer.on(AnnouncementMockA, do=subscribeAnother)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(counter), 1)
+        self.assertEqual(len(self.registry), 2)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(counter), 3)
+
+    def testUnsubscribeOnlyLooksAtOwnSubscriptions(self):
+        """Unsubscribing compares the subscriber with its own subscriptions
+        only, whatever the number of the others, see benchBulkSubscriptions
+
+        """
+        compared = []
+
+        class Receiver(object):
+            __hash__ = object.__hash__
+
+            def __eq__(self, other):
+                compared.append(self)
+                return self is other
+
+            def do(self):
+                pass
+
+        receivers = [Receiver() for each in range(1000)]
+        for receiver in receivers:
+            self.announcer.subscribe(AnnouncementMockA, send="do",
+                    to=receiver)
+            self.announcer.subscribe(AnnouncementMockB, send="do",
+                    to=receiver)
+        self.announcer.announce(AnnouncementMockA)
+        del compared[:]
+        self.announcer.unsubscribe(receivers[500])
+        self.assertEqual(len(self.registry), 1998)
+        self.assertEqual(len(compared), 2)
+        self.assertTrue(all(each is receivers[500] for each in compared))
+
+
+class SlottedAnnouncementMock(SlottedAnnouncement):
+    """This is a simple test mock.
+
+    """
+    __slots__ = ("value",)
+
+
+class SlotsTest(unittest.TestCase):
+
+    def testSubscriptionsHaveNoDict(self):
+        announcer = Announcer()
+        subscription = announcer.on(AnnouncementMockA, do=lambda: None)
+        self.assertFalse(hasattr(subscription, "__dict__"))
+        self.assertFalse(hasattr(subscription.makeWeak(), "__dict__"))
+
+    def testSlottedAnnouncement(self):
+        received = []
+        announcer = Announcer()
+        announcer.on(Announcement, do=received.append)
+        announcement = announcer.announce(SlottedAnnouncementMock(value=42))
+        self.assertFalse(hasattr(announcement, "__dict__"))
+        self.assertEqual(received[0].value, 42)
+        self.assertTrue("value=42" in repr(announcement))
+        self.assertRaises(AttributeError, setattr, announcement, "other", 1)
+        self.assertTrue(isinstance(announcer.announce(SlottedAnnouncementMock),
+            SlottedAnnouncementMock))
+
+    def testBareAnnouncement(self):
+        """A bare Announcement has no instance dictionary, it can't take
+        attributes, subclasses without __slots__ can. All can be weakly
+        referenced.
+
+        """
+        announcement = Announcement()
+        self.assertRaises(AttributeError, setattr, announcement, "data", 1)
+        self.assertTrue(weakref.ref(announcement)() is announcement)
+        slotted = SlottedAnnouncementMock(value=1)
+        self.assertTrue(weakref.ref(slotted)() is slotted)
+        announcement = AnnouncementMockA()
+        announcement.data = 1
+        self.assertEqual(vars(announcement), {"data": 1})
+
+
+class AnnouncementSetHandlesTest(unittest.TestCase):
+
+    def testHandlesCache(self):
+        ann_set = AnnouncementMockA + AnnouncementMockB
+        self.assertTrue(ann_set.handles(AnnouncementMockC))
+        self.assertFalse(ann_set.handles(Announcement))
+        self.assertEqual(ann_set.handled, {AnnouncementMockC: True,
+            Announcement: False})
+
+    def testAddInvalidates(self):
+        ann_set = AnnouncementMockA + AnnouncementMockC
+        self.assertFalse(ann_set.handles(AnnouncementMockB))
+        ann_set.add(AnnouncementMockB)
+        self.assertTrue(ann_set.handles(AnnouncementMockB))
+
+    def testAddReindexesRegistries(self):
+        announcer = Announcer()
+        received = []
+        ann_set = AnnouncementMockA + AnnouncementMockC
+        subscription = announcer.subscribe(ann_set, do=received.append)
+        announcer.announce(AnnouncementMockB)
+        self.assertEqual(received, [])
+        ann_set += AnnouncementMockB
+        announcer.announce(AnnouncementMockB)
+        self.assertEqual(len(received), 1)
+        announcer.unsubscribe(received.append)
+        self.assertEqual(announcer.registry.subscriptionsByClass, {})
+
+    def testEveryMutatorReindexes(self):
+        announcer = Announcer()
+        received = []
+        ann_set = AnnouncementMockA + AnnouncementMockC
+        announcer.on(ann_set, do=lambda announcement:
+                received.append(type(announcement)))
+
+        def check(*handled):
+            del received[:]
+            for cls in (AnnouncementMockA, AnnouncementMockB,
+                    AnnouncementMockC):
+                announcer.announce(cls)
+            self.assertEqual(received, list(handled))
+            for cls in (AnnouncementMockA, AnnouncementMockB):
+                self.assertEqual(ann_set.handles(cls), cls in handled)
+
+        check(AnnouncementMockA, AnnouncementMockC)
+        ann_set.discard(AnnouncementMockA)
+        check(AnnouncementMockC)
+        ann_set.update([AnnouncementMockA, AnnouncementMockB])
+        check(AnnouncementMockA, AnnouncementMockB, AnnouncementMockC)
+        ann_set.remove(AnnouncementMockB)
+        check(AnnouncementMockA, AnnouncementMockC)
+        ann_set.difference_update([AnnouncementMockC])
+        check(AnnouncementMockA)
+        ann_set.symmetric_difference_update([AnnouncementMockA,
+            AnnouncementMockB])
+        check(AnnouncementMockB, AnnouncementMockC)
+        ann_set.intersection_update([AnnouncementMockA])
+        check()
+        ann_set.add(AnnouncementMockA)
+        self.assertEqual(ann_set.pop(), AnnouncementMockA)
+        check()
+        ann_set.add(AnnouncementMockA)
+        ann_set.clear()
+        check()
+
+
 class AnnouncerTest(unittest.TestCase):
     """test Announcer
 
@@ -201,6 +463,1506 @@ class AnnouncerTest(unittest.TestCase):
         self.assertEqual(len(announcement), 0)
 
 
+class ArgumentsCountTest(unittest.TestCase):
+
+    def testPlainFunctions(self):
+        self.assertEqual(argumentsCountOf(lambda: None), 0)
+        self.assertEqual(argumentsCountOf(lambda ann: None), 1)
+        self.assertEqual(argumentsCountOf(lambda ann, announcer: None), 2)
+
+    def testDefaultsAndVarargs(self):
+        self.assertEqual(argumentsCountOf(lambda ann=None: None), 1)
+        self.assertEqual(argumentsCountOf(lambda a, b=1, c=2: None), 2)
+        self.assertEqual(argumentsCountOf(lambda *args: None), 2)
+        self.assertEqual(argumentsCountOf(lambda ann, *args: None), 2)
+
+    def testPartial(self):
+        partial = functools.partial(lambda a, b, c: None, 1)
+        self.assertEqual(argumentsCountOf(partial), 2)
+        partial = functools.partial(lambda a, ann: None, a=1)
+        self.assertEqual(argumentsCountOf(partial), 1)
+
+    def testCallableObjects(self):
+
+        class Receiver(object):
+            def __call__(self, ann):
+                pass
+
+        self.assertEqual(argumentsCountOf(Receiver()), 1)
+        self.assertEqual(argumentsCountOf(Receiver().__call__), 1)
+        self.assertEqual(argumentsCountOf([].append), 1)
+
+    @unittest.skipIf(not hasattr(inspect, "signature"),
+            "Python 2 builtins have no signature")
+    def testBuiltins(self):
+        received = []
+        self.assertEqual(argumentsCountOf(received.clear), 0)
+        self.assertEqual(argumentsCountOf(received.append), 1)
+        self.assertEqual(argumentsCountOf(len), 1)
+        announcer = Announcer()
+        announcer.on(AnnouncementMockA, do=received.append)
+        announcer.on(AnnouncementMockA, do=received.clear)
+        announcer.announce(AnnouncementMockA)
+        self.assertEqual(received, [])
+
+    def testBadSignatureRejectedOnSubscribe(self):
+        announcer = Announcer()
+        self.assertRaises(TypeError, announcer.on, AnnouncementMockA,
+                do=lambda a, b, c: None)
+        self.assertRaises(TypeError, announcer.on, AnnouncementMockA, do=42)
+        self.assertEqual(len(announcer.registry), 0)
+
+    def testSubscribeListAppend(self):
+        announcer = Announcer()
+        subscriber = []
+        announcer.subscribe(AnnouncementMockA, send="append", to=subscriber)
+        announcement = announcer.announce(AnnouncementMockA)
+        self.assertEqual(subscriber, [announcement])
+
+
+class AnnounceAllTest(unittest.TestCase):
+
+    def setUp(self):
+        super(AnnounceAllTest, self).setUp()
+        self.announcer = Announcer()
+        self.received = []
+
+    def testOrder(self):
+        self.announcer.on(AnnouncementMockA, do=self.received.append)
+        self.announcer.on(AnnouncementMockB, do=self.received.append)
+        announcements = [AnnouncementMockA(), AnnouncementMockC(),
+                AnnouncementMockA(), AnnouncementMockB()]
+        count = self.announcer.announceAll(announcements)
+        self.assertEqual(count, 4)
+        self.assertEqual(len(self.received), 4)
+        for received, announced in zip(self.received, announcements):
+            self.assertTrue(received is announced)
+
+    def testGenerator(self):
+
+        def announcements():
+            for each in range(3):
+                yield AnnouncementMockA
+                self.assertEqual(len(self.received), each + 1)
+
+        self.announcer.on(AnnouncementMockA, do=self.received.append)
+        self.announcer.announceAll(announcements())
+        self.assertEqual(len(self.received), 3)
+
+    def testDeliverAllThenRaise(self):
+
+        def fail(ann):
+            raise ValueError(ann)
+
+        self.announcer.on(AnnouncementMockA, do=fail)
+        self.announcer.on(AnnouncementMockA, do=self.received.append)
+        self.assertRaises(ValueError, self.announcer.announceAll,
+                [AnnouncementMockA, AnnouncementMockA])
+        self.assertEqual(len(self.received), 2)
+        self.announcer.ignored_exceptions.append(ValueError)
+        self.announcer.announceAll([AnnouncementMockA])
+        self.assertEqual(len(self.received), 3)
+
+
+class LazyAnnounceTest(unittest.TestCase):
+
+    def setUp(self):
+        super(LazyAnnounceTest, self).setUp()
+        self.announcer = Announcer()
+        self.built = []
+
+    def factory(self):
+        self.built.append(1)
+        return AnnouncementMockC()
+
+    def testHasSubscribersFor(self):
+        self.assertFalse(self.announcer.hasSubscribersFor(AnnouncementMockB))
+        subscription = self.announcer.on(AnnouncementMockB, do=lambda: None)
+        self.assertTrue(self.announcer.hasSubscribersFor(AnnouncementMockC))
+        self.assertFalse(self.announcer.hasSubscribersFor(AnnouncementMockA))
+        self.announcer.removeSubscription(subscription)
+        self.assertFalse(self.announcer.hasSubscribersFor(AnnouncementMockC))
+        self.announcer.on(AnnouncementMockA + AnnouncementMockC,
+                do=lambda: None, where={"key": 1})
+        self.assertTrue(self.announcer.hasSubscribersFor(AnnouncementMockC))
+
+    def testFactory(self):
+        self.assertEqual(self.announcer.announceLazily(AnnouncementMockC,
+            self.factory), None)
+        self.assertEqual(self.built, [])
+        received = []
+        self.announcer.on(AnnouncementMockB, do=received.append)
+        announcement = self.announcer.announceLazily(AnnouncementMockC,
+                self.factory)
+        self.assertEqual(self.built, [1])
+        self.assertTrue(received[0] is announcement)
+
+    def testRelay(self):
+        """announce takes a single argument, subscribed to another announcer
+        it is passed only the announcement
+
+        """
+        received = []
+        child = Announcer()
+        self.announcer.on(AnnouncementMockA, do=received.append)
+        child.on(AnnouncementMockA, do=self.announcer.announce)
+        announcement = child.announce(AnnouncementMockA)
+        self.assertEqual(received, [announcement])
+
+    def testSharded(self):
+        self.announcer = Announcer(registry=ShardedSubscriptionRegistry())
+        self.assertFalse(self.announcer.hasSubscribersFor(AnnouncementMockC))
+        self.announcer.announceLazily(AnnouncementMockC, self.factory)
+        self.announcer.on(AnnouncementMockB, do=lambda: None)
+        self.assertTrue(self.announcer.hasSubscribersFor(AnnouncementMockC))
+        self.announcer.announceLazily(AnnouncementMockC, self.factory)
+        self.assertEqual(self.built, [1])
+
+    def testQueued(self):
+        received = []
+        with queued.QueuedAnnouncer() as announcer:
+            announcer.announceLazily(AnnouncementMockC, self.factory)
+            announcer.on(AnnouncementMockB, do=received.append)
+            announcer.announceLazily(AnnouncementMockC, self.factory)
+        self.assertEqual(self.built, [1])
+        self.assertEqual(len(received), 1)
+
+
+class FilteredSubscriptionTest(unittest.TestCase):
+
+    def setUp(self):
+        super(FilteredSubscriptionTest, self).setUp()
+        self.announcer = Announcer()
+        self.received = []
+
+    def announcement(self, cls=AnnouncementMockA, **attributes):
+        announcement = cls()
+        for name, value in attributes.items():
+            setattr(announcement, name, value)
+        return announcement
+
+    def testWhere(self):
+        self.announcer.on(AnnouncementMockA, do=self.received.append,
+                where={"key": 1})
+        self.announcer.announce(self.announcement(key=2))
+        self.announcer.announce(self.announcement())
+        self.assertEqual(self.received, [])
+        announcement = self.announcer.announce(self.announcement(key=1))
+        self.assertTrue(self.received[0] is announcement)
+
+    def testSeveralAttributes(self):
+        self.announcer.on(AnnouncementMockA, do=self.received.append,
+                where={"key": 1, "other": "a"})
+        self.announcer.announce(self.announcement(key=1, other="b"))
+        self.announcer.announce(self.announcement(key=1))
+        self.assertEqual(self.received, [])
+        self.announcer.announce(self.announcement(key=1, other="a"))
+        self.assertEqual(len(self.received), 1)
+
+    def testOnlyMatchingAreLookedAt(self):
+        for key in range(1000):
+            self.announcer.on(AnnouncementMockA, do=self.received.append,
+                    where={"key": key})
+        self.announcer.on(AnnouncementMockA, do=self.received.append)
+        announcement = self.announcement(key=7)
+        subscriptions = self.announcer.registry.subscriptionsTo(announcement)
+        self.assertEqual(len(subscriptions), 2)
+        self.assertEqual([s.where for s in subscriptions],
+                [(("key", 7),), None])
+        self.assertEqual(self.announcer.announceAll([announcement,
+            self.announcement(key=-1)]), 2)
+        self.assertEqual(len(self.received), 3)
+
+    def testSubclassesAndSets(self):
+        self.announcer.on(AnnouncementMockB, do=self.received.append,
+                where={"key": 1})
+        self.announcer.subscribe(AnnouncementMockA + AnnouncementMockB,
+                do=self.received.append, where={"key": 1})
+        self.announcer.announce(self.announcement(AnnouncementMockC, key=1))
+        self.assertEqual(len(self.received), 2)
+        self.announcer.announce(self.announcement(AnnouncementMockA, key=1))
+        self.assertEqual(len(self.received), 3)
+
+    def testUnsubscribe(self):
+        self.announcer.on(AnnouncementMockA, do=self.received.append,
+                where={"key": 1})
+        subscription = self.announcer.on(AnnouncementMockA, do=len,
+                where={"key": 1})
+        self.announcer.unsubscribe(self.received.append)
+        self.assertEqual(self.announcer.registry.filtered,
+                {AnnouncementMockA: {"key": {1: (subscription,)}}})
+        self.announcer.removeSubscription(subscription)
+        self.assertEqual(self.announcer.registry.filtered, {})
+        self.announcer.announce(self.announcement(key=1))
+        self.assertEqual(self.received, [])
+
+    def testWeak(self):
+
+        class Receiver(object):
+            def receive(receiver, announcement):
+                self.received.append(announcement)
+
+        receiver = Receiver()
+        subscription = self.announcer.on(AnnouncementMockA,
+                do=receiver.receive, where={"key": 1}).makeWeak()
+        self.assertEqual(subscription.where, (("key", 1),))
+        self.announcer.announce(self.announcement(key=1))
+        self.assertEqual(len(self.received), 1)
+        del receiver
+        gc.collect()
+        self.assertEqual(len(self.announcer.registry), 0)
+        self.assertEqual(self.announcer.registry.filtered, {})
+
+    def testUnhashable(self):
+        self.assertRaises(TypeError, self.announcer.on, AnnouncementMockA,
+                do=self.received.append, where={"key": []})
+        self.announcer.on(AnnouncementMockA, do=self.received.append,
+                where={"key": 1})
+        self.announcer.announce(self.announcement(key=[1]))
+        self.assertEqual(self.received, [])
+
+
+class PriorityTest(unittest.TestCase):
+
+    def setUp(self):
+        super(PriorityTest, self).setUp()
+        self.announcer = Announcer()
+        self.received = []
+
+    def receiver(self, name):
+        return lambda: self.received.append(name)
+
+    def testInsertionOrder(self):
+        for name in range(20):
+            self.announcer.on(AnnouncementMockA, do=self.receiver(name))
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.received, list(range(20)))
+
+    def testPriority(self):
+        self.announcer.on(AnnouncementMockA, do=self.receiver("late"),
+                priority=10)
+        self.announcer.on(AnnouncementMockA, do=self.receiver("default"))
+        self.announcer.on(AnnouncementMockA, do=self.receiver("first"),
+                priority=-1)
+        self.announcer.on(AnnouncementMockA, do=self.receiver("second"),
+                priority=-1)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.received, ["first", "second", "default", "late"])
+
+    def testPriorityAcrossClassesAndFilters(self):
+        self.announcer.on(AnnouncementMockC, do=self.receiver("specific"))
+        self.announcer.on(AnnouncementMockB, do=self.receiver("general"),
+                priority=-1)
+        self.announcer.on(AnnouncementMockC, do=self.receiver("filtered"),
+                where={"key": 1}, priority=-2)
+        announcement = AnnouncementMockC()
+        announcement.key = 1
+        self.announcer.announce(announcement)
+        self.assertEqual(self.received, ["filtered", "general", "specific"])
+
+    def testInsertionOrderAcrossClassesAndFilters(self):
+        self.announcer.on(AnnouncementMockB, do=self.receiver("general"))
+        self.announcer.on(AnnouncementMockC, do=self.receiver("filtered"),
+                where={"key": 1})
+        self.announcer.on(AnnouncementMockC, do=self.receiver("specific"))
+        self.announcer.on(AnnouncementMockB, do=self.receiver("late"),
+                where={"key": 1})
+        self.announcer.on(AnnouncementMockA + AnnouncementMockC,
+                do=self.receiver("set"))
+        announcement = AnnouncementMockC()
+        announcement.key = 1
+        self.announcer.announce(announcement)
+        self.assertEqual(self.received,
+                ["general", "filtered", "specific", "late", "set"])
+
+    def testReplaceKeepsOrder(self):
+        self.announcer.on(AnnouncementMockA, do=self.receiver("first"))
+        self.announcer.on(AnnouncementMockA, do=self.receiver("second"))
+        first = self.announcer.registry.subscriptions[0]
+        weak = first.makeWeak()
+        self.assertTrue(self.announcer.registry.subscriptions[0] is weak)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.received[-2:], ["first", "second"])
+
+    def testStopPropagation(self):
+
+        def stop():
+            self.received.append("stop")
+            raise StopPropagation()
+
+        self.announcer.on(AnnouncementMockA, do=self.receiver("first"),
+                priority=-1)
+        self.announcer.on(AnnouncementMockA, do=stop)
+        self.announcer.on(AnnouncementMockA, do=self.receiver("skipped"))
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.received, ["first", "stop"])
+        self.assertEqual(self.announcer.announceAll([AnnouncementMockA,
+            AnnouncementMockA]), 2)
+        self.assertEqual(self.received.count("skipped"), 0)
+        self.assertEqual(self.received.count("stop"), 3)
+
+    def testStopPropagationInstrumented(self):
+
+        def stop():
+            raise StopPropagation()
+
+        self.announcer.on(AnnouncementMockA, do=self.receiver("first"))
+        stop = self.announcer.on(AnnouncementMockA, do=stop)
+        self.announcer.on(AnnouncementMockA, do=self.receiver("skipped"))
+        instrumentation = self.announcer.instrument()
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.received, ["first"])
+        self.assertEqual(instrumentation.statsOf(stop).errors, 0)
+        self.assertEqual(len(instrumentation.snapshot()), 2)
+
+
+class ForwardingTest(unittest.TestCase):
+
+    def setUp(self):
+        super(ForwardingTest, self).setUp()
+        self.delivered = []
+        self.root = Announcer()
+        self.middle = Announcer()
+        self.leaf = Announcer()
+        self.leaf.forwardTo(self.middle).forwardTo(self.root)
+        for name in ("root", "middle", "leaf"):
+            getattr(self, name).on(AnnouncementMockB,
+                    do=functools.partial(self.record, name))
+
+    def record(self, name, announcement):
+        self.delivered.append(name)
+
+    def testForward(self):
+        self.leaf.announce(AnnouncementMockB)
+        self.assertEqual(self.delivered, ["leaf", "middle", "root"])
+        self.delivered = []
+        self.middle.announce(AnnouncementMockC)
+        self.assertEqual(self.delivered, ["middle", "root"])
+        self.delivered = []
+        self.leaf.announce(AnnouncementMockA)
+        self.assertEqual(self.delivered, [])
+        self.assertFalse(self.leaf.hasSubscribersFor(AnnouncementMockA))
+        self.root.on(AnnouncementMockA, do=self.record)
+        self.assertTrue(self.leaf.hasSubscribersFor(AnnouncementMockA))
+
+    def testChanges(self):
+        self.leaf.announce(AnnouncementMockB)
+        self.root.on(AnnouncementMockB, do=functools.partial(self.record,
+            "late"), priority=-1)
+        self.middle.registry.reset()
+        self.delivered = []
+        self.leaf.announce(AnnouncementMockB)
+        self.assertEqual(self.delivered, ["leaf", "late", "root"])
+        self.middle.stopForwardingTo(self.root)
+        self.delivered = []
+        self.leaf.announce(AnnouncementMockB)
+        self.assertEqual(self.delivered, ["leaf"])
+        self.assertEqual(self.leaf.parents, (self.middle,))
+
+    def testLinks(self):
+        self.assertRaises(ValueError, self.root.forwardTo, self.leaf)
+        self.assertRaises(ValueError, self.root.forwardTo, self.root)
+        self.leaf.forwardTo(self.root)
+        self.leaf.forwardTo(self.root)
+        self.assertEqual(self.leaf.parents, (self.middle, self.root))
+        self.leaf.announce(AnnouncementMockB)
+        # The root is reached twice, it is delivered once
+        self.assertEqual(self.delivered, ["leaf", "middle", "root"])
+
+    def testStaleEntries(self):
+        """A thread which listed the registries before a link was made stores
+        its entries after the link dropped the index
+
+        """
+        chain = self.leaf.chain
+        stale = chain.registriesNow()
+        other = Announcer()
+        other.on(AnnouncementMockB, do=functools.partial(self.record,
+            "other"))
+        self.root.forwardTo(other)
+        chain.registriesNow()
+        chain.registriesNow = lambda: stale
+        chain.entryFor(AnnouncementMockB)
+        del chain.registriesNow
+        self.leaf.announce(AnnouncementMockB)
+        self.assertEqual(self.delivered, ["leaf", "middle", "root", "other"])
+
+    def testFiltersAndFactory(self):
+        received = []
+        self.root.on(SlottedAnnouncementMock, do=received.append,
+                where={"value": 1})
+        self.assertEqual(self.leaf.announceLazily(SlottedAnnouncementMock,
+            lambda: SlottedAnnouncementMock(value=2)).value, 2)
+        self.leaf.announce(SlottedAnnouncementMock(value=1))
+        self.assertEqual([each.value for each in received], [1])
+        self.assertEqual(self.leaf.announceAll([SlottedAnnouncementMock(
+            value=value) for value in (1, 2, 1)] + [AnnouncementMockB()]), 4)
+        self.assertEqual([each.value for each in received], [1, 1, 1])
+        self.assertEqual(self.delivered, ["leaf", "middle", "root"])
+
+    def testErrors(self):
+        def fail(announcement):
+            raise ValueError()
+        self.root.on(AnnouncementMockB, do=fail, priority=-1)
+        self.assertRaises(ValueError, self.leaf.announce, AnnouncementMockB)
+        self.assertEqual(self.delivered, ["leaf", "middle", "root"])
+        self.leaf.ignored_exceptions.append(ValueError)
+        self.leaf.announce(AnnouncementMockB)
+
+    def testRelay(self):
+        """Subscribing announce relays as before
+
+        """
+        other = Announcer()
+        other.on(AnnouncementMockB, do=functools.partial(self.record,
+            "other"))
+        self.leaf.subscribe(Announcement, send="announce", to=other)
+        self.leaf.announce(AnnouncementMockB)
+        self.assertEqual(self.delivered, ["leaf", "other", "middle", "root"])
+
+
+class LimitTest(unittest.TestCase):
+
+    def setUp(self):
+        super(LimitTest, self).setUp()
+        self.announcer = Announcer()
+        self.received = []
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def testRate(self):
+        subscription = self.announcer.on(AnnouncementMockA,
+                do=self.received.append, rate=2)
+        subscription.limit.timer = self.clock
+        for each in range(5):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(self.received), 2)
+        self.now = 0.5
+        for each in range(5):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(self.received), 3)
+        self.now = 60.0
+        for each in range(5):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(self.received), 5)
+        self.assertEqual((subscription.limit.admitted,
+            subscription.limit.dropped), (5, 10))
+
+    def testBurst(self):
+        limit = RateLimit(10, burst=1)
+        limit.timer = self.clock
+        self.assertEqual([limit.admit() for each in range(3)],
+                [True, False, False])
+        self.now = 0.1
+        self.assertTrue(limit.admit())
+
+    def testSample(self):
+        subscription = self.announcer.on(AnnouncementMockA,
+                do=self.received.append, sample=0.25)
+        subscription.limit = Sample(0.25, seed=1)
+        for each in range(2000):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertTrue(400 < len(self.received) < 600)
+        self.assertEqual(subscription.limit.admitted, len(self.received))
+        self.assertEqual(subscription.limit.dropped, 2000 - len(self.received))
+        none = self.announcer.on(AnnouncementMockB, do=self.received.append,
+                sample=0)
+        self.announcer.announce(AnnouncementMockB)
+        self.assertEqual(none.limit.dropped, 1)
+
+    def testWeak(self):
+
+        class Receiver(object):
+            def receive(receiver, announcement):
+                self.received.append(announcement)
+
+        receiver = Receiver()
+        subscription = self.announcer.on(AnnouncementMockA,
+                do=receiver.receive, rate=1).makeWeak()
+        subscription.limit.timer = self.clock
+        self.announcer.announce(AnnouncementMockA)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(subscription.makeStrong().limit.dropped, 1)
+
+    def testArguments(self):
+        self.assertRaises(ValueError, self.announcer.on, AnnouncementMockA,
+                do=self.received.append, burst=3)
+        self.assertRaises(ValueError, self.announcer.on, AnnouncementMockA,
+                do=self.received.append, rate=1, sample=0.5)
+        self.assertRaises(ValueError, self.announcer.on, AnnouncementMockA,
+                do=self.received.append, sample=2)
+        self.assertRaises(ValueError, self.announcer.on, AnnouncementMockA,
+                do=self.received.append, rate=0)
+        self.assertFalse(self.announcer.registry)
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        super(StreamTest, self).setUp()
+        self.announcer = Announcer()
+
+    def announceLater(self, *announcements):
+        thread = threading.Thread(target=self.announcer.announceAll,
+                args=(announcements,))
+        thread.start()
+        return thread
+
+    def testIterate(self):
+        with self.announcer.stream(AnnouncementMockB) as stream:
+            self.announcer.announce(AnnouncementMockA)
+            self.announcer.announce(AnnouncementMockC)
+            self.announcer.announce(AnnouncementMockB)
+            self.assertEqual(len(stream), 2)
+            self.assertEqual(type(next(stream)), AnnouncementMockC)
+            thread = self.announceLater(AnnouncementMockB())
+            self.assertEqual(type(next(stream)), AnnouncementMockB)
+            self.assertEqual(type(next(stream)), AnnouncementMockB)
+            thread.join()
+        self.assertFalse(self.announcer.registry)
+        self.announcer.announce(AnnouncementMockB)
+        self.assertEqual(list(stream), [])
+
+    def testBatches(self):
+        stream = self.announcer.stream(SlottedAnnouncementMock)
+        self.assertEqual(stream.nextBatch(10, timeout=0.01), [])
+        for value in range(5):
+            self.announcer.announce(SlottedAnnouncementMock(value=value))
+        self.assertEqual([each.value for each in stream.nextBatch(3)],
+                [0, 1, 2])
+        self.assertEqual([each.value for each in stream.nextBatch(3)], [3, 4])
+        thread = self.announceLater(SlottedAnnouncementMock(value=5))
+        self.assertEqual([each.value for each in stream.nextBatch(3)], [5])
+        thread.join()
+        stream.close()
+        self.assertEqual(stream.nextBatch(3), [])
+
+    def testOverflow(self):
+        stream = self.announcer.stream(SlottedAnnouncementMock, maxsize=2,
+                where={"value": 1})
+        announcements = [SlottedAnnouncementMock(value=1) for each in range(4)]
+        self.announcer.announceAll(announcements)
+        self.announcer.announce(SlottedAnnouncementMock(value=2))
+        self.assertEqual(stream.dropped, 2)
+        self.assertEqual(stream.nextBatch(5), announcements[2:])
+        stream.close()
+        stream = self.announcer.stream(overflow=queued.RAISE, maxsize=1)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertRaises(queued.queue.Full, self.announcer.announce,
+                AnnouncementMockA)
+        stream.close()
+        self.assertRaises(ValueError, self.announcer.stream, maxsize=0)
+
+    def testBlock(self):
+        stream = self.announcer.stream(SlottedAnnouncementMock,
+                overflow=queued.BLOCK, maxsize=1)
+        thread = self.announceLater(*[SlottedAnnouncementMock(value=value)
+            for value in range(5)])
+        self.assertEqual([next(stream).value for each in range(5)],
+                list(range(5)))
+        thread.join()
+        self.assertEqual(stream.dropped, 0)
+        stream.close()
+
+
+@unittest.skipIf(asyncio is None, "asyncio requires Python 3")
+class AsyncStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        super(AsyncStreamTest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.announcer = Announcer()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        super(AsyncStreamTest, self).tearDown()
+
+    def testIterate(self):
+        stream = self.loop.run_until_complete(
+                self.announcer.asyncStream(AnnouncementMockB).__aenter__())
+        self.assertTrue(stream.__aiter__() is stream)
+        self.announcer.announce(AnnouncementMockC)
+        self.assertEqual(type(self.loop.run_until_complete(
+            stream.__anext__())), AnnouncementMockC)
+        pending = stream.__anext__()
+        self.assertFalse(pending.done())
+        thread = threading.Thread(target=self.announcer.announce,
+                args=(AnnouncementMockB,))
+        thread.start()
+        self.assertEqual(type(self.loop.run_until_complete(pending)),
+                AnnouncementMockB)
+        thread.join()
+        pending = stream.__anext__()
+        self.loop.run_until_complete(stream.__aexit__(None, None, None))
+        self.assertRaises(StopAsyncIteration, self.loop.run_until_complete,
+                pending)
+        self.assertFalse(self.announcer.registry)
+
+    def testBatches(self):
+        stream = self.announcer.asyncStream(SlottedAnnouncementMock,
+                maxsize=3)
+        self.assertEqual(self.loop.run_until_complete(
+            stream.nextBatch(5, timeout=0.01)), [])
+        for value in range(5):
+            self.announcer.announce(SlottedAnnouncementMock(value=value))
+        self.assertEqual(stream.dropped, 2)
+        self.assertEqual([each.value for each in self.loop.run_until_complete(
+            stream.nextBatch(2))], [2, 3])
+        self.assertEqual([each.value for each in self.loop.run_until_complete(
+            stream.nextBatch(2, timeout=1))], [4])
+        stream.close()
+        self.assertRaises(ValueError, self.announcer.asyncStream,
+                overflow=queued.BLOCK)
+
+
+class Work(object):
+    """An awaitable taking a loop iteration, counting how many of them run at
+    the same time
+
+    """
+    def __init__(self, counters):
+        self.counters = counters
+
+    def __await__(self):
+        self.counters["running"] += 1
+        self.counters["max"] = max(self.counters["max"],
+                self.counters["running"])
+        for each in asyncio.sleep(0).__await__():
+            yield each
+        self.counters["running"] -= 1
+        self.counters["done"] += 1
+
+
+@unittest.skipIf(asyncio is None, "asyncio requires Python 3")
+class AsyncAnnouncerTest(unittest.TestCase):
+
+    def setUp(self):
+        super(AsyncAnnouncerTest, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.counters = dict(running=0, max=0, done=0)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        super(AsyncAnnouncerTest, self).tearDown()
+
+    def testConcurrencyLimit(self):
+        announcer = AsyncAnnouncer(concurrency=2)
+        for each in range(5):
+            announcer.on(AnnouncementMockA, do=lambda: Work(self.counters))
+        future = announcer.announce(AnnouncementMockA)
+        announcement = self.loop.run_until_complete(future)
+        self.assertTrue(isinstance(announcement, AnnouncementMockA))
+        self.assertEqual(self.counters["done"], 5)
+        self.assertEqual(self.counters["max"], 2)
+
+    def testSynchronousSubscribersInline(self):
+        announcer = AsyncAnnouncer()
+        received = []
+        announcer.on(AnnouncementMockA, do=received.append)
+        future = announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(received), 1)
+        self.assertTrue(future.done())
+
+    def testErrorsAfterEveryone(self):
+        announcer = AsyncAnnouncer()
+
+        def fail(ann):
+            raise ValueError(ann)
+
+        announcer.on(AnnouncementMockA, do=fail)
+        announcer.on(AnnouncementMockA, do=lambda: Work(self.counters))
+        self.assertRaises(ValueError, self.loop.run_until_complete,
+                announcer.announce(AnnouncementMockA))
+        self.assertEqual(self.counters["done"], 1)
+        announcer.ignored_exceptions.append(ValueError)
+        self.loop.run_until_complete(announcer.announce(AnnouncementMockA))
+        self.assertEqual(self.counters["done"], 2)
+
+    def testAnnounceAll(self):
+        announcer = AsyncAnnouncer(concurrency=1)
+        announcer.on(AnnouncementMockA, do=lambda: Work(self.counters))
+        count = self.loop.run_until_complete(
+                announcer.announceAll([AnnouncementMockA] * 3))
+        self.assertEqual(count, 3)
+        self.assertEqual(self.counters["done"], 3)
+        self.assertEqual(self.counters["max"], 1)
+
+    def testFactory(self):
+        announcer = AsyncAnnouncer()
+        future = announcer.announceLazily(AnnouncementMockA,
+                AnnouncementMockA)
+        self.assertEqual(self.loop.run_until_complete(future), None)
+        announcer.on(AnnouncementMockA, do=lambda: None)
+        future = announcer.announceLazily(AnnouncementMockA,
+                AnnouncementMockA)
+        self.assertTrue(isinstance(self.loop.run_until_complete(future),
+            AnnouncementMockA))
+
+
+@unittest.skipIf(ThreadPoolExecutor is None, "requires concurrent.futures")
+class ThreadedAnnouncerTest(unittest.TestCase):
+
+    def setUp(self):
+        super(ThreadedAnnouncerTest, self).setUp()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(ThreadedAnnouncerTest, self).tearDown()
+
+    def testParallel(self):
+        announcer = ThreadedAnnouncer(self.executor)
+        barrier = threading.Barrier(3, timeout=5)
+        for each in range(3):
+            announcer.on(AnnouncementMockA, do=lambda: barrier.wait())
+        delivery = announcer.announce(AnnouncementMockA)
+        self.assertTrue(isinstance(delivery.result(5), AnnouncementMockA))
+        self.assertTrue(delivery.done())
+
+    def testFactory(self):
+        announcer = ThreadedAnnouncer(self.executor)
+        delivery = announcer.announceLazily(AnnouncementMockA,
+                AnnouncementMockA)
+        self.assertEqual(delivery.result(5), None)
+        announcer.on(AnnouncementMockA, do=lambda: None)
+        delivery = announcer.announceLazily(AnnouncementMockA,
+                AnnouncementMockA)
+        self.assertTrue(isinstance(delivery.result(5), AnnouncementMockA))
+
+    def testExceptions(self):
+        announcer = ThreadedAnnouncer(self.executor)
+
+        def fail(ann):
+            raise ValueError(ann)
+
+        received = []
+        announcer.on(AnnouncementMockA, do=fail)
+        announcer.on(AnnouncementMockA, do=received.append)
+        delivery = announcer.announce(AnnouncementMockA)
+        self.assertRaises(ValueError, delivery.result, 5)
+        self.assertEqual(len(delivery.exceptions()), 1)
+        self.assertEqual(len(received), 1)
+        announcer.ignored_exceptions.append(ValueError)
+        announcer.announce(AnnouncementMockA).result(5)
+
+    def testOrdered(self):
+        announcer = ThreadedAnnouncer(self.executor, ordered=True)
+        received = []
+
+        def slow(ann):
+            time.sleep(0.001 * (len(received) % 3))
+            received.append(ann)
+
+        announcer.on(AnnouncementMockA, do=slow)
+        announcements = [AnnouncementMockA() for each in range(20)]
+        deliveries = [announcer.announce(each) for each in announcements]
+        for delivery in deliveries:
+            delivery.result(5)
+        self.assertEqual([id(each) for each in received],
+                [id(each) for each in announcements])
+        self.assertEqual(announcer.queues, {})
+
+    def testAnnounceAll(self):
+        announcer = ThreadedAnnouncer(self.executor, ordered=True)
+        received = []
+        announcer.on(AnnouncementMockA, do=received.append)
+        delivery = announcer.announceAll([AnnouncementMockA] * 5)
+        self.assertEqual(delivery.result(5), 5)
+        self.assertEqual(len(received), 5)
+
+
+class QueuedAnnouncerTest(unittest.TestCase):
+
+    def setUp(self):
+        super(QueuedAnnouncerTest, self).setUp()
+        self.received = []
+        self.gate = threading.Event()
+
+    def newAnnouncer(self, **kwargs):
+        announcer = queued.QueuedAnnouncer(**kwargs)
+        self.addCleanup(announcer.close, timeout=5)
+        self.addCleanup(self.gate.set)
+        return announcer
+
+    def blocked(self, ann):
+        self.gate.wait(5)
+        self.received.append(ann)
+
+    def testDelivery(self):
+        announcer = self.newAnnouncer()
+        announcer.on(AnnouncementMockA, do=self.received.append)
+        announcements = [announcer.announce(AnnouncementMockA)
+                for each in range(10)]
+        self.assertTrue(announcer.flush(5))
+        self.assertEqual(self.received, announcements)
+        self.assertEqual(announcer.depth, 0)
+
+    def testDropNewest(self):
+        announcer = self.newAnnouncer(maxsize=2, overflow=queued.DROP_NEWEST)
+        announcer.on(AnnouncementMockA, do=self.blocked)
+        first = announcer.announce(AnnouncementMockA)
+        while announcer.depth:
+            time.sleep(0.001)
+        announcements = [announcer.announce(AnnouncementMockA)
+                for each in range(4)]
+        self.assertEqual(announcer.depth, 2)
+        self.assertEqual(announcer.dropped, 2)
+        self.gate.set()
+        self.assertTrue(announcer.flush(5))
+        self.assertEqual(self.received, [first] + announcements[:2])
+
+    def testDropOldest(self):
+        announcer = self.newAnnouncer(maxsize=2, overflow=queued.DROP_OLDEST)
+        announcer.on(AnnouncementMockA, do=self.blocked)
+        first = announcer.announce(AnnouncementMockA)
+        while announcer.depth:
+            time.sleep(0.001)
+        announcements = [announcer.announce(AnnouncementMockA)
+                for each in range(4)]
+        self.assertEqual(announcer.dropped, 2)
+        self.gate.set()
+        self.assertTrue(announcer.flush(5))
+        self.assertEqual(self.received, [first] + announcements[2:])
+
+    def testRaise(self):
+        announcer = self.newAnnouncer(maxsize=1, overflow=queued.RAISE)
+        announcer.on(AnnouncementMockA, do=self.blocked)
+        announcer.announce(AnnouncementMockA)
+        while announcer.depth:
+            time.sleep(0.001)
+        announcer.announce(AnnouncementMockA)
+        self.assertRaises(queued.queue.Full, announcer.announce,
+                AnnouncementMockA)
+        self.gate.set()
+        self.assertTrue(announcer.flush(5))
+
+    def testFailures(self):
+        announcer = self.newAnnouncer()
+        failed = []
+        announcer.dispatchFailed = lambda ann, error: failed.append(error)
+
+        def fail(ann):
+            raise ValueError(ann)
+
+        announcer.on(AnnouncementMockA, do=fail)
+        announcer.announce(AnnouncementMockA)
+        self.assertTrue(announcer.flush(5))
+        self.assertEqual(announcer.failures, 1)
+        self.assertTrue(isinstance(failed[0], ValueError))
+
+    def testClose(self):
+        announcer = self.newAnnouncer()
+        announcer.on(AnnouncementMockA, do=self.received.append)
+        announcer.announceAll([AnnouncementMockA] * 3)
+        announcer.close()
+        self.assertEqual(len(self.received), 3)
+        self.assertRaises(RuntimeError, announcer.announce, AnnouncementMockA)
+        self.assertFalse(any(thread.is_alive()
+            for thread in announcer.dispatchers))
+
+
+class CoalescingAnnouncerTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CoalescingAnnouncerTest, self).setUp()
+        self.received = []
+
+    def testLazily(self):
+        announcer = CoalescingAnnouncer()
+        self.assertEqual(announcer.announceLazily(AnnouncementMockA,
+            AnnouncementMockA), None)
+        announcer.on(AnnouncementMockA, do=self.received.append)
+        announcement = announcer.announceLazily(AnnouncementMockA,
+                AnnouncementMockA)
+        self.assertEqual(announcer.flush(), 1)
+        self.assertEqual(self.received, [announcement])
+
+    def testLastOfEachType(self):
+        announcer = CoalescingAnnouncer()
+        announcer.on(Announcement, do=self.received.append)
+        announcements = [announcer.announce(AnnouncementMockA()),
+                announcer.announce(AnnouncementMockB()),
+                announcer.announce(AnnouncementMockA())]
+        self.assertEqual(self.received, [])
+        self.assertEqual(announcer.coalesced, 1)
+        self.assertEqual(announcer.flush(), 2)
+        self.assertEqual([id(each) for each in self.received],
+                [id(announcements[1]), id(announcements[2])])
+        self.assertEqual(announcer.flush(), 0)
+
+    def testKeyAndMerge(self):
+
+        def merge(pending, new):
+            new.value = pending.value + new.value
+            return new
+
+        announcer = CoalescingAnnouncer(key=lambda ann: ann.key, merge=merge)
+        announcer.on(AnnouncementMockA, do=self.received.append)
+        for key, value in [(1, 1), (2, 10), (1, 2), (1, 3)]:
+            announcement = AnnouncementMockA()
+            announcement.key, announcement.value = key, value
+            announcer.announce(announcement)
+        announcer.flush()
+        self.assertEqual([(each.key, each.value) for each in self.received],
+                [(2, 10), (1, 6)])
+
+    def testWindow(self):
+        announcer = CoalescingAnnouncer(window=0.01)
+        delivered = threading.Event()
+        announcer.on(AnnouncementMockA, do=lambda ann: (
+            self.received.append(ann), delivered.set()))
+        for each in range(100):
+            announcer.announce(AnnouncementMockA)
+        self.assertTrue(delivered.wait(5))
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(len(announcer), 0)
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.announcer = Announcer()
+
+    def testStats(self):
+
+        def fail():
+            raise ValueError()
+
+        ok = self.announcer.on(AnnouncementMockA, do=lambda: None)
+        failing = self.announcer.on(AnnouncementMockA, do=fail)
+        instrumentation = self.announcer.instrument()
+        for each in range(3):
+            self.assertRaises(ValueError, self.announcer.announce,
+                    AnnouncementMockA)
+        self.assertEqual(instrumentation.statsOf(ok).calls, 3)
+        self.assertEqual(instrumentation.statsOf(ok).errors, 0)
+        self.assertEqual(instrumentation.statsOf(failing).errors, 3)
+        self.assertEqual(sum(instrumentation.statsOf(ok).histogram), 3)
+        self.assertEqual(len(instrumentation.snapshot()), 2)
+
+    def testSlowAndExporter(self):
+        slow, exported = [], []
+        instrumentation = Instrumentation(slowThreshold=0.5,
+                onSlow=lambda *args: slow.append(args),
+                exporter=lambda *args: exported.append(args))
+        now = [0.0]
+
+        def tick():
+            now[0] += 1.0
+            return now[0]
+
+        #XXX A real timer may measure 0.0 for such a short call
+        instrumentation.timer = tick
+        subscription = self.announcer.on(AnnouncementMockA, do=lambda: None)
+        self.announcer.instrument(instrumentation)
+        announcement = self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(slow, [(subscription, announcement, 1.0)])
+        self.assertEqual(exported, [(subscription, 1.0, None)])
+
+    def testUninstrument(self):
+        self.announcer.on(AnnouncementMockA, do=lambda: None)
+        instrumentation = self.announcer.instrument()
+        self.announcer.uninstrument()
+        self.assertFalse("tryDeliverTo" in vars(self.announcer.registry))
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(instrumentation.snapshot(), [])
+
+    def testAnnounceAll(self):
+        subscription = self.announcer.on(AnnouncementMockA, do=lambda: None)
+        instrumentation = self.announcer.instrument()
+        self.announcer.announceAll([AnnouncementMockA] * 4)
+        self.assertEqual(instrumentation.statsOf(subscription).calls, 4)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTest, self).setUp()
+        self.announcer = Announcer()
+        self.now = [0.0]
+        self.breaker = CircuitBreaker(maxFailures=2, cooldown=10)
+        self.breaker.timer = lambda: self.now[0]
+        self.announcer.protect(self.breaker)
+        self.notified = []
+        self.announcer.on(SubscriptionSuspended + SubscriptionResumed,
+                do=self.notified.append)
+        self.calls = []
+        self.failing = True
+
+    def flaky(self):
+        self.calls.append(1)
+        if self.failing:
+            raise ValueError()
+
+    def testSuspendAndResume(self):
+        subscription = self.announcer.on(AnnouncementMockA, do=self.flaky)
+        for each in range(2):
+            self.assertRaises(ValueError, self.announcer.announce,
+                    AnnouncementMockA)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.breaker.suspended(), [subscription])
+        self.assertEqual(type(self.notified[0]), SubscriptionSuspended)
+        self.assertEqual(self.notified[0].reason, "failures")
+        self.assertTrue(self.notified[0].subscription is subscription)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.breaker.stateOf(subscription).skipped, 1)
+        self.now[0] = 11
+        self.assertRaises(ValueError, self.announcer.announce,
+                AnnouncementMockA)
+        self.assertEqual(len(self.notified), 2)
+        self.assertEqual(self.breaker.stateOf(subscription).suspensions, 2)
+        self.now[0] = 22
+        self.failing = False
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(type(self.notified[-1]), SubscriptionResumed)
+        self.assertEqual(self.breaker.suspended(), [])
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(self.calls), 5)
+
+    def testLatencyBudget(self):
+        breaker = CircuitBreaker(budget=0.5, maxOverruns=2)
+        breaker.timer = lambda: self.now[0]
+
+        def slow():
+            self.now[0] += 1
+
+        subscription = self.announcer.on(AnnouncementMockA, do=slow)
+        self.announcer.protect(breaker)
+        self.announcer.announceAll([AnnouncementMockA] * 3)
+        self.assertEqual(breaker.stateOf(subscription).totalOverruns, 2)
+        self.assertEqual(breaker.stateOf(subscription).skipped, 1)
+        self.assertEqual(self.notified[0].reason, "latency")
+
+    def testCollectErrors(self):
+
+        def other():
+            raise KeyError()
+
+        self.announcer.on(AnnouncementMockA, do=self.flaky)
+        self.announcer.on(AnnouncementMockA, do=other)
+        try:
+            self.announcer.announce(AnnouncementMockA)
+        except DeliveryErrors as err:
+            self.assertEqual([type(error) for error in err.errors],
+                    [ValueError, KeyError])
+        else:
+            self.fail("DeliveryErrors not raised")
+
+    def testIgnoredExceptions(self):
+        subscription = self.announcer.on(AnnouncementMockA, do=self.flaky)
+        self.announcer.ignored_exceptions.append(ValueError)
+        for each in range(3):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.breaker.stateOf(subscription), None)
+        self.breaker.countIgnored = True
+        for each in range(2):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(self.breaker.suspended(), [subscription])
+
+    def testUnprotect(self):
+        self.assertRaises(ValueError, self.announcer.instrument)
+        self.announcer.on(AnnouncementMockA, do=self.flaky)
+        self.breaker.maxFailures = 1
+        self.assertRaises(ValueError, self.announcer.announce,
+                AnnouncementMockA)
+        self.announcer.unprotect()
+        self.assertFalse("tryDeliverTo" in vars(self.announcer.registry))
+        self.assertRaises(ValueError, self.announcer.announce,
+                AnnouncementMockA)
+        self.assertEqual(len(self.calls), 2)
+
+
+class AnnouncementSpyTest(unittest.TestCase):
+
+    def setUp(self):
+        super(AnnouncementSpyTest, self).setUp()
+        self.announcer = Announcer()
+
+    def testRingBuffer(self):
+        spy = AnnouncementSpy(self.announcer, capacity=3)
+        announcements = [self.announcer.announce(AnnouncementMockA)
+                for each in range(5)]
+        self.assertEqual(spy.index, 5)
+        self.assertEqual(len(spy), 3)
+        self.assertEqual(spy.announcements, announcements[2:])
+        spy.clear()
+        self.assertEqual(spy.announcements, [])
+
+    def testRecentByType(self):
+        spy = AnnouncementSpy(self.announcer, capacity=4)
+        announcements = [self.announcer.announce(each) for each in
+                (AnnouncementMockA, AnnouncementMockB, AnnouncementMockC,
+                    AnnouncementMockA, AnnouncementMockC, AnnouncementMockB)]
+        self.assertEqual(spy.recent(AnnouncementMockA), [announcements[3]])
+        self.assertEqual(spy.recent(AnnouncementMockB),
+                [announcements[2], announcements[4], announcements[5]])
+        self.assertEqual(spy.recent(AnnouncementMockC, count=1),
+                [announcements[4]])
+        self.assertEqual(spy.recent(count=2), announcements[-2:])
+        self.assertEqual(sum(len(each) for each in spy.byType.values()), 4)
+
+    def testSampling(self):
+        spy = AnnouncementSpy(self.announcer, sampleEvery=3)
+        for each in range(9):
+            self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(spy), 3)
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        super(JournalTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.announcer = Announcer()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(JournalTest, self).tearDown()
+
+    def testRecordAndReplay(self):
+        with AnnouncementJournal(self.directory, self.announcer,
+                batchSize=2) as journal:
+            self.announcer.announce(SlottedAnnouncementMock(value=1))
+            self.announcer.announce(AnnouncementMockA)
+            self.announcer.announce(SlottedAnnouncementMock(value=2))
+            self.assertEqual(journal.recorded, 2)
+        self.assertEqual(journal.recorded, 3)
+        self.announcer.announce(AnnouncementMockA)
+        found = [announcement for timestamp, announcement
+                in records(self.directory)]
+        self.assertEqual([type(each) for each in found],
+                [SlottedAnnouncementMock, AnnouncementMockA,
+                    SlottedAnnouncementMock])
+        self.assertEqual(found[2].value, 2)
+        received = []
+        other = Announcer()
+        other.on(SlottedAnnouncementMock, do=received.append)
+        self.assertEqual(replay(self.directory, other,
+            types=[SlottedAnnouncementMock]), 2)
+        self.assertEqual([each.value for each in received], [1, 2])
+
+    def testSegments(self):
+        journal = AnnouncementJournal(self.directory, self.announcer,
+                segmentSize=256, batchSize=1)
+        for value in range(20):
+            self.announcer.announce(SlottedAnnouncementMock(value=value))
+        journal.close()
+        journal = AnnouncementJournal(self.directory, self.announcer)
+        self.announcer.announce(SlottedAnnouncementMock(value=20))
+        journal.close()
+        segments = sorted(os.listdir(self.directory))
+        self.assertTrue(len(segments) > 2)
+        self.assertEqual([announcement.value for timestamp, announcement
+            in records(self.directory)], list(range(21)))
+
+    def testBackgroundWriter(self):
+        journal = AnnouncementJournal(self.directory, self.announcer,
+                interval=0.01)
+        self.announcer.announce(SlottedAnnouncementMock(value=1))
+        for each in range(500):
+            if journal.recorded:
+                break
+            time.sleep(0.01)
+        self.assertEqual(journal.recorded, 1)
+        self.announcer.announce(SlottedAnnouncementMock(value=2))
+        journal.close()
+        self.assertFalse(journal.writer.is_alive())
+        self.assertEqual(len(list(records(self.directory))), 2)
+
+    def testFilters(self):
+        journal = AnnouncementJournal(self.directory)
+        journal.pending.extend([(1.0, AnnouncementMockA()),
+            (2.0, AnnouncementMockB()), (3.0, AnnouncementMockC())])
+        journal.close()
+        self.assertEqual([type(announcement) for timestamp, announcement
+            in records(self.directory, types=(AnnouncementMockB,))],
+            [AnnouncementMockB, AnnouncementMockC])
+        self.assertEqual([timestamp for timestamp, announcement
+            in records(self.directory, since=2.0, until=3.0)], [2.0])
+        self.assertEqual(list(records(self.directory, since=4.0)), [])
+
+    def testUnserializable(self):
+
+        class Journal(AnnouncementJournal):
+            def writeFailed(journal, announcement, error):
+                failed.append(announcement)
+
+        failed = []
+        journal = Journal(self.directory, self.announcer, batchSize=1)
+        self.announcer.announce(SlottedAnnouncementMock(value=1))
+        self.announcer.announce(SlottedAnnouncementMock(value=lambda: None))
+        self.announcer.announce(SlottedAnnouncementMock(value=2))
+        journal.close()
+        self.assertEqual((journal.recorded, journal.failures), (2, 1))
+        self.assertEqual(len(failed), 1)
+        journal = Journal(self.directory, self.announcer, interval=0.01)
+        self.announcer.announce(SlottedAnnouncementMock(value=lambda: None))
+        self.assertTrue(waitFor(lambda: journal.failures))
+        self.announcer.announce(SlottedAnnouncementMock(value=3))
+        self.assertTrue(waitFor(lambda: journal.recorded))
+        self.assertTrue(journal.writer.is_alive())
+        journal.close()
+        self.assertEqual([announcement.value for timestamp, announcement
+            in records(self.directory)], [1, 2, 3])
+
+    def recordValues(self, *values):
+        journal = AnnouncementJournal(self.directory, self.announcer)
+        for value in values:
+            self.announcer.announce(SlottedAnnouncementMock(value=value))
+        journal.close()
+        segment, = segmentsIn(self.directory)
+        return segment
+
+    def testTornRecord(self):
+        segment = self.recordValues(1, 2, 3)
+        with open(segment, "r+b") as file:
+            file.truncate(os.path.getsize(segment) - 5)
+        self.assertEqual([announcement.value for timestamp, announcement
+            in records(self.directory)], [1, 2])
+
+    def testCorruptRecord(self):
+        segment = self.recordValues(1, 2, 3)
+        with open(segment, "r+b") as file:
+            data = file.read()
+            middle = len(data) // 2
+            file.seek(middle)
+            file.write(b"\xff" if data[middle:middle + 1] != b"\xff"
+                    else b"\x00")
+        self.assertEqual([announcement.value for timestamp, announcement
+            in records(self.directory)], [1, 3])
+
+
+def waitFor(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+class GatedConnection(object):
+    """A connection whose writes wait for gate. The peer at the other end
+    sends nothing, it closes once it read close.
+
+    """
+    def __init__(self):
+        self.gate = threading.Event()
+        self.closing = threading.Event()
+        self.closed = threading.Event()
+        self.written = []
+
+    def send_bytes(self, data):
+        self.gate.wait()
+        self.written.append(data)
+        if pickle.loads(data) == ("close", None):
+            self.closing.set()
+
+    def recv_bytes(self):
+        self.closing.wait()
+        return pickle.dumps(("close", None))
+
+    def close(self):
+        self.closed.set()
+
+
+def echo(address):
+    """Run in a child process by BridgeTest, answer every AnnouncementMockA
+    with an AnnouncementMockB
+
+    """
+    announcer = Announcer()
+    announcer.on(AnnouncementMockA,
+            do=lambda announcement: announcer.announce(AnnouncementMockB))
+    bridge = bridgeTo(announcer, address, types=(AnnouncementMockB,))
+    bridge.receiver.join()
+    bridge.close()
+
+
+def hold(connection):
+    """Run in a child process by BridgeTest, keep connection open until
+    killed
+
+    """
+    time.sleep(60)
+
+
+class BridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        super(BridgeTest, self).setUp()
+        self.announcer = Announcer()
+        self.other = Announcer()
+        self.bridges = []
+
+    def tearDown(self):
+        for bridge in self.bridges:
+            bridge.close(timeout=5)
+        super(BridgeTest, self).tearDown()
+
+    def bridge(self, announcer, connection, **options):
+        bridge = AnnouncementBridge(announcer, connection, **options)
+        self.bridges.append(bridge)
+        return bridge
+
+    def testForward(self):
+        received = []
+        local = []
+        self.other.on(AnnouncementMockB, do=received.append)
+        self.announcer.on(AnnouncementMockB, do=local.append)
+        left, right = multiprocessing.Pipe()
+        bridge = self.bridge(self.announcer, left, batchSize=2)
+        self.bridge(self.other, right)
+        self.assertTrue(bridge.ready.wait(5))
+        self.announcer.announce(AnnouncementMockA)
+        for value in range(5):
+            self.announcer.announce(AnnouncementMockC)
+        self.assertTrue(waitFor(lambda: len(received) == 5))
+        self.assertTrue(all(type(each) is AnnouncementMockC
+            for each in received))
+        self.assertEqual(bridge.filtered, 1)
+        self.assertEqual(bridge.sent, 5)
+        # What was relayed isn't forwarded back
+        time.sleep(0.05)
+        self.assertEqual(len(local), 5)
+
+    def testInterestChanges(self):
+        received = []
+        left, right = multiprocessing.Pipe()
+        bridge = self.bridge(self.announcer, left, refresh=0.01)
+        self.bridge(self.other, right, refresh=0.01)
+        self.assertTrue(bridge.ready.wait(5))
+        self.assertFalse(bridge.wants(AnnouncementMockA))
+        self.other.on(AnnouncementMockA, do=received.append)
+        self.assertTrue(waitFor(lambda: bridge.wants(AnnouncementMockA)))
+        self.announcer.announce(AnnouncementMockA)
+        self.assertTrue(waitFor(lambda: received))
+        self.other.unsubscribe(received.append)
+        self.assertTrue(waitFor(lambda: not bridge.wants(AnnouncementMockA)))
+
+    def testOverflow(self):
+        connection = GatedConnection()
+        bridge = self.bridge(self.announcer, connection, maxsize=2,
+                overflow=queued.DROP_NEWEST, batchSize=10)
+        bridge.interestChanged([nameOf(SlottedAnnouncementMock)])
+        # The sender waits for the gate to tell what announcer subscribes to
+        for value in range(4):
+            self.announcer.announce(SlottedAnnouncementMock(value=value))
+        self.assertEqual(bridge.depth, 2)
+        self.assertEqual(bridge.dropped, 2)
+        connection.gate.set()
+        bridge.close(timeout=5)
+        self.assertFalse(bridge.sender.is_alive() or bridge.receiver.is_alive())
+        self.assertTrue(connection.closed.is_set())
+        batches = [pickle.loads(data) for data in connection.written]
+        self.assertEqual([[each.value for each in payload]
+            for kind, payload in batches if kind == "announcements"],
+            [[0, 1]])
+        self.assertEqual(batches[-1], ("close", None))
+
+    def testPeerKilled(self):
+        left, right = multiprocessing.Pipe()
+        peer = multiprocessing.Process(target=hold, args=(right,))
+        peer.start()
+        right.close()
+        bridge = self.bridge(self.announcer, left, refresh=0.01)
+        self.announcer.on(AnnouncementMockA, do=lambda: None)
+        time.sleep(0.05)
+        peer.terminate()
+        peer.join(5)
+        # Both threads close the bridge, neither waits for the other
+        self.assertTrue(waitFor(lambda: not (bridge.sender.is_alive() or
+            bridge.receiver.is_alive())))
+        self.assertTrue(bridge.closed)
+        self.assertTrue(left.closed)
+        bridge.close(timeout=5)
+
+    def testHub(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        address = os.path.join(directory, "announcements.sock")
+        listener = BridgeListener(self.announcer, address, refresh=0.01)
+        self.addCleanup(listener.close, timeout=5)
+        workers = [Announcer() for each in range(3)]
+        for worker in workers:
+            self.bridges.append(bridgeTo(worker, address, refresh=0.01))
+        received = [[] for worker in workers]
+        workers[1].on(AnnouncementMockA, do=received[1].append)
+        workers[2].on(AnnouncementMockB, do=received[2].append)
+        bridge = self.bridges[0]
+        self.assertTrue(waitFor(lambda: bridge.wants(AnnouncementMockA) and
+            bridge.wants(AnnouncementMockC)))
+        workers[0].on(AnnouncementMockA, do=received[0].append)
+        workers[0].announce(AnnouncementMockA)
+        workers[0].announce(AnnouncementMockC)
+        self.assertTrue(waitFor(lambda: received[1] and received[2]))
+        self.assertEqual([type(each) for each in received[1]],
+                [AnnouncementMockA])
+        self.assertEqual([type(each) for each in received[2]],
+                [AnnouncementMockC])
+        # Nothing comes back to the worker announcing
+        time.sleep(0.05)
+        self.assertEqual(len(received[0]), 1)
+
+    def testAuthkey(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        address = os.path.join(directory, "announcements.sock")
+        listener = BridgeListener(self.announcer, address, authkey=b"secret")
+        self.addCleanup(listener.close, timeout=5)
+        self.assertEqual(os.stat(address).st_mode & 0o777, 0o600)
+        self.assertRaises(multiprocessing.AuthenticationError, bridgeTo,
+                self.other, address, authkey=b"guess")
+        received = []
+        self.announcer.on(AnnouncementMockA, do=received.append)
+        bridge = bridgeTo(self.other, address, authkey=b"secret")
+        self.bridges.append(bridge)
+        self.assertTrue(waitFor(lambda: bridge.wants(AnnouncementMockA)))
+        self.other.announce(AnnouncementMockA)
+        self.assertTrue(waitFor(lambda: received))
+        self.assertEqual(len(listener.peers), 1)
+
+    def testUnknownNames(self):
+        connection = GatedConnection()
+        bridge = self.bridge(self.announcer, connection,
+                types=(AnnouncementMockB,))
+        bridge.interestChanged(["os:system", "announcements.nowhere:Nothing",
+            nameOf(AnnouncementMockA), nameOf(AnnouncementMockC),
+            nameOf(Announcement)])
+        self.assertEqual(bridge.peer[0], (AnnouncementMockC, Announcement))
+        self.assertFalse("announcements.nowhere" in sys.modules)
+        self.assertTrue(bridge.wants(AnnouncementMockB))
+        connection.gate.set()
+
+    def testProcesses(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        address = os.path.join(directory, "announcements.sock")
+        received = []
+        self.announcer.on(AnnouncementMockB, do=received.append)
+        listener = BridgeListener(self.announcer, address,
+                types=(AnnouncementMockA,))
+        child = multiprocessing.Process(target=echo, args=(address,))
+        child.start()
+        try:
+            self.assertTrue(waitFor(lambda: listener.peers and
+                listener.peers[0].wants(AnnouncementMockA)))
+            self.announcer.announce(AnnouncementMockA)
+            self.assertTrue(waitFor(lambda: received))
+        finally:
+            listener.close(timeout=5)
+            child.join(5)
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(type(received[0]), AnnouncementMockB)
+
+
 class WeakAnnouncerTest(AnnouncerTest):
 
     def setUp(self):
@@ -251,3 +2013,153 @@ class WeakAnnouncerTest(AnnouncerTest):
         subscription = self.announcer.subscribe(AnnouncementMockA, send="do",
                 to=receiver).makeWeak()
         self.assertTrue(receiver is subscription.subscriber)
+
+    def testWeakBoundMethod(self):
+
+        class Receiver(object):
+            def do(self, announcement):
+                announcement.value += 1
+
+        receiver = Receiver()
+        announcement = AnnouncementMockA()
+        announcement.value = 0
+        self.announcer.subscribe(AnnouncementMockA,
+                do=receiver.do).makeWeak()
+        gc.collect()
+        self.announcer.announce(announcement)
+        self.assertEqual(announcement.value, 1)
+        self.assertFalse(hasattr(receiver, "_AnnouncementSubscription__announcementsIm"))
+        del receiver
+        gc.collect()
+        self.announcer.announce(announcement)
+        self.assertEqual(announcement.value, 1)
+        self.assertEqual(len(self.announcer.registry), 0)
+
+    def testWeakBuiltinMethod(self):
+        received = collections.deque()
+        self.announcer.subscribe(AnnouncementMockA, send="append",
+                to=received).makeWeak()
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(received), 1)
+        del received
+        gc.collect()
+        self.assertEqual(len(self.announcer.registry), 0)
+
+    def testWeakUnreferenceable(self):
+        subscription = self.announcer.subscribe(AnnouncementMockA,
+                send="append", to=[])
+        self.assertRaises(TypeError, subscription.makeWeak)
+
+    def testBatchedSweep(self):
+
+        class Receiver(object):
+            def do(self):
+                pass
+
+        receivers = [Receiver() for each in range(10)]
+        for receiver in receivers:
+            self.announcer.subscribe(AnnouncementMockA, send="do",
+                    to=receiver).makeWeak()
+        registry = self.announcer.registry
+        generation = registry.generation
+        del receivers, receiver
+        gc.collect()
+        self.assertTrue(registry.dead)
+        self.assertEqual(registry.generation, generation)
+        self.announcer.announce(AnnouncementMockA)
+        self.assertEqual(len(registry.dead), 0)
+        self.assertEqual(registry.generation, generation + 1)
+        self.assertEqual(len(registry), 0)
+
+
+class ShardedAnnouncerTest(WeakAnnouncerTest):
+
+    def newAnnouncer(self):
+        return Announcer(registry=ShardedSubscriptionRegistry(shards=4))
+
+    def testOrderAcrossShards(self):
+        received = []
+        classes = [type("Sharded%d" % each, (AnnouncementMockA,), {})
+                for each in range(8)]
+        for cls in [AnnouncementMockA] + classes:
+            self.announcer.on(cls, do=functools.partial(received.append, cls))
+        self.announcer.on(AnnouncementMockA + AnnouncementMockB,
+                do=functools.partial(received.append, "set"))
+        self.announcer.on(AnnouncementMockA,
+                do=functools.partial(received.append, "first"), priority=-1)
+        self.announcer.announce(classes[3])
+        self.assertEqual(received, ["first", AnnouncementMockA, classes[3],
+            "set"])
+        self.assertEqual(len(self.announcer.registry), 11)
+        self.assertEqual(self.announcer.registry.subscriptionsTo(classes[3]()),
+                self.announcer.registry.subscriptionsFor(classes[3]))
+
+    def testMergeInvalidation(self):
+        received = []
+        announcer = self.announcer
+        announcer.on(AnnouncementMockC, do=received.append)
+        announcer.announce(AnnouncementMockC)
+        subscription = announcer.on(AnnouncementMockB, do=received.append)
+        announcer.announce(AnnouncementMockC)
+        self.assertEqual(len(received), 3)
+        announcer.removeSubscription(subscription)
+        ann_set = AnnouncementMockA + AnnouncementMockB
+        announcer.on(ann_set, do=received.append)
+        announcer.announce(AnnouncementMockC)
+        self.assertEqual(len(received), 5)
+
+    def testInheritedInterface(self):
+        registry = self.announcer.registry
+        subscription = self.announcer.on(AnnouncementMockA, do=lambda: None)
+        setSubscription = self.announcer.on(
+                AnnouncementMockA + AnnouncementMockB, do=lambda: None)
+        self.assertEqual(registry.members,
+                set([subscription, setSubscription]))
+        self.assertEqual(registry.ignored_exceptions, [])
+        self.assertFalse(registry.dead)
+        with registry.protected():
+            for shard in registry.shards:
+                self.assertFalse(shard.lock.acquire(False))
+        for shard in registry.shards:
+            self.assertTrue(shard.lock.acquire(False))
+            shard.lock.release()
+        registry.entryFor(AnnouncementMockA)
+        self.assertEqual(list(registry.entries), [AnnouncementMockA])
+        registry.reset()
+        self.assertEqual(registry.entries, {})
+        self.assertEqual(registry.members, set())
+
+    def testStress(self):
+        """Threads subscribing, announcing and unsubscribing their own classes
+        while others announce a common one
+
+        """
+        registry = self.announcer.registry
+        errors = []
+        common = []
+        self.announcer.on(AnnouncementMockA, do=lambda: common.append(1))
+
+        def work(number):
+            try:
+                cls = type("Stress%d" % number, (AnnouncementMockA,), {})
+                received = []
+                for each in range(200):
+                    subscription = self.announcer.on(cls, do=received.append)
+                    self.announcer.announce(cls)
+                    self.announcer.removeSubscription(subscription)
+                    self.announcer.announce(cls)
+                    self.announcer.announce(AnnouncementMockA)
+                if len(received) != 200:
+                    errors.append((number, len(received)))
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=work, args=(number,))
+                for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(registry), 1)
+        self.assertEqual(len(common), 8 * 200 * 3)
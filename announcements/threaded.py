@@ -0,0 +1,171 @@
+# -*- coding: utf8 -*-
+
+"""This module implements ThreadedAnnouncer, an Announcer delivering in
+parallel through a concurrent.futures executor. In Python 2 it requires the
+futures backport.
+
+    >>> executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    >>> announcer = ThreadedAnnouncer(executor, ordered=True)
+    >>> announcer.subscribe(Changed, send="save", to=store)
+    >>> announcer.announce(Changed).result()
+
+"""
+
+import collections
+import threading
+from concurrent import futures
+
+from . import core
+
+
+class ThreadedAnnouncer(core.Announcer):
+    """An announcer submitting each subscription to executor instead of calling
+    them one after the other. announce answers a Delivery handle, callers can
+    wait on it or not.
+    When ordered is true every subscription receives the announcements in the
+    order they were announced, a subscription never runs twice at the same
+    time. Subscriptions are submitted by priority, but they run concurrently,
+    StopPropagation can't skip the others and is not reported as an error.
+
+    """
+    def __init__(self, executor, ordered=False):
+        super(ThreadedAnnouncer, self).__init__()
+        self.executor = executor
+        self.ordered = ordered
+        self.queues = {}
+        self.queuesLock = threading.Lock()
+
+    def announce(self, announcement):
+        """Submit the deliveries of announcement and answer a Delivery
+
+        """
+        announcement = announcement.asAnnouncement(announcement)
+        pending = self.submitAll(announcement,
+                self.subscriptionsTo(announcement), [])
+        return Delivery(announcement, pending, tuple(self.ignored_exceptions))
+
+    def announceLazily(self, announcementClass, factory):
+        """See Announcer.announceLazily, the Delivery answers None if factory
+        wasn't called
+
+        """
+        if not self.hasSubscribersFor(announcementClass):
+            return Delivery(None, [], tuple(self.ignored_exceptions))
+        return self.announce(factory())
+
+    def announceAll(self, announcements):
+        """Submit the deliveries of every announcement. The Delivery answers
+        the number of announcements.
+
+        """
+        subscriptionsTo = self.chain.subscriptionsTo if self.parents \
+                else self.registry.subscriptionsTo
+        pending = []
+        count = 0
+        for announcement in announcements:
+            announcement = announcement.asAnnouncement(announcement)
+            self.submitAll(announcement,
+                    subscriptionsTo(announcement), pending)
+            count += 1
+        return Delivery(count, pending, tuple(self.ignored_exceptions))
+
+    def submitAll(self, announcement, subscriptions, pending):
+        submit = self.submitOrdered if self.ordered else self.submit
+        for subscription in subscriptions:
+            pending.append(submit(subscription, announcement))
+        return pending
+
+    def submit(self, subscription, announcement):
+        return self.executor.submit(subscription.basicDeliver, announcement)
+
+    def submitOrdered(self, subscription, announcement):
+        """Queue the delivery after the ones pending for subscription, and
+        start draining them if nobody is doing it
+
+        """
+        future = futures.Future()
+        with self.queuesLock:
+            queue = self.queues.get(subscription)
+            start = queue is None
+            if start:
+                queue = self.queues[subscription] = collections.deque()
+            queue.append((announcement, future))
+        if start:
+            try:
+                self.executor.submit(self.drain, subscription, queue)
+            except Exception as err:
+                with self.queuesLock:
+                    del self.queues[subscription]
+                for announcement, each in queue:
+                    each.set_exception(err)
+                raise
+        return future
+
+    def drain(self, subscription, queue):
+        while True:
+            with self.queuesLock:
+                if not queue:
+                    del self.queues[subscription]
+                    return
+                announcement, future = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = subscription.basicDeliver(announcement)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+
+class Delivery(object):
+    """A handle on the deliveries of an announce. result waits for every
+    subscription and, as Announcer.announce does, raises the last error not in
+    exceptions_that_are_ok.
+
+    """
+    def __init__(self, result, futures, exceptions_that_are_ok):
+        super(Delivery, self).__init__()
+        self.futures = futures
+        self.exceptions_that_are_ok = exceptions_that_are_ok
+        self._result = result
+
+    def __repr__(self):
+        return "<%s %s, %d deliveries>" % (type(self).__name__,
+                "done" if self.done() else "pending", len(self.futures))
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def wait(self, timeout=None):
+        """Wait until every delivery is done, answer False on timeout
+
+        """
+        notDone = futures.wait(self.futures, timeout).not_done
+        return not notDone
+
+    def exceptions(self, timeout=None):
+        """Answer the errors raised by subscribers, skipping cancelled
+        deliveries and the exceptions that are ok
+
+        """
+        if not self.wait(timeout):
+            raise futures.TimeoutError()
+        errors = []
+        for future in self.futures:
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None and not isinstance(error,
+                    (core.StopPropagation,) + self.exceptions_that_are_ok):
+                errors.append(error)
+        return errors
+
+    def result(self, timeout=None):
+        """Wait for every delivery and answer the announcement
+
+        """
+        errors = self.exceptions(timeout)
+        if errors:
+            raise errors[-1]
+        return self._result
@@ -5,34 +5,102 @@ published by an announcer.
 
 """
 
-import core
+from . import core
+import collections
 import logging
+import threading
 
 
 class AnnouncementSpy(object):
-    """A class logging every announcement
+    """A class logging every announcement. Only the last capacity
+    announcements are kept, in a ring buffer, and they are also indexed by
+    type, see recent. With sampleEvery=n only one of every n announcements is
+    recorded. Announcements are logged at INFO level, formatted only if the
+    logger is enabled for it; configuring logging is up to the application.
 
     """
-    logging.basicConfig(level=logging.INFO)
     logger = logging.getLogger("AnnouncementSpy")
 
-    def __init__(self, announcer):
-
+    def __init__(self, announcer, capacity=1000, sampleEvery=1):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.sampleEvery = sampleEvery
+        self.lock = threading.Lock()
+        self.clear()
         self._announcer = None
         self.announcer = announcer
-        self.announcements = []
-        self.index = 0
 
     def __repr__(self):
         return "<AnnouncementSpy announcer=%s>" % self.announcer
 
+    def __len__(self):
+        return min(self.index, self.capacity)
+
     def clear(self):
-        self.announcements = []
+        self.buffer = [None] * self.capacity
+        self.byType = {}
+        self.index = 0
+        self.seen = 0
+
+    @property
+    def announcements(self):
+        """The recorded announcements, oldest first
+
+        """
+        with self.lock:
+            start = self.index % self.capacity
+            if self.index < self.capacity:
+                entries = self.buffer[:self.index]
+            else:
+                entries = self.buffer[start:] + self.buffer[:start]
+        return [announcement for sequence, announcement in entries]
 
     def announce(self, announcement):
-        self.announcements.append(announcement)
-        self.index = len(self.announcements)
-        self.logger.info("%s: IncommingEvent=%s", self.announcer, announcement)
+        self.seen += 1
+        if self.sampleEvery > 1 and self.seen % self.sampleEvery:
+            return
+        with self.lock:
+            position = self.index % self.capacity
+            evicted = self.buffer[position]
+            if evicted is not None:
+                evictedType = type(evicted[1])
+                entries = self.byType[evictedType]
+                entries.popleft()
+                if not entries:
+                    del self.byType[evictedType]
+            entry = (self.index, announcement)
+            self.buffer[position] = entry
+            entries = self.byType.get(type(announcement))
+            if entries is None:
+                entries = self.byType[type(announcement)] = collections.deque()
+            entries.append(entry)
+            self.index += 1
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("%s: IncommingEvent=%s", self.announcer,
+                    announcement)
+
+    def recent(self, announcementClass=None, count=None):
+        """Answer the last count recorded announcements, oldest first. When
+        announcementClass is given, only those of that class or its
+        subclasses; that looks only at the recorded types, not at every
+        announcement.
+
+        """
+        if announcementClass is None:
+            announcements = self.announcements
+        else:
+            with self.lock:
+                entries = []
+                for cls, byType in self.byType.items():
+                    if issubclass(cls, announcementClass):
+                        entries.extend(byType)
+            entries.sort(key=lambda entry: entry[0])
+            announcements = [announcement for sequence, announcement
+                    in entries]
+        if count is not None:
+            announcements = announcements[-count:] if count else []
+        return announcements
 
     @property
     def announcer(self):
@@ -40,9 +108,8 @@ class AnnouncementSpy(object):
 
     @announcer.setter
     def announcer(self, announcer):
-        if self._announcer:
+        if self._announcer is not None:
             self._announcer.unsubscribe(self)
         self._announcer = announcer
         self._announcer.subscribe(core.Announcement, send="announce",
                 to=self).makeWeak()
-